@@ -0,0 +1,307 @@
+"""
+Per stage throughput of the build over one or more plain .xml dumps.
+
+    python -m benchmarks.bench                      # the two bundled samples
+    python -m benchmarks.bench --output before.json data/en.sample.xml
+    python -m benchmarks.bench --repeat 3 --stages extract render -- synthetic.xml
+
+Pages are read in batches and every batch goes through the stages one after
+the other, each stage with its own cumulative timer, so a dump of millions of
+pages (see benchmarks.gendump) is benchmarked in bounded memory. Every run is
+a fresh process, so its peak RSS is the peak of that run alone. With --repeat
+the fastest run of each stage is reported.
+"""
+
+import argparse
+import bz2
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List
+
+from wikitextparser import WikiText
+
+from wiktionary2dict.app import iter_page_tuples
+from wiktionary2dict.collation import merge_collisions, sort_key
+from wiktionary2dict.extsort import ExternalSorter
+from wiktionary2dict.renderer import RENDERERS, gen_html
+from wiktionary2dict.stats import peak_rss
+from wiktionary2dict.writemdict.writemdict import COMPRESSION_TYPES, ZLIB_STRATEGIES, MDictWriter
+
+STAGES = [
+    # decompressing a .bz2 copy of the dump
+    'bz2',
+    # <page> elements -> Page tuples, what parse_wiktionary iterates
+    'extract',
+    # WikiText() of every word page
+    'wikitext',
+    # gen_html() of those WikiTexts
+    'gen_html',
+    # the --renderer the records are made with
+    'render',
+    # collation.sort_key(), ExternalSorter.add() and the sorted iteration
+    # through collation.merge_collisions()
+    'sort',
+    # MDictWriter.add() and commit(), which build the key blocks
+    'mdict_add',
+    # MDictWriter.write(), the second pass that compresses the records into the file
+    'write',
+]
+
+_MB = 1000 * 1000
+
+
+class Stage(object):
+    def __init__(self):
+        self.seconds = 0.0
+        self.pages = 0
+        self.bytes = 0
+
+    def report(self) -> Dict:
+        seconds = self.seconds if self.seconds > 0 else float('nan')
+        return {
+            'seconds': round(self.seconds, 6),
+            'pages': self.pages,
+            'bytes': self.bytes,
+            'pages_per_s': round(self.pages / seconds, 1),
+            'mb_per_s': round(self.bytes / _MB / seconds, 3),
+        }
+
+
+def _bench_bz2(path: str, tmp_dir: str, stage: Stage):
+    compressed = os.path.join(tmp_dir, os.path.basename(path) + '.bz2')
+    with open(path, 'rb') as f, bz2.open(compressed, 'wb') as out:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            out.write(chunk)
+
+    start = time.perf_counter()
+    with bz2.open(compressed, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            stage.bytes += len(chunk)
+    stage.seconds += time.perf_counter() - start
+    os.remove(compressed)
+
+
+def bench_dump(
+    path: str,
+    stages: List[str],
+    reader: str = 'etree',
+    renderer: str = 'headings',
+    batch_size: int = 1024,
+    block_size: int = 64 * 1024,
+    sort_memory: int = 256,
+    compression: str = 'zlib',
+    compression_level: int = -1,
+    compression_strategy: str = 'default',
+    compress_threads: int = 1,
+    dedup: bool = False,
+) -> Dict:
+    """
+    Runs the stages over the dump at path and returns their reports plus the
+    peak RSS of the run. bz2, wikitext and gen_html only run when they are
+    selected, the others feed each other and always run, unselected ones
+    are left out of the report. With dedup the report has the number of
+    records replaced by links and the bytes that saved before compression.
+    """
+
+    timers = {name: Stage() for name in STAGES}
+    render = RENDERERS[renderer]()
+    tmp_dir = tempfile.mkdtemp(prefix='wiktionary2dict-bench-')
+    dict_file = os.path.join(tmp_dir, 'bench.mdx')
+
+    if 'bz2' in stages:
+        _bench_bz2(path, tmp_dir, timers['bz2'])
+
+    sorter = ExternalSorter(sort_memory * 1024 * 1024, tmp_dir)
+    pages = iter_page_tuples(path, reader)
+    while True:
+        stage = timers['extract']
+        start = time.perf_counter()
+        batch = list(itertools.islice(pages, batch_size))
+        stage.seconds += time.perf_counter() - start
+        if len(batch) == 0:
+            break
+        stage.pages += len(batch)
+
+        words = [page for page in batch if page.ns == '0' and (page.text is not None or page.redirect is not None)]
+        texts = [page.text for page in words if page.redirect is None]
+        text_bytes = sum(len(text.encode()) for text in texts)
+
+        if 'wikitext' in stages or 'gen_html' in stages:
+            stage = timers['wikitext']
+            start = time.perf_counter()
+            ws = [WikiText(text) for text in texts]
+            stage.seconds += time.perf_counter() - start
+            stage.pages += len(texts)
+            stage.bytes += text_bytes
+
+            if 'gen_html' in stages:
+                stage = timers['gen_html']
+                start = time.perf_counter()
+                for w in ws:
+                    gen_html(w)
+                stage.seconds += time.perf_counter() - start
+                stage.pages += len(ws)
+                stage.bytes += text_bytes
+            del ws
+
+        stage = timers['render']
+        start = time.perf_counter()
+        records = [render(page.title, page.text, page.redirect) for page in words]
+        stage.seconds += time.perf_counter() - start
+        stage.pages += len(words)
+        stage.bytes += text_bytes
+
+        stage = timers['sort']
+        start = time.perf_counter()
+        keys = [sort_key(page.title.encode()) for page in words]
+        for key, record in zip(keys, records):
+            sorter.add(key, record)
+        stage.seconds += time.perf_counter() - start
+        stage.pages += len(words)
+        stage.bytes += sum(len(key) + len(record) for key, record in zip(keys, records))
+
+    with tempfile.TemporaryFile(dir=tmp_dir) as output_key_blocks:
+        writer = MDictWriter(
+            title='bench',
+            description='bench',
+            output_key_blocks=output_key_blocks,
+            is_mdd=False,
+            block_size=block_size,
+            compression_type=COMPRESSION_TYPES[compression],
+            compression_level=compression_level,
+            compression_strategy=ZLIB_STRATEGIES[compression_strategy],
+            compress_threads=compress_threads,
+            dedup=dedup,
+        )
+
+        # the sorted iteration and the writer interleave, the writer's share
+        # is timed around each add() and taken out of the sort
+        add = timers['mdict_add']
+        start = time.perf_counter()
+        for key, record in merge_collisions(sorter):
+            add_start = time.perf_counter()
+            writer.add({key: record})
+            add.seconds += time.perf_counter() - add_start
+            add.pages += 1
+            add.bytes += len(key) + len(record)
+        add_start = time.perf_counter()
+        writer.commit()
+        add.seconds += time.perf_counter() - add_start
+        timers['sort'].seconds += time.perf_counter() - start - add.seconds
+
+        write = timers['write']
+        start = time.perf_counter()
+        with open(dict_file, 'wb') as output:
+            writer.write(output, (record for _, record in merge_collisions(sorter)))
+        write.seconds += time.perf_counter() - start
+        write.pages = add.pages
+        write.bytes = os.path.getsize(dict_file)
+        sorter.close()
+    timers['extract'].bytes = os.path.getsize(path)
+    if 'bz2' in stages:
+        timers['bz2'].pages = timers['extract'].pages
+
+    os.remove(dict_file)
+    os.rmdir(tmp_dir)
+
+    result = {
+        'stages': {name: timers[name].report() for name in STAGES if name in stages},
+        'peak_rss_mb': round(peak_rss() / _MB, 1),
+    }
+    if dedup:
+        result['shared_records'] = writer.shared_records
+        result['shared_uncompressed_bytes'] = writer.shared_uncompressed_bytes
+    return result
+
+
+def _fastest(runs: List[Dict]) -> Dict:
+    best = dict(runs[0])
+    best['stages'] = {
+        name: min((run['stages'][name] for run in runs), key=lambda stage: stage['seconds'])
+        for name in runs[0]['stages']
+    }
+    best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+    return best
+
+
+def _commit() -> str | None:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.bench')
+    parser.add_argument('dumps', nargs='*', default=['data/en.sample.xml', 'data/zh.sample.xml'],
+                        help='plain .xml dumps, the bundled samples by default')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='runs per dump, the fastest of each stage is reported')
+    parser.add_argument('--reader', choices=['etree', 'pulldom'], default='etree')
+    parser.add_argument('--renderer', choices=list(RENDERERS), default='headings')
+    parser.add_argument('--batch-size', type=int, default=1024,
+                        help='pages read before they go through the other stages')
+    parser.add_argument('--block-size', type=int, default=64 * 1024)
+    parser.add_argument('--sort-memory', type=int, default=256, help='MiB')
+    parser.add_argument('--compression', choices=list(COMPRESSION_TYPES), default='zlib')
+    parser.add_argument('--compression-level', type=int, default=-1)
+    parser.add_argument('--compression-strategy', choices=list(ZLIB_STRATEGIES), default='default')
+    parser.add_argument('--compress-threads', type=int, default=1)
+    parser.add_argument('--dedup', action='store_true',
+                        help='records identical to an earlier one are replaced by a link to its key')
+    parser.add_argument('--output', help='json file for the results, stdout by default')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    assert (args.repeat > 0)
+    for path in args.dumps:
+        assert (path.endswith('.xml') and os.path.isfile(path))
+
+    results = {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'args': {name: value for name, value in vars(args).items() if name not in ('dumps', 'output')},
+        'dumps': {},
+    }
+
+    # one fresh process per run, ru_maxrss never goes down within a process
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn'), max_tasks_per_child=1) as executor:
+        for path in args.dumps:
+            runs = [
+                executor.submit(
+                    bench_dump, path, args.stages, args.reader, args.renderer,
+                    args.batch_size, args.block_size, args.sort_memory,
+                    args.compression, args.compression_level, args.compression_strategy, args.compress_threads,
+                    args.dedup,
+                ).result()
+                for _ in range(args.repeat)
+            ]
+            result = _fastest(runs)
+            result['size'] = os.path.getsize(path)
+            results['dumps'][path] = result
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Synthetic dumps of any size made of the pages of real ones.
+
+    python -m benchmarks.gendump --pages 1000000 synthetic.xml
+    python -m benchmarks.gendump --pages 2000000 synthetic.xml.bz2 data/zh.sample.xml
+
+The <siteinfo> of the first sample is kept, then the <page>s of the samples
+are written over and over until there are --pages of them. The n-th copy of
+a page is titled f'{title}/{n}' (and so is its redirect target), so every
+title stays unique and the dictionary keys spread over the whole range
+instead of piling up on a few. Templates are only renamed as pages, the
+copies still call the originals, which are part of the first copy.
+"""
+
+import argparse
+import bz2
+import mmap
+import re
+from typing import BinaryIO, List
+
+_TITLE = re.compile(rb'<title>(.*?)</title>')
+_REDIRECT = re.compile(rb'<redirect title="(.*?)"')
+
+
+def read_pages(path: str) -> (bytes, List[bytes]):
+    # (everything before the first <page>, the <page> elements)
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        first = m.find(b'<page>')
+        if first < 0:
+            return m[:], []
+        head = m[:first]
+        pages = []
+        start = first
+        while start >= 0:
+            end = m.find(b'</page>', start)
+            if end < 0:
+                break
+            end += len(b'</page>')
+            pages.append(m[start:end])
+            start = m.find(b'<page>', end)
+        return head, pages
+
+
+def copy_page(page: bytes, n: int) -> bytes:
+    if n == 0:
+        return page
+    suffix = b'/%d' % n
+    page = _TITLE.sub(lambda m: b'<title>' + m.group(1) + suffix + b'</title>', page, count=1)
+    return _REDIRECT.sub(lambda m: b'<redirect title="' + m.group(1) + suffix + b'"', page, count=1)
+
+
+def write_dump(out: BinaryIO, samples: List[str], num_pages: int) -> int:
+    head = None
+    pages = []
+    for path in samples:
+        sample_head, sample_pages = read_pages(path)
+        if head is None:
+            head = sample_head
+        pages += sample_pages
+    assert (len(pages) > 0)
+
+    out.write(head)
+    written = 0
+    n = 0
+    while written < num_pages:
+        for page in pages[:num_pages - written]:
+            out.write(b'  ')
+            out.write(copy_page(page, n))
+            out.write(b'\n')
+        written += min(len(pages), num_pages - written)
+        n += 1
+    out.write(b'</mediawiki>\n')
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.gendump')
+    parser.add_argument('output', help='.xml, or .xml.bz2 to compress it as a single stream')
+    parser.add_argument('samples', nargs='*', default=['data/en.sample.xml', 'data/zh.sample.xml'])
+    parser.add_argument('--pages', type=int, default=1000 * 1000, help='number of <page>s to write')
+    args = parser.parse_args(argv)
+    assert (args.pages > 0)
+
+    opener = bz2.open if args.output.endswith('.bz2') else open
+    with opener(args.output, 'wb') as out:
+        written = write_dump(out, args.samples, args.pages)
+    print(f'{written} pages written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
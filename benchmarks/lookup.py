@@ -0,0 +1,109 @@
+"""
+Lookup latency of wiktionary2dict.reader over built dictionaries.
+
+    python -m benchmarks.lookup data/sample.mdx
+    python -m benchmarks.lookup --lookups 100000 --max-blocks 8 --output lookup.json en.mdx zh.mdx
+
+Keys are drawn at random from the dictionary itself, a share of them
+(--missing) altered so that they are not found. Cold lookups are timed on a
+reader whose block cache is cleared before each one, warm lookups on a
+reader that keeps its cache, which is how a lookup service would run.
+Prefix lookups fetch the first --prefix-limit entries after a prefix of
+the first characters of a key.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List
+
+from wiktionary2dict.reader import MDictReader
+
+
+def _latencies(fn: Callable, args: List) -> Dict:
+    seconds = []
+    for arg in args:
+        start = time.perf_counter()
+        fn(arg)
+        seconds.append(time.perf_counter() - start)
+    seconds.sort()
+
+    def percentile(p: float) -> float:
+        return round(seconds[min(len(seconds) - 1, int(p * len(seconds)))] * 1e6, 1)
+
+    return {
+        'lookups': len(seconds),
+        'lookups_per_s': round(len(seconds) / sum(seconds), 1),
+        'mean_us': round(statistics.fmean(seconds) * 1e6, 1),
+        'p50_us': percentile(0.5),
+        'p90_us': percentile(0.9),
+        'p99_us': percentile(0.99),
+        'max_us': round(seconds[-1] * 1e6, 1),
+    }
+
+
+def bench_dict(path: str, lookups: int, missing: float, max_blocks: int, prefix_len: int, prefix_limit: int) -> Dict:
+    start = time.perf_counter()
+    reader = MDictReader(path, max_blocks=max_blocks)
+    open_seconds = time.perf_counter() - start
+    keys = list(reader.keys())
+    if len(keys) == 0:
+        reader.close()
+        return {'entries': 0}
+
+    rng = random.Random(0)
+    words = [rng.choice(keys) for _ in range(lookups)]
+    words = [word + '\uffff' if rng.random() < missing else word for word in words]
+    prefixes = [word[:prefix_len] for word in words]
+
+    def cold(word: str):
+        reader._blocks.clear()
+        reader.lookup(word)
+
+    result = {
+        'entries': len(reader),
+        'size': os.path.getsize(path),
+        'open_ms': round(open_seconds * 1e3, 3),
+        'cold': _latencies(cold, words),
+        'warm': _latencies(reader.lookup, words),
+        'prefix': _latencies(lambda prefix: list(itertools.islice(reader.iter_prefix(prefix), prefix_limit)), prefixes),
+    }
+    reader.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.lookup')
+    parser.add_argument('dicts', nargs='+', help='.mdx or .mdd files')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--missing', type=float, default=0.1, help='share of keys that are not in the dictionary')
+    parser.add_argument('--max-blocks', type=int, default=64, help='size of the block cache of the reader')
+    parser.add_argument('--prefix-len', type=int, default=2)
+    parser.add_argument('--prefix-limit', type=int, default=20)
+    parser.add_argument('--output', help='json file for the results, stdout by default')
+    args = parser.parse_args(argv)
+    assert (args.lookups > 0)
+
+    results = {
+        'args': {name: value for name, value in vars(args).items() if name not in ('dicts', 'output')},
+        'dicts': {
+            path: bench_dict(path, args.lookups, args.missing, args.max_blocks, args.prefix_len, args.prefix_limit)
+            for path in args.dicts
+        },
+    }
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import bz2
+import os
+
+import pytest
+
+from wiktionary2dict.dumpreader import iter_xml_page_spans
+
+DATA = os.path.join(os.path.dirname(__file__), os.pardir, 'data')
+
+
+def write_multistream(xml_path: str, dump_path: str, index_path: str, pages_per_stream: int = 10):
+    # the dump header, streams of pages_per_stream pages and the closing tag
+    # as separate bz2 streams, with the index lines of the pages
+    with open(xml_path, 'rb') as f:
+        data = f.read()
+    spans = list(iter_xml_page_spans(xml_path))
+    end = spans[-1][0] + spans[-1][1]
+    with open(dump_path, 'wb') as dump, open(index_path, 'w', encoding='utf-8') as index:
+        dump.write(bz2.compress(data[:spans[0][0]]))
+        for i in range(0, len(spans), pages_per_stream):
+            stream = spans[i:i + pages_per_stream]
+            offset = dump.tell()
+            for page_id, (_, _, page) in enumerate(stream, i + 1):
+                index.write(f'{offset}:{page_id}:{page.title}\n')
+            dump.write(bz2.compress(data[stream[0][0]:stream[-1][0] + stream[-1][1]]))
+        dump.write(bz2.compress(data[end:]))
+
+
+@pytest.fixture
+def multistream(tmp_path):
+    # (dump, index) of the en sample
+    dump_path = str(tmp_path / 'en-multistream.xml.bz2')
+    index_path = str(tmp_path / 'en-multistream-index.txt')
+    write_multistream(os.path.join(DATA, 'en.sample.xml'), dump_path, index_path)
+    return dump_path, index_path
@@ -0,0 +1,57 @@
+import asyncio
+import os
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from wiktionary2dict import AsyncDictBuilder, DictBuilder, aiter_pages, iter_pages
+from wiktionary2dict.app import Wiktionary2Dict
+
+_DUMP = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'en.sample.xml')
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _cli(tmp_path):
+    path = str(tmp_path / 'cli.mdx')
+    Wiktionary2Dict.run([_DUMP, 'Sample', path, '--quiet'])
+    return _read(path)
+
+
+def test_dict_builder(tmp_path):
+    path = str(tmp_path / 'builder.mdx')
+    with DictBuilder(path, 'Sample') as builder:
+        for page in iter_pages(_DUMP):
+            builder.add(page)
+        builder.finish(verify=True)
+    assert _read(path) == _cli(tmp_path)
+
+
+def test_async_dict_builder(tmp_path):
+    path = str(tmp_path / 'async.mdx')
+
+    async def build():
+        # batches rendered by two processes, several in flight at once
+        with ProcessPoolExecutor(2) as executor:
+            async with AsyncDictBuilder(path, 'Sample', executor=executor, batch_size=16, max_pending=2) as builder:
+                await builder.add_pages(aiter_pages(_DUMP, batch_size=10))
+                await builder.finish()
+
+    asyncio.run(build())
+    assert _read(path) == _cli(tmp_path)
+
+
+def test_lazy_import():
+    code = (
+        'import sys, wiktionary2dict\n'
+        'assert "wiktionary2dict.app" not in sys.modules\n'
+        'wiktionary2dict.PageFilter\n'
+        'assert "wiktionary2dict.app" not in sys.modules\n'
+        'assert wiktionary2dict.DictBuilder is sys.modules["wiktionary2dict.app"].DictBuilder\n'
+        'assert "AsyncDictBuilder" in dir(wiktionary2dict)\n'
+    )
+    root = os.path.join(os.path.dirname(__file__), os.pardir)
+    subprocess.run([sys.executable, '-c', code], cwd=root, check=True)
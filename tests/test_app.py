@@ -0,0 +1,78 @@
+import itertools
+import json
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from wiktionary2dict import app
+from wiktionary2dict.app import Wiktionary2Dict
+
+_DUMP = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'en.sample.xml')
+
+
+def _build(tmp_path, name, *args, dump=_DUMP):
+    path = str(tmp_path / name)
+    Wiktionary2Dict.run([dump, 'Sample', path, '--quiet', *args])
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_jobs(tmp_path):
+    # the 85 word pages of the sample are two batches, rendered at once
+    assert _build(tmp_path, 'jobs.mdx', '--jobs', '2') == _build(tmp_path, 'serial.mdx')
+
+
+def test_dedup(tmp_path):
+    # the sample repeats short records close to each other, which the
+    # compression finds anyway
+    assert len(_build(tmp_path, 'dedup.mdx', '--dedup')) <= len(_build(tmp_path, 'sample.mdx'))
+
+
+@pytest.mark.parametrize('multistream_dump', [False, True])
+def test_resume(tmp_path, monkeypatch, multistream, multistream_dump):
+    dump, args = _DUMP, []
+    if multistream_dump:
+        dump, args = multistream[0], ['--multistream-index', multistream[1]]
+    expected = _build(tmp_path, 'expected.mdx', *args, dump=dump)
+
+    # a checkpoint after every page, and the build dies after 60 of the
+    # 85 word pages
+    render_page = app.render_page
+    rendered = itertools.count()
+
+    def die(*page):
+        if next(rendered) == 60:
+            raise RuntimeError('killed')
+        return render_page(*page)
+
+    clock = itertools.count()
+    monkeypatch.setattr(app, 'time', SimpleNamespace(perf_counter=time.perf_counter, monotonic=lambda: next(clock)))
+    monkeypatch.setattr(app, 'render_page', die)
+    path = str(tmp_path / 'resumed.mdx')
+    with pytest.raises(RuntimeError):
+        Wiktionary2Dict.run([dump, 'Sample', path, '--quiet', '--checkpoint-interval', '1', *args])
+    with open(f'{path}.checkpoint', 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    assert checkpoint['position'] == 60
+    offset, position = checkpoint['seek']
+    assert offset > 0
+    assert position <= checkpoint['position']
+
+    # the dump is read from the seek point, not from its start
+    monkeypatch.setattr(app, 'render_page', render_page)
+    iter_page_tuples = app.iter_page_tuples
+    offsets = []
+
+    def spy(*args, **kwargs):
+        offsets.append(kwargs.get('offset'))
+        return iter_page_tuples(*args, **kwargs)
+
+    monkeypatch.setattr(app, 'iter_page_tuples', spy)
+    Wiktionary2Dict.run([dump, 'Sample', path, '--quiet', '--checkpoint-interval', '1', '--resume', *args])
+    assert offsets == [offset]
+    with open(path, 'rb') as f:
+        assert f.read() == expected
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        ['en-multistream.xml.bz2', 'en-multistream-index.txt', 'expected.mdx', 'resumed.mdx'])
@@ -0,0 +1,85 @@
+import os
+
+from wiktionary2dict import app
+from wiktionary2dict.app import Wiktionary2Dict
+from wiktionary2dict.cache import RenderCache, page_digest
+
+_DUMP = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'en.sample.xml')
+
+
+def _build(path, version, pages):
+    with RenderCache(path, version) as cache:
+        records = {title: cache.get(title, page_digest(text, None)) for title, text in pages.items()}
+        for title, text in pages.items():
+            cache.put(title, page_digest(text, None), records[title] or f'<p>{text}</p>'.encode())
+        cache.commit()
+    return records, cache.hits, cache.misses
+
+
+def test_page_digest():
+    assert page_digest('a', None) == page_digest('a', None)
+    assert page_digest('a', None) != page_digest('b', None)
+    assert page_digest(None, 'a') != page_digest('a', None)
+    assert page_digest(None, 'a') != page_digest(None, None)
+
+
+def test_hits_and_eviction(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    assert _build(path, '1', {'a': 'A', 'b': 'B'})[1:] == (0, 2)
+    # b changed, c is new
+    records, hits, misses = _build(path, '1', {'a': 'A', 'b': 'B2', 'c': 'C'})
+    assert records == {'a': b'<p>A</p>', 'b': None, 'c': None}
+    assert (hits, misses) == (1, 2)
+    # a is gone from the dump, and from the cache
+    assert _build(path, '1', {'b': 'B2', 'c': 'C'})[1:] == (2, 0)
+    assert _build(path, '1', {'a': 'A'})[1:] == (0, 1)
+    assert os.listdir(tmp_path) == ['cache.sqlite']
+
+
+def test_version(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    _build(path, '1', {'a': 'A'})
+    assert _build(path, '2', {'a': 'A'})[1:] == (0, 1)
+    assert _build(path, '2', {'a': 'A'})[1:] == (1, 0)
+
+
+def test_resume(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    cache = RenderCache(path, '1')
+    cache.put('a', page_digest('A', None), b'<p>A</p>')
+    cache.checkpoint()
+    # not in the checkpoint
+    cache.put('b', page_digest('B', None), b'<p>B</p>')
+    cache.close()
+
+    with RenderCache(path, '1', resume=True) as cache:
+        cache.put('c', page_digest('C', None), b'<p>C</p>')
+        cache.commit()
+    records, hits, _ = _build(path, '1', {'a': 'A', 'b': 'B', 'c': 'C'})
+    assert hits == 2
+    assert records['b'] is None
+
+    # the .new file of another version is started over
+    with RenderCache(path, '1') as cache:
+        cache.put('d', page_digest('D', None), b'<p>D</p>')
+        cache.checkpoint()
+    with RenderCache(path, '2', resume=True) as cache:
+        cache.commit()
+    assert _build(path, '2', {'d': 'D'})[1:] == (0, 1)
+
+
+def test_rebuild(tmp_path, monkeypatch):
+    path = str(tmp_path / 'sample.mdx')
+    cache = str(tmp_path / 'cache.sqlite')
+    Wiktionary2Dict.run([_DUMP, 'Sample', path, '--quiet', '--cache', cache])
+    with open(path, 'rb') as f:
+        expected = f.read()
+
+    # every page of the same dump is a hit
+    def render_page(*args):
+        raise AssertionError('rendered')
+
+    monkeypatch.setattr(app, 'render_page', render_page)
+    Wiktionary2Dict.run([_DUMP, 'Sample', path, '--quiet', '--cache', cache])
+    with open(path, 'rb') as f:
+        assert f.read() == expected
@@ -0,0 +1,72 @@
+from wiktionary2dict.app import DictBuilder
+from wiktionary2dict.collation import fold, merge_collisions, sort_key, split_sort_key
+from wiktionary2dict.reader import MDictReader
+
+
+def _merged(entries):
+    return list(merge_collisions(sorted((sort_key(key), record) for key, record in entries)))
+
+
+def test_fold():
+    assert fold('Free') == 'free'
+    assert fold("Don't-stop me") == 'dontstopme'
+    # keys are folded as they are stored, as clients do
+    assert fold('AT&T') == 'att'
+    assert fold('&amp;') == fold('amp')
+
+
+def test_sort_key():
+    keys = [b'b', b'A', b'a', b'-a', b'\xc3\xa9']
+    assert [split_sort_key(sort_key(key))[1] for key in sorted(keys, key=sort_key)] == [
+        b'-a', b'A', b'a', b'b', b'\xc3\xa9']
+    assert split_sort_key(sort_key(b'A-b')) == (b'ab', b'A-b')
+
+
+def test_stored_keys_in_client_order(tmp_path):
+    # a client folds the keys as they are in the file, "don't" stored as
+    # "don&#x27;t" would be "donx27t", between "donx" and "donx27u"
+    path = str(tmp_path / 'example.mdx')
+    titles = ["don't", 'dont', 'donut', 'donx', 'donx27u', 'AT&T', '<b>']
+    with DictBuilder(path, 'Example') as builder:
+        for title in titles:
+            builder.add_record(title, f'<p>{title}</p>'.encode())
+        builder.add_record('at and t', b'@@@LINK=AT&T')
+        builder.finish(verify=True)
+    with MDictReader(path) as reader:
+        keys = [key for key, _ in reader.items()]
+        assert keys == ['at and t', 'AT&T', '<b>', 'dont', 'donut', 'donx', 'donx27u']
+        folded = [fold(key) for key in keys]
+        assert folded == sorted(folded)
+        assert reader.lookup("Don't") == ["<p>don't</p><p>dont</p>"]
+        assert reader.lookup('at&t') == ['<p>AT&T</p>']
+        assert reader.lookup('at and t') == ['@@@LINK=AT&T']
+
+
+def test_merge_collisions():
+    entries = [(b'-s', b'<p>-s</p>'), (b's', b'<p>s</p>'), (b'S', b'<p>S</p>'), (b'x', b'<p>x</p>')]
+    # keyed by the member that is its own fold, the pages in key order
+    assert _merged(entries) == [(b's', b'<p>-s</p><p>S</p><p>s</p>'), (b'x', b'<p>x</p>')]
+
+
+def test_merge_key_without_punctuation():
+    entries = [(b'-S-', b'<p>-S-</p>'), (b'S', b'<p>S</p>')]
+    assert _merged(entries) == [(b'S', b'<p>-S-</p><p>S</p>')]
+
+
+def test_merge_links():
+    entries = [
+        (b'Free', b'<p>Free</p>'),
+        # a link inside the group and a repeated record are dropped
+        (b'free', b'@@@LINK=Free'),
+        (b'FREE', b'<p>Free</p>'),
+        # a link out of the group is kept as a link in the record
+        (b'fr-ee', b'@@@LINK=gratis'),
+        (b'fr ee', b'@@@LINK=A&B'),
+    ]
+    assert _merged(entries) == [(b'free', (
+        b'<p>Free</p><p><a href="entry://A&amp;B">A&amp;B</a></p><p><a href="entry://gratis">gratis</a></p>'))]
+
+
+def test_merge_only_links():
+    entries = [(b'Colour', b'@@@LINK=color'), (b'colour', b'@@@LINK=color')]
+    assert _merged(entries) == [(b'colour', b'@@@LINK=color')]
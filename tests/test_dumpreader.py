@@ -0,0 +1,50 @@
+import bz2
+import os
+from collections import Counter
+
+import pytest
+
+from wiktionary2dict.app import iter_page_tuples_pulldom
+from wiktionary2dict.dumpreader import iter_dump_pages, iter_multistream_pages, read_multistream_offsets
+
+_DATA = os.path.join(os.path.dirname(__file__), os.pardir, 'data')
+
+
+@pytest.mark.parametrize('sample', ['en.sample.xml', 'zh.sample.xml'])
+def test_pulldom_parity(tmp_path, sample):
+    path = os.path.join(_DATA, sample)
+    pages = list(iter_dump_pages(path))
+    assert len(pages) > 500
+    assert pages == list(iter_page_tuples_pulldom(path))
+
+    compressed = str(tmp_path / f'{sample}.bz2')
+    with open(path, 'rb') as f, bz2.open(compressed, 'wb') as out:
+        out.write(f.read())
+    assert list(iter_dump_pages(compressed)) == pages
+    # a download, told apart by its magic bytes
+    for source in (path, compressed):
+        with open(source, 'rb') as f:
+            assert list(iter_dump_pages(f)) == pages
+
+
+def test_progress():
+    path = os.path.join(_DATA, 'en.sample.xml')
+    positions = []
+    for _ in iter_dump_pages(path, progress=positions.append):
+        pass
+    assert positions == sorted(positions)
+    assert positions[-1] == os.path.getsize(path)
+
+
+@pytest.mark.parametrize('jobs', [1, 3])
+def test_multistream(multistream, jobs):
+    dump_path, index_path = multistream
+    pages = list(iter_dump_pages(os.path.join(_DATA, 'en.sample.xml')))
+    positions = []
+    assert list(iter_multistream_pages(dump_path, index_path, jobs=jobs, progress=positions.append)) == pages
+    assert positions == sorted(positions)
+    # the streams from the first page on
+    assert positions[-1] == os.path.getsize(dump_path) - read_multistream_offsets(index_path)[0]
+
+    unordered = list(iter_multistream_pages(dump_path, index_path, jobs=jobs, ordered=False))
+    assert Counter(unordered) == Counter(pages)
@@ -0,0 +1,56 @@
+import os
+import random
+
+from wiktionary2dict.extsort import ExternalSorter
+
+
+def _entries(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    return [(f'{rng.randrange(n // 4):08d}'.encode(), f'value {i}'.encode()) for i in range(n)]
+
+
+def test_spill_and_merge(tmp_path):
+    entries = _entries(5000)
+    with ExternalSorter(memory_budget=4096, tmp_dir=str(tmp_path)) as sorter:
+        for key, value in entries:
+            sorter.add(key, value)
+        assert len(sorter._runs) > 10
+        assert len(sorter) == len(entries)
+        # stable, equal keys keep the order they were added in
+        expected = sorted(entries, key=lambda entry: entry[0])
+        assert list(sorter) == expected
+        assert list(sorter) == expected
+
+
+def test_in_memory():
+    entries = _entries(100)
+    with ExternalSorter() as sorter:
+        for key, value in entries:
+            sorter.add(key, value)
+        assert len(sorter._runs) == 0
+        assert list(sorter) == sorted(entries, key=lambda entry: entry[0])
+
+
+def test_checkpoint_and_resume(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    entries = _entries(3000)
+    sorter = ExternalSorter(memory_budget=4096, run_prefix='runs.')
+    for key, value in entries[:1000]:
+        sorter.add(key, value)
+    runs = sorter.checkpoint()
+    assert all(os.path.isabs(path) for path in runs)
+    # spilled after the checkpoint, then the build died
+    for key, value in entries[1000:2000]:
+        sorter.add(key, value)
+    leaked = sorter.checkpoint()[len(runs):]
+    sorter.close()
+    assert len(leaked) > 0
+
+    os.chdir(os.path.dirname(tmp_path))
+    with ExternalSorter(memory_budget=4096, run_prefix=str(tmp_path / 'runs.'), runs=runs) as resumed:
+        assert not any(os.path.exists(path) for path in leaked)
+        for key, value in entries[1000:]:
+            resumed.add(key, value)
+        assert list(resumed) == sorted(entries, key=lambda entry: entry[0])
+        resumed.remove_runs()
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,79 @@
+import pytest
+
+from wiktionary2dict.writemdict import lzo
+
+_END = bytes.fromhex('110000')
+
+
+def _lcg(n: int) -> bytes:
+    # incompressible bytes, the same on every platform
+    x = 1
+    out = bytearray()
+    for _ in range(n):
+        x = (x * 1103515245 + 12345) & 0x7fffffff
+        out.append((x >> 16) & 0xff)
+    return bytes(out)
+
+
+_INPUTS = {
+    'empty': b'',
+    'short': b'abc',
+    'repeat': b'hello world, hello world, hello world!',
+    'run': b'a' * 100,
+    'bytes': bytes(range(256)) * 4,
+    # a match more than 16 KiB back (M4)
+    'far': _lcg(64) + b'z' * 17000 + _lcg(64),
+    # a literal run too long for the first instruction byte
+    'literals': _lcg(300),
+}
+
+# lzo1x_1_compress() of liblzo 2.10
+_LIBLZO = {
+    'empty': _END,
+    'short': bytes.fromhex('14616263') + _END,
+    'repeat': bytes.fromhex('0a68656c6c6f20776f726c642c202a30000a2068656c6c6f20776f726c6421') + _END,
+    'run': bytes.fromhex('026161616161202b1000000161616161616161616161616161616161616161') + _END,
+    'bytes': (
+        bytes.fromhex('00f3') + bytes(range(256)) + bytes.fromhex('0001020304200000cdfc030c')
+        + bytes(range(0xf1, 0x100)) + _END
+    ),
+    'far': (
+        bytes.fromhex('0031') + _lcg(64) + b'zzz' + bytes.fromhex('20') + bytes(66)
+        + bytes.fromhex('8608001023a00a0002') + _lcg(64)[-20:] + _END
+    ),
+    'literals': bytes.fromhex('00001b') + _lcg(300) + _END,
+}
+
+# _compress(), each one decompressed by lzo1x_decompress_safe() of liblzo
+# 2.10 to the input
+_OURS = {
+    'empty': _END,
+    'short': bytes.fromhex('14616263') + _END,
+    'repeat': bytes.fromhex('1e68656c6c6f20776f726c642c2036310021') + _END,
+    'run': bytes.fromhex('126120420000') + _END,
+    'bytes': bytes.fromhex('00ee') + bytes(range(256)) + bytes.fromhex('200000e1fc03') + _END,
+    'far': (
+        bytes.fromhex('52') + _lcg(64) + b'z' + bytes.fromhex('20') + bytes(66)
+        + bytes.fromhex('8800001037a00a') + _END
+    ),
+    'literals': bytes.fromhex('00001b') + _lcg(300) + _END,
+}
+
+
+@pytest.mark.parametrize('name', list(_INPUTS))
+def test_decompress_liblzo(name):
+    assert lzo._decompress(_LIBLZO[name]) == _INPUTS[name]
+    assert lzo.decompress(_LIBLZO[name], len(_INPUTS[name])) == _INPUTS[name]
+
+
+@pytest.mark.parametrize('name', list(_INPUTS))
+def test_compress(name):
+    assert lzo._compress(_INPUTS[name]) == _OURS[name]
+    assert lzo._decompress(_OURS[name]) == _INPUTS[name]
+
+
+def test_round_trip():
+    text = ' '.join(f'{i} {i * i} {"x" * (i % 7)}' for i in range(5000)).encode()
+    for data in (text, _lcg(70000), text + _lcg(3000) + text):
+        assert lzo._decompress(lzo._compress(data)) == data
+        assert lzo.decompress(lzo.compress(data), len(data)) == data
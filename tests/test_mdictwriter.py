@@ -1,27 +1,175 @@
-# from mdict_utils.base.writemdict import MDictWriter
-
-# dictionary = {
-#     "doe": "a deer, a female deer.",
-#     "0ray": "a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. a drop of golden sun. ",
-#     "far": "a long, long way to run.",
-#     "me": "中文 麵麪麵 😀 😃 😄.",
-#     "far2": "a long, long way to run.",
-# }
-
-
-# def test_mdict_writer():
-
-#     writer = MDictWriter(
-#         title="Example Dictionary",
-#         description="This is an example dictionary.",
-#         compression_type=2,
-#         is_mdd=False,
-#     )
-
-#     writer._build_offset_table(dictionary)
-#     writer._build_key_blocks()
-#     writer._build_keyb_index()
-#     writer._build_record_blocks()
-#     writer._build_recordb_index()
-#     with open('./data/sample.mdx', 'wb') as f:
-#         writer.write(f)
+import os
+import tempfile
+
+import pytest
+
+from wiktionary2dict.collation import merge_collisions, sort_key
+from wiktionary2dict.reader import MDictReader, verify_dict
+from wiktionary2dict.mdd import build_mdd
+from wiktionary2dict.writemdict.writemdict import FileRecord, MDictWriter, ParameterError
+
+_DICTIONARY = {
+    'doe': 'a deer, a female deer.',
+    '0ray': 'a drop of golden sun. ' * 50,
+    'far': 'a long, long way to run.',
+    'me': '中文 麵麪麵 😀 😃 😄.',
+    'far2': 'a long, long way to run.',
+    'far3': 'a long, long way to run.',
+    'la': '@@@LINK=far',
+    'so': 'a needle pulling thread.',
+}
+
+
+def _entries(dictionary):
+    # sorted and merged as DictBuilder writes them
+    items = sorted((sort_key(key.encode()), record.encode()) for key, record in dictionary.items())
+    return list(merge_collisions(items))
+
+
+def _write(path, entries, **kwargs):
+    with tempfile.TemporaryFile() as key_blocks:
+        writer = MDictWriter('Example', 'An example dictionary.', key_blocks, **kwargs)
+        writer.add(dict(entries))
+        writer.commit()
+        with open(path, 'wb') as f:
+            writer.write(f, [record for _, record in entries])
+    return writer
+
+
+@pytest.mark.parametrize('compression_type', [0, 1, 2])
+@pytest.mark.parametrize('block_size', [32, 65536])
+def test_round_trip(tmp_path, compression_type, block_size):
+    path = str(tmp_path / 'example.mdx')
+    entries = _entries(_DICTIONARY)
+    _write(path, entries, block_size=block_size, compression_type=compression_type)
+
+    assert verify_dict(path, entries) == len(_DICTIONARY)
+    with MDictReader(path) as reader:
+        assert reader.header['StripKey'] == 'Yes'
+        assert reader.collation == 'mdict'
+        assert dict(reader.items()) == _DICTIONARY
+        assert reader.lookup('Far') == [_DICTIONARY['far']]
+        assert reader.lookup('missing') == []
+        assert [key for key, _ in reader.iter_prefix('far')] == ['far', 'far2', 'far3']
+
+
+def test_dedup(tmp_path):
+    path = str(tmp_path / 'example.mdx')
+    entries = _entries(_DICTIONARY)
+    writer = _write(path, entries, block_size=32, dedup=True)
+
+    # far2 and far3 link to far, the link of la is kept, doe is shorter
+    # than a link would be
+    assert writer.shared_records == 2
+    assert writer.shared_uncompressed_bytes == 2 * (len('a long, long way to run.') - len('@@@LINK=far'))
+    assert verify_dict(path, entries) == len(_DICTIONARY)
+    with MDictReader(path) as reader:
+        records = dict(reader.items())
+    assert records['far'] == _DICTIONARY['far']
+    assert records['far2'] == '@@@LINK=far'
+    assert records['far3'] == '@@@LINK=far'
+    assert records['la'] == '@@@LINK=far'
+    assert records['0ray'] == _DICTIONARY['0ray']
+
+
+@pytest.mark.parametrize('compression_type', [0, 1, 2])
+def test_dedup_within_block(tmp_path, compression_type):
+    # the compression of the block finds far in far2 and far3, the copy of
+    # the long 0ray is still linked
+    path = str(tmp_path / 'example.mdx')
+    entries = _entries({**_DICTIONARY, '0ray2': _DICTIONARY['0ray']})
+    writer = _write(path, entries, dedup=True, compression_type=compression_type)
+    assert writer.shared_records == (3 if compression_type == 0 else 1)
+    with MDictReader(path) as reader:
+        records = dict(reader.items())
+    assert records['0ray2'] == '@@@LINK=0ray'
+    assert records['far2'] == ('@@@LINK=far' if compression_type == 0 else _DICTIONARY['far'])
+
+
+def test_dedup_max_records(tmp_path):
+    path = str(tmp_path / 'example.mdx')
+    entries = _entries(_DICTIONARY)
+    writer = _write(path, entries, block_size=32, dedup=True, dedup_max_records=0)
+    assert writer.shared_records == 0
+    with MDictReader(path) as reader:
+        assert dict(reader.items()) == _DICTIONARY
+
+
+def test_dedup_other_readers(tmp_path):
+    # readers that take the end of a record from the next key
+    readmdict = pytest.importorskip('mdict_utils.base.readmdict')
+    path = str(tmp_path / 'example.mdx')
+    entries = _entries(_DICTIONARY)
+    _write(path, entries, block_size=32, dedup=True)
+    records = {key.decode(): record.decode() for key, record in readmdict.MDX(path).items()}
+    assert records == {**_DICTIONARY, 'far2': '@@@LINK=far', 'far3': '@@@LINK=far'}
+
+
+def test_codepoint_order(tmp_path):
+    path = str(tmp_path / 'example.mdx')
+    entries = [(b'Apple', b'A'), (b'Banana', b'B'), (b'apple', b'a')]
+    _write(path, entries, strip_key=False)
+    with MDictReader(path) as reader:
+        assert reader.header['StripKey'] == 'No'
+        assert reader.collation == 'codepoint'
+        assert reader.lookup('Apple') == ['A']
+        assert reader.lookup('apple') == ['a']
+        assert reader.lookup('banana') == []
+
+
+def test_ambiguous_order(tmp_path):
+    # in code point and folded order at once, searched folded as clients do
+    path = str(tmp_path / 'example.mdx')
+    entries = [(b'apple', b'A'), (b'banana', b'B')]
+    _write(path, entries, strip_key=False)
+    with MDictReader(path) as reader:
+        assert reader.collation == 'mdict'
+        assert reader.lookup('Apple') == ['A']
+
+
+@pytest.mark.parametrize('compress_threads', [1, 3])
+def test_compression_options(tmp_path, compress_threads):
+    entries = _entries(_DICTIONARY)
+    sizes = []
+    for level in (0, 9):
+        path = str(tmp_path / f'level{level}.mdx')
+        _write(path, entries, block_size=256, compression_level=level, compress_threads=compress_threads)
+        assert verify_dict(path, entries) == len(_DICTIONARY)
+        sizes.append(os.path.getsize(path))
+    assert sizes[1] < sizes[0]
+
+    with pytest.raises(ParameterError):
+        MDictWriter('Example', '', None, compression_type=3)
+
+
+def test_mdd(tmp_path):
+    resources = {'\\a.png': b'\x89PNG' + bytes(range(256)) * 10, '\\b.css': b'', '\\c\\d.js': b'var x;'}
+    for name, data in resources.items():
+        (tmp_path / name.replace('\\', '_')).write_bytes(data)
+    path = str(tmp_path / 'example.mdd')
+    entries = [
+        (name, FileRecord(str(tmp_path / name.replace('\\', '_'))))
+        for name in sorted(resources, key=str.lower)
+    ]
+    _write(path, entries, is_mdd=True, block_size=64)
+    with MDictReader(path) as reader:
+        assert reader.header['StripKey'] == 'No'
+        assert dict(reader.items()) == resources
+        assert reader.lookup('\\A.PNG') == [resources['\\a.png']]
+
+    with pytest.raises(ParameterError):
+        MDictWriter('Example', '', None, is_mdd=True, dedup=True)
+
+
+def test_build_mdd(tmp_path):
+    # identical files are each written, the first source wins a key
+    (tmp_path / 'one' / 'img').mkdir(parents=True)
+    (tmp_path / 'two').mkdir()
+    (tmp_path / 'one' / 'img' / 'a.png').write_bytes(b'same')
+    (tmp_path / 'one' / 'b.png').write_bytes(b'same')
+    (tmp_path / 'one' / 'empty.css').write_bytes(b'')
+    (tmp_path / 'two' / 'b.png').write_bytes(b'other')
+    path = str(tmp_path / 'example.mdd')
+    build_mdd(path, [str(tmp_path / 'one'), str(tmp_path / 'two')], 'Example', block_size=16)
+    with MDictReader(path) as reader:
+        assert dict(reader.items()) == {'\\img\\a.png': b'same', '\\b.png': b'same', '\\empty.css': b''}
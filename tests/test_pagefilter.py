@@ -0,0 +1,71 @@
+import io
+import os
+
+from wiktionary2dict.dumpreader import iter_dump_pages
+from wiktionary2dict.pagefilter import FilteredDump, PageFilter
+
+_DUMP = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'en.sample.xml')
+
+
+def _page(ns, title, text, redirect=None):
+    redirect = f'<redirect title="{redirect}" />' if redirect is not None else ''
+    return (
+        f'<page><title>{title}</title><ns>{ns}</ns><id>1</id>{redirect}<revision><model>wikitext</model>'
+        f'<text xml:space="preserve">{text}</text></revision></page>'
+    ).encode()
+
+
+def test_accepts_raw():
+    page_filter = PageFilter(namespaces=['0', '10'], title_prefixes=['a'], exclude_title_pattern='^ab')
+    assert page_filter.accepts_raw(_page('0', 'a', ''))
+    assert not page_filter.accepts_raw(_page('0', 'b', ''))
+    assert not page_filter.accepts_raw(_page('0', 'abc', ''))
+    # titles are unescaped, prefixes only apply to word pages
+    assert PageFilter(title_pattern='^a&b$').accepts_raw(_page('0', 'a&amp;b', ''))
+    assert page_filter.accepts_raw(_page('10', 'Template:b', ''))
+    assert not page_filter.accepts_raw(_page('14', 'a', ''))
+    # pages it can not read are left to the parser
+    assert page_filter.accepts_raw(b'<page><title>b</title></page>')
+
+
+def test_accepts_raw_languages():
+    page_filter = PageFilter(languages=['English', 'Old & New'])
+    assert page_filter.accepts_raw(_page('0', 'a', '==English==\nx'))
+    assert page_filter.accepts_raw(_page('0', 'a', 'lead\n== Old &amp; New ==\nx'))
+    assert not page_filter.accepts_raw(_page('0', 'a', '==French==\n===English===\nx'))
+    # redirects have no sections
+    assert page_filter.accepts_raw(_page('0', 'a', '#REDIRECT [[b]]', redirect='b'))
+    assert page_filter.accepts_raw(_page('10', 'Template:a', ''))
+
+
+def test_cut():
+    text = 'lead\n==English==\n===Noun===\nen\n==French==\n===Nom===\nfr\n==German==\nde\n'
+    assert PageFilter().cut(text) == text
+    assert PageFilter(languages=['English', 'German']).cut(text) == (
+        'lead\n==English==\n===Noun===\nen\n==German==\nde\n')
+    assert PageFilter(languages=['Dutch']).cut(text) is None
+
+
+def test_filtered_dump():
+    page_filter = PageFilter(namespaces=['0'])
+    pages = [_page('0', 'a', 'x'), _page('14', 'b', 'y' * 100), _page('0', 'c', 'z')]
+    data = b'<mediawiki>\n  ' + b'\n  '.join(pages) + b'\n</mediawiki>\n'
+    expected = data.replace(pages[1], b'')
+    # pages cut across reads of every size
+    for chunk_size in (1, 7, 64, 1 << 20):
+        filtered = FilteredDump(io.BytesIO(data), page_filter, chunk_size)
+        out = []
+        while True:
+            chunk = filtered.read(5)
+            if chunk == b'':
+                break
+            out.append(chunk)
+        assert b''.join(out) == expected
+
+
+def test_dump():
+    page_filter = PageFilter(namespaces=['0'], exclude_title_pattern='^[a-m]')
+    pages = list(iter_dump_pages(_DUMP, page_filter=page_filter))
+    expected = [page for page in iter_dump_pages(_DUMP) if page_filter.accepts(page.ns, page.title)]
+    assert 0 < len(pages) == len(expected)
+    assert pages == expected
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from wiktionary2dict import pageindex
+from wiktionary2dict.dumpreader import iter_dump_pages
+from wiktionary2dict.pageindex import build_page_index, open_page_index
+
+_DUMP = os.path.join(os.path.dirname(__file__), os.pardir, 'data', 'en.sample.xml')
+
+
+@pytest.mark.parametrize('multistream_dump', [False, True])
+def test_get(tmp_path, multistream, multistream_dump):
+    dump, index_path = _DUMP, None
+    if multistream_dump:
+        dump, index_path = multistream
+    # the last page of titles that are in the sample twice
+    pages = list({page.title: page for page in iter_dump_pages(_DUMP)}.values())
+    with build_page_index(str(tmp_path / 'index.sqlite'), dump, index_path, jobs=2) as index:
+        assert len(index) == len(pages)
+        # out of dump order, across streams
+        for page in pages[::-7] + pages:
+            assert index.get(page.title) == page
+        assert index.get('missing') is None
+        assert set(index.titles(ns='10')) == {page.title for page in pages if page.ns == '10'}
+        words = [page for page in pages if page.ns == '0']
+        assert list(index.iter_pages(['missing'] + [page.title for page in words])) == words
+
+
+def test_reuse(tmp_path, monkeypatch):
+    path = str(tmp_path / 'index.sqlite')
+    open_page_index(path, _DUMP).close()
+
+    def build_page_index(*args):
+        raise AssertionError('built again')
+
+    monkeypatch.setattr(pageindex, 'build_page_index', build_page_index)
+    with open_page_index(path, _DUMP) as index:
+        assert index.dump_path == os.path.abspath(_DUMP)
+
+
+def test_plain_bz2(tmp_path):
+    with pytest.raises(ValueError):
+        build_page_index(str(tmp_path / 'index.sqlite'), 'dump.xml.bz2')
@@ -0,0 +1,55 @@
+import pytest
+
+from wiktionary2dict.app import DictBuilder
+from wiktionary2dict.reader import MDictReader, verify_dict
+
+_WORDS = [f'word{i:03d}' for i in range(200)]
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / 'example.mdx')
+    with DictBuilder(path, 'Example', block_size=256) as builder:
+        for word in _WORDS:
+            builder.add_record(word, f'<p>{word}</p>'.encode())
+        builder.finish()
+    return path
+
+
+def _entries():
+    return [(word.encode(), f'<p>{word}</p>'.encode()) for word in _WORDS]
+
+
+def test_lookup(path):
+    with MDictReader(path, max_blocks=2) as reader:
+        assert len(reader) == len(_WORDS)
+        assert list(reader.keys()) == _WORDS
+        assert len(reader._record_blocks) > 2
+        for word in reversed(_WORDS):
+            assert reader.lookup(word.upper()) == [f'<p>{word}</p>']
+        # decompressed blocks stay within the LRU
+        assert len(reader._blocks) == 2
+        assert 'word010' in reader
+        assert 'word' not in reader
+        assert [key for key, _ in reader.iter_prefix('word19')] == _WORDS[190:]
+        assert list(reader.iter_prefix('x')) == []
+
+
+def test_verify(path):
+    assert verify_dict(path, _entries()) == len(_WORDS)
+    with pytest.raises(ValueError, match='differs'):
+        verify_dict(path, [(b'word000', b'<p>other</p>')] + _entries()[1:])
+    with pytest.raises(ValueError, match='expected'):
+        verify_dict(path, [(b'other', b'<p>word000</p>')] + _entries()[1:])
+    with pytest.raises(ValueError, match='more than'):
+        verify_dict(path, _entries()[:-1])
+    with pytest.raises(ValueError, match='missing'):
+        verify_dict(path, _entries() + [(b'word999', b'<p>word999</p>')])
+
+
+def test_checksum(path):
+    with open(path, 'r+b') as f:
+        f.seek(10)
+        f.write(b'\xff')
+    with pytest.raises(ValueError, match='checksum'):
+        MDictReader(path)
@@ -0,0 +1,70 @@
+from wiktionary2dict.app import DictBuilder
+from wiktionary2dict.reader import MDictReader
+from wiktionary2dict.redirects import RedirectResolver
+
+
+def test_chains():
+    resolver = RedirectResolver()
+    for key, target in [('a', 'b'), ('b', 'c'), ('c', 'page'), ('d', 'page')]:
+        resolver.add(key, target)
+    assert resolver.resolve('a') == 'page'
+    assert resolver.resolve('d') == 'page'
+    # not a redirect
+    assert resolver.resolve('page') == 'page'
+    assert sorted(resolver.resolved()) == [('a', 'page'), ('b', 'page'), ('c', 'page'), ('d', 'page')]
+    assert (resolver.shortened, resolver.dropped) == (2, 0)
+
+
+def test_cycles():
+    resolver = RedirectResolver()
+    for key, target in [('a', 'b'), ('b', 'a'), ('self', 'self'), ('c', 'a')]:
+        resolver.add(key, target)
+    assert resolver.resolve('a') is None
+    assert resolver.resolve('self') is None
+    # into a cycle
+    assert resolver.resolve('c') is None
+    assert list(resolver.resolved()) == []
+    assert resolver.dropped == 4
+
+
+def test_depth():
+    chain = [(f'r{i}', f'r{i + 1}') for i in range(5)]
+    for depth, final in [(5, 'r5'), (4, None)]:
+        resolver = RedirectResolver(max_depth=depth)
+        for key, target in chain:
+            resolver.add(key, target)
+        # five links from r0 to the page r5
+        assert resolver.resolve('r0') == final
+        assert resolver.resolve('r1') == 'r5'
+
+
+def test_state():
+    resolver = RedirectResolver()
+    resolver.add('a', 'b')
+    resumed = RedirectResolver(redirects=resolver.state())
+    resumed.add('b', 'c')
+    assert list(resumed.resolved()) == [('a', 'c'), ('b', 'c')]
+
+
+def test_builder(tmp_path):
+    path = str(tmp_path / 'example.mdx')
+    with DictBuilder(path, 'Example') as builder:
+        builder.add_record('page', b'<p>page</p>')
+        builder.add_record('b', b'@@@LINK=page')
+        builder.add_record('a', b'@@@LINK=b')
+        builder.add_record('x', b'@@@LINK=y')
+        builder.add_record('y', b'@@@LINK=x')
+        builder.finish(verify=True)
+        assert builder.stats.counts['redirects'] == 4
+    with MDictReader(path) as reader:
+        assert dict(reader.items()) == {'a': '@@@LINK=page', 'b': '@@@LINK=page', 'page': '<p>page</p>'}
+
+
+def test_keep(tmp_path):
+    path = str(tmp_path / 'example.mdx')
+    with DictBuilder(path, 'Example', resolve_redirects=False) as builder:
+        builder.add_record('a', b'@@@LINK=b')
+        builder.add_record('b', b'@@@LINK=a')
+        builder.finish()
+    with MDictReader(path) as reader:
+        assert dict(reader.items()) == {'a': '@@@LINK=b', 'b': '@@@LINK=a'}
@@ -0,0 +1,44 @@
+import os
+import pickle
+
+import pytest
+from wikitextparser import WikiText
+
+from wiktionary2dict.dumpreader import iter_dump_pages
+from wiktionary2dict.renderer import HeadingsRenderer, gen_html
+
+_DATA = os.path.join(os.path.dirname(__file__), os.pardir, 'data')
+
+_TEXTS = [
+    '',
+    'no headings',
+    '==English==\n===Noun===\ntext\n====Translations====\n===Verb===',
+    # level 3 headings before any level 2 one, and after a level 1 one
+    '===Orphan===\n==A==\n===B===\n=Top=\n===C===\n==D==',
+    '==A &amp; <b>==\n=== spaced === \t\n==Unbalanced===',
+    # not headings: inside a template, a comment, <pre> or <nowiki>
+    '==A==\n{{t|\n===In template===\n}}\n<!--\n===In comment===\n-->\n<pre>\n===In pre===\n</pre>\n===B===',
+    '==A==\n<nowiki>\n==In nowiki==\n</nowiki>\n{{unclosed\n===C===',
+    '==A==<!-- c -->\n==B<!-- c -->==\n ==Indented==',
+]
+
+
+@pytest.mark.parametrize('text', _TEXTS)
+def test_gen_html(text):
+    assert HeadingsRenderer().render('T', text) == gen_html(WikiText(text))
+
+
+@pytest.mark.parametrize('sample', ['en.sample.xml', 'zh.sample.xml'])
+def test_samples(sample):
+    render = HeadingsRenderer()
+    pages = [page for page in iter_dump_pages(os.path.join(_DATA, sample)) if page.ns == '0' and page.text]
+    assert len(pages) > 50
+    for page in pages:
+        assert render.render(page.title, page.text) == gen_html(WikiText(page.text)), page.title
+
+
+def test_record():
+    render = pickle.loads(pickle.dumps(HeadingsRenderer()))
+    assert render('T', '==A==\n===B===', None) == b'<h2>A</h2><h3>B</h3>'
+    # the target is a key, not HTML
+    assert render('T', None, 'A & B') == b'@@@LINK=A & B'
@@ -0,0 +1,58 @@
+import pytest
+
+from wiktionary2dict.templates import Arg, Call, Param, TemplateStore, compile_wikitext
+
+
+def test_compile():
+    assert compile_wikitext('a {{b|c|d=e=f}} g') == [
+        'a ', Call(['b'], [Arg(None, ['c']), Arg(['d'], ['e=f'])]), ' g']
+    assert compile_wikitext('{{{1|x}}}') == [Param(['1'], ['x'])]
+    assert compile_wikitext('{{{1}}}') == [Param(['1'], None)]
+    # | and = of links are not separators
+    assert compile_wikitext('{{a|[[b|c]]|d}}') == [Call(['a'], [Arg(None, ['[[b|c]]']), Arg(None, ['d'])])]
+    assert compile_wikitext('{{a|<!-- | -->b}}') == [Call(['a'], [Arg(None, ['b'])])]
+
+
+def test_closing_braces():
+    # the innermost braces are closed first
+    assert compile_wikitext('{{a|{{b}}}}') == [Call(['a'], [Arg(None, [Call(['b'], [])])])]
+    assert compile_wikitext('{{{a}}') == ['{', Call(['a'], [])]
+    assert compile_wikitext('x}}') == ['x}}']
+
+
+def test_unclosed():
+    assert compile_wikitext('a {{b|c') == ['a {{b|c']
+    assert compile_wikitext('{{x|{{y|z}}') == ['{{x|', Call(['y'], [Arg(None, ['z'])])]
+    # every {{ once, not every one after each unclosed one
+    text = 'x {{ ' * 1000 + '{{a}}'
+    assert compile_wikitext(text) == ['x {{ ' * 1000, Call(['a'], [])]
+    assert compile_wikitext('{{{a|' * 1000) == ['{{{a|' * 1000]
+
+
+def test_nesting():
+    text = '{{a|' * 1000 + 'b' + '}}' * 1000
+    nodes = compile_wikitext(text)
+    # the outer braces are text around the innermost 100 levels
+    assert nodes[0] == '{{a|' * 900
+    assert nodes[2] == '}}' * 900
+    nodes = [nodes[1]]
+    depth = 0
+    while isinstance(nodes[0], Call):
+        nodes = nodes[0].args[0].value
+        depth += 1
+    assert depth == 100
+    assert nodes == ['b']
+    assert TemplateStore(':memory:').expand(text, 'T') == '{{a|' * 900 + '}}' * 900
+
+
+@pytest.mark.parametrize('nesting', [3, 5, 8, 15, 99])
+def test_recursion(nesting):
+    # inclusions within the depth limit, each one nesting more nodes, still
+    # end before the Python recursion limit
+    store = TemplateStore(':memory:')
+    store.add('Template:r', '{{#if:1|' * nesting + '{{r}}' + '}}' * nesting, None)
+    store.add('Template:p', '{{p|{{{1}}}}}', None)
+    store.commit()
+    assert store.expand('a {{r}} b', 'T') == 'a  b'
+    assert store.expand('{{p|x}}', 'T') == ''
+    assert store.depth_exceeded == 2
@@ -1 +1,27 @@
-from .app import Wiktionary2Dict  # noqa: F401
+import importlib
+
+# the library API, imported on first use so that running one module of the
+# package (python -m wiktionary2dict.mdd) does not import the others first
+_EXPORTS = {
+    'AsyncDictBuilder': 'aio',
+    'aiter_pages': 'aio',
+    'DictBuilder': 'app',
+    'Wiktionary2Dict': 'app',
+    'iter_pages': 'app',
+    'Page': 'dumpreader',
+    'PageFilter': 'pagefilter',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str):
+    if name not in _EXPORTS:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = getattr(importlib.import_module(f'.{_EXPORTS[name]}', __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,138 @@
+"""
+asyncio front ends of iter_pages() and DictBuilder.
+
+Reading the dump, rendering pages and writing the dictionary are CPU
+work, they run in executors so that the event loop stays free, for
+example to download the next part of the dump:
+
+    en = AsyncDictBuilder('en.mdx', 'English', page_filter=PageFilter(languages=['English']))
+    de = AsyncDictBuilder('de.mdx', 'Deutsch', page_filter=PageFilter(languages=['German']))
+    async for page in aiter_pages(dump):
+        await en.add(page)
+        await de.add(page)
+    await en.finish()
+    await de.finish()
+"""
+
+import asyncio
+import itertools
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterable, Iterator, List
+
+from .app import DictBuilder, iter_pages, render_batch
+from .dumpreader import Page
+from .writemdict.writemdict import MDictWriter
+
+
+def _take(pages: Iterator[Page], n: int) -> List[Page]:
+    return list(itertools.islice(pages, n))
+
+
+async def aiter_pages(
+    source: str | BinaryIO,
+    namespaces: Iterable[str] | None = ('0',),
+    batch_size: int = 64,
+    executor: ThreadPoolExecutor | None = None,
+    **kwargs,
+) -> AsyncIterator[Page]:
+    """
+    iter_pages(source, namespaces, **kwargs), batch_size pages at a time
+    read in executor (the loop's default one when None), which has to be
+    a thread pool, the generator can not move to another process.
+    """
+
+    loop = asyncio.get_running_loop()
+    pages = iter_pages(source, namespaces, **kwargs)
+    try:
+        while True:
+            batch = await loop.run_in_executor(executor, _take, pages, batch_size)
+            if len(batch) == 0:
+                return
+            for page in batch:
+                yield page
+    finally:
+        pages.close()
+
+
+class AsyncDictBuilder(object):
+    """
+    A DictBuilder (made of path, title and kwargs) whose pages are rendered
+    in executor, in batches of batch_size, a ProcessPoolExecutor renders
+    them on every CPU (the render of the builder then has to be picklable,
+    a Renderer). At most max_pending batches are in flight, add() waits for
+    the oldest one beyond that. The records of a batch are added once it is
+    done and in the order of its pages, so the dictionary is the one
+    DictBuilder.add() makes of the same pages. finish() writes it in the
+    loop's default executor.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        title: str,
+        executor: Executor | None = None,
+        batch_size: int = 64,
+        max_pending: int = 8,
+        **kwargs,
+    ):
+        self.builder = DictBuilder(path, title, **kwargs)
+        self._executor = executor
+        self._batch_size = batch_size
+        self._max_pending = max_pending
+        self._batch: List[Page] = []
+        self._pending = deque()
+
+    def _submit(self):
+        if len(self._batch) == 0:
+            return
+        batch = [(page.title, page.text, page.redirect) for page in self._batch]
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, render_batch, self.builder.render, batch, self.builder.page_filter)
+        self._pending.append((batch, future))
+        self._batch = []
+
+    async def _consume(self):
+        batch, future = self._pending.popleft()
+        records, seconds, _ = await future
+        stats = self.builder.stats
+        for (title, _, _), record, elapsed in zip(batch, records, seconds):
+            stats.page_rendered(title, elapsed)
+            if record is not None:
+                self.builder.add_record(title, record)
+
+    async def add(self, page: Page):
+        if not self.builder.accepts(page):
+            return
+        self._batch.append(page)
+        if len(self._batch) >= self._batch_size:
+            self._submit()
+        while len(self._pending) > self._max_pending:
+            await self._consume()
+
+    async def add_pages(self, pages: AsyncIterable[Page] | Iterable[Page]):
+        if isinstance(pages, AsyncIterable):
+            async for page in pages:
+                await self.add(page)
+        else:
+            for page in pages:
+                await self.add(page)
+
+    async def finish(self, verify: bool = False) -> MDictWriter:
+        self._submit()
+        while len(self._pending) > 0:
+            await self._consume()
+        return await asyncio.get_running_loop().run_in_executor(None, self.builder.finish, verify)
+
+    async def close(self):
+        # the batches still in flight are dropped
+        while len(self._pending) > 0:
+            _, future = self._pending.popleft()
+            future.cancel()
+        self.builder.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, ctx_type, ctx_value, ctx_traceback):
+        await self.close()
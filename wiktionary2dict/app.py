@@ -1,29 +1,31 @@
-import operator
+import argparse
+import itertools
+import json
 import os
-import sys
-from .writemdict.writemdict import MDictWriter as MDictWriterStream
-
-from html import escape
-from collections import defaultdict
+import tempfile
+import time
+import zlib
+from .cache import RenderCache, page_digest
+from .collation import COLLATIONS, merge_collisions, sort_key
+from .checkpoint import load_checkpoint, remove_checkpoint, save_checkpoint
+from .extsort import ExternalSorter
+from .mdd import build_mdd
+from .pageindex import open_page_index
+from .redirects import LINK, RedirectResolver
+from .reader import verify_dict
+from .renderer import RENDERERS
+from .stats import BuildStats
+from .templates import TemplateStore, build_template_store
+from .dumpreader import BZ2OrXml, Page, iter_dump_pages, iter_multistream_pages
+from .pagefilter import PageFilter
+from .writemdict.writemdict import COMPRESSION_TYPES, ZLIB_STRATEGIES, MDictWriter as MDictWriterStream
+
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 from wikitextparser import WikiText
 from xml.dom.minidom import Element
 from xml.dom import pulldom
-from typing import Callable, Tuple
-import bz2
-
-
-class BZ2OrXml(object):
-    def __init__(self, filename):
-        if filename.endswith('.bz2'):
-            self.file = bz2.BZ2File(filename)
-        else:
-            self.file = open(filename)
-
-    def __enter__(self):
-        return self.file
-
-    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
-        self.file.close()
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
 
 
 def getElementTextByTagName(node: Element, name: str) -> str | None:
@@ -35,11 +37,125 @@ def getElementTextByTagName(node: Element, name: str) -> str | None:
     return elements[0].firstChild.wholeText
 
 
+def page_tuple(node: Element) -> Page | None:
+    redirect = None
+    redirects = node.getElementsByTagName('redirect')
+    if redirects.length > 0:
+        redirect = redirects[0].getAttribute('title')
+
+    ns = getElementTextByTagName(node, 'ns')
+    if ns is None:
+        return None
+
+    title = getElementTextByTagName(node, 'title')
+    if title is None or title == '':
+        return None
+
+    text = None
+    if ns == '0':
+        model = getElementTextByTagName(node, 'model')
+        if model != 'wikitext':
+            return None
+        text = getElementTextByTagName(node, 'text')
+    elif ns == '10':
+        text = getElementTextByTagName(node, 'text')
+
+    return Page(ns, title, text, redirect)
+
+
+def iter_page_tuples_pulldom(
+    path: str,
+    progress: Callable[[int], any] = None,
+    page_filter: PageFilter | None = None,
+) -> Iterator[Page]:
+    dump = BZ2OrXml(path)
+    with dump as f:
+        events = pulldom.parse(f if page_filter is None else page_filter.stream(f))
+
+        for (event, node) in events:
+            if event == pulldom.START_ELEMENT:
+                if node.tagName == 'page':
+                    events.expandNode(node)
+                    page = page_tuple(node)
+                    if progress is not None:
+                        progress(dump.raw.tell())
+                    if page is not None:
+                        yield page
+
+
+def iter_page_tuples(
+    path: str,
+    reader: str = 'etree',
+    multistream_index: str | None = None,
+    decompress_jobs: int = 1,
+    ordered: bool = True,
+    progress: Callable[[int], any] = None,
+    page_filter: PageFilter | None = None,
+    offset: int = 0,
+    mark: Callable[[int], any] = None,
+) -> Iterator[Page]:
+    # progress(bytes) is called with the bytes of the dump file consumed so
+    # far, the pages page_filter rejects are dropped before they are parsed.
+    # mark(offset) is called with the offsets reading can start again from
+    # (not by the pulldom reader), see iter_dump_pages
+    if multistream_index is not None:
+        return iter_multistream_pages(path, multistream_index, jobs=decompress_jobs, ordered=ordered, progress=progress,
+                                      page_filter=page_filter, offset=offset, mark=mark)
+    if reader == 'pulldom':
+        if offset > 0:
+            raise ValueError('the pulldom reader starts at the beginning of the dump')
+        return iter_page_tuples_pulldom(path, progress, page_filter)
+    return iter_dump_pages(path, progress, page_filter, offset, mark)
+
+
+def iter_pages(
+    source: str | BinaryIO,
+    namespaces: Iterable[str] | None = ('0',),
+    page_filter: PageFilter | None = None,
+    reader: str = 'etree',
+    multistream_index: str | None = None,
+    decompress_jobs: int = 1,
+) -> Iterator[Page]:
+    """
+    The pages of a dump parse_wiktionary() would handle, as a generator.
+
+    source is the path of a plain or .bz2 dump, or a binary file of one,
+    a download for example, which is read as it arrives (multistream_index
+    needs a path). Pages are those of namespaces (all when None), or of
+    page_filter, which then also cuts word pages to its languages. Word
+    pages without text are skipped, as are those without any of the
+    languages.
+    """
+
+    if page_filter is None:
+        page_filter = PageFilter(namespaces=namespaces)
+    for page in iter_page_tuples(source, reader, multistream_index, decompress_jobs, page_filter=page_filter):
+        if page.ns == '0' and page.redirect is None:
+            if page.text is None:
+                continue
+            text = page_filter.cut(page.text)
+            if text is None:
+                continue
+            page = page._replace(text=text)
+        yield page
+
+
 def parse_wiktionary(
     path: str,
     word_cb: Callable[[str, WikiText, str, str], any] = None,
     template_cb: Callable[[str, WikiText, str, str], any] = None,
+    reader: str = 'etree',
+    multistream_index: str | None = None,
+    decompress_jobs: int = 1,
+    stats: BuildStats | None = None,
+    page_filter: PageFilter | None = None,
 ):
+    # with stats, reading the dump, word_cb (WikiText included) and
+    # template_cb are timed as the read, render and templates stages,
+    # with page_filter the word pages are cut to its languages before
+    # WikiText parses them
+    if stats is None:
+        stats = BuildStats(progress=False)
 
     def template_handle(title: str, text: str, redirect: str):
         if template_cb is None:
@@ -72,160 +188,715 @@ def parse_wiktionary(
         if text is None:
             return None
 
+        if page_filter is not None:
+            text = page_filter.cut(text)
+            if text is None:
+                return None
+
         w = WikiText(text)
         if w is None:
             return None
         word_cb(title, w, text, None)
 
-    def page_handle(node: Element) -> Tuple[str | None, str | None, str | WikiText | None]:
-        redirect = None
-        redirects = node.getElementsByTagName('redirect')
-        if redirects.length > 0:
-            redirect = redirects[0].getAttribute('title')
-
-        ns = getElementTextByTagName(node, 'ns')
-        if ns is None:
-            return
-
-        title = getElementTextByTagName(node, 'title')
-        if title is None or title == '':
-            return
-
+    pages = iter_page_tuples(path, reader, multistream_index, decompress_jobs, progress=stats.dump_progress,
+                             page_filter=page_filter)
+    for ns, title, text, redirect in stats.timed('read', pages):
+        stats.page_read()
         if ns == '0':
-            model = getElementTextByTagName(node, 'model')
-            if model == 'wikitext':
-                return word_handle(
-                    title,
-                    getElementTextByTagName(node, 'text'),
-                    redirect,
-                )
+            start = time.perf_counter()
+            word_handle(title, text, redirect)
+            stats.page_rendered(title, time.perf_counter() - start)
         elif ns == '10':
-            return template_handle(
-                title,
-                getElementTextByTagName(node, 'text'),
-                redirect,
-            )
+            start = time.perf_counter()
+            template_handle(title, text, redirect)
+            stats.add_time('templates', time.perf_counter() - start)
         elif ns == '8':
             # TODO MediaWiki
-            return
+            continue
         elif ns == '14':
             # TODO Category
-            return
+            continue
         elif ns == '100':
             # TODO Appendix
-            return
+            continue
         else:
             # TODO
-            return
+            continue
 
-        return
 
-    with BZ2OrXml(path) as f:
-        events = pulldom.parse(f)
+# the TemplateStore pages are expanded with, one per process
+_templates: TemplateStore | None = None
 
-        for (event, node) in events:
-            if event == pulldom.START_ELEMENT:
-                if node.tagName == 'page':
-                    events.expandNode(node)
-                    page_handle(node)
 
+def open_template_store(path: str | None):
+    global _templates
+    if _templates is not None:
+        _templates.close()
+    _templates = TemplateStore(path) if path is not None else None
+
+
+def merge_template_stats(stats: Dict[str, List], more: Dict[str, List]):
+    for name, (calls, seconds) in more.items():
+        stat = stats.setdefault(name, [0, 0.0])
+        stat[0] += calls
+        stat[1] += seconds
+
+
+def render_page(
+    render: Callable[[str, str | None, str | None], bytes],
+    title: str,
+    text: str | None,
+    redirect: str | None,
+    page_filter: PageFilter | None = None,
+) -> bytes | None:
+    if redirect is not None:
+        return render(title, None, redirect)
+
+    if text is None:
+        return None
+
+    if page_filter is not None:
+        text = page_filter.cut(text)
+        if text is None:
+            return None
+
+    if _templates is not None:
+        text = _templates.expand(text, title)
 
-def mergeFiles(out: str, ins: list):
-    BLOCKSIZE = 4096
-    BLOCKS = 1024
-    chunk = BLOCKS * BLOCKSIZE
-    with open(out, "wb") as o:
-        for fname in ins:
-            with open(fname, "rb") as i:
-                b = i.read(chunk)
-                while len(b) > 0:
-                    o.write(b)
-                    b = i.read(chunk)
+    return render(title, text, None)
+
+
+def render_batch(
+    render: Callable[[str, str | None, str | None], bytes],
+    batch: List[Tuple[str, str | None, str | None]],
+    page_filter: PageFilter | None = None,
+) -> Tuple[List[bytes | None], List[float], Dict[str, List]]:
+    # the records, the seconds each one took and the template stats
+    records = []
+    seconds = []
+    for title, text, redirect in batch:
+        start = time.perf_counter()
+        records.append(render_page(render, title, text, redirect, page_filter))
+        seconds.append(time.perf_counter() - start)
+    return records, seconds, _templates.pop_stats() if _templates is not None else {}
+
+
+def render_wiktionary(
+    path: str,
+    render: Callable[[str, str | None, str | None], bytes],
+    record_cb: Callable[[str, bytes], any],
+    jobs: int = 1,
+    batch_size: int = 64,
+    reader: str = 'etree',
+    multistream_index: str | None = None,
+    decompress_jobs: int = 1,
+    ordered: bool = True,
+    start: int = 0,
+    seek: Tuple[int, int] | None = None,
+    progress_cb: Callable[[int, Tuple[int, int] | None], any] = None,
+    cache: RenderCache | None = None,
+    templates: str | None = None,
+    pages: Iterable[Page] | None = None,
+    stats: BuildStats | None = None,
+    page_filter: PageFilter | None = None,
+) -> Dict[str, List]:
+    """
+    Renders every word page of the dump with render and passes the
+    resulting records to record_cb in dump order.
+
+    With jobs > 1 the main process only reads pages from the dump, batches
+    of batch_size pages are rendered in a pool of jobs worker processes.
+    render must be picklable, a module level function or a Renderer.
+    At most jobs * 4 batches are in flight, which bounds memory use, and
+    the results are consumed in submission order, so the records are
+    exactly the ones a serial run produces.
+
+    With multistream_index the dump is a multistream .bz2 whose streams are
+    decompressed by decompress_jobs processes, ordered=False lets pages
+    through as soon as their stream is ready.
+
+    The first start pages of the dump are skipped without rendering.
+    progress_cb(position, seek) is called once the records of the first
+    position pages have all been passed to record_cb, which is what a
+    checkpoint needs to resume with start=position (ordered runs only).
+    seek is the last (offset, position) at or before position where the
+    dump can be read from again, the pages after byte offset of the dump
+    (of its xml for a .bz2, see iter_dump_pages) are those after position,
+    or None when the reader has none. A resumed run given that seek reads
+    the dump from offset instead of from the start.
+
+    With a cache, pages whose title and wikitext are unchanged since the
+    previous build reuse its record and are not rendered at all.
+
+    With templates, the path of a TemplateStore, page text is expanded
+    before it is parsed. The per-template [calls, seconds] of all processes
+    are returned.
+
+    pages, when given, are rendered instead of the pages of the dump, for
+    example a subset of titles read through a PageIndex.
+
+    stats, when given, gets the progress through the dump and the time
+    spent reading pages, in the cache and rendering each page.
+
+    page_filter drops pages before they are parsed (or after they are read
+    from pages) and cuts word pages to its languages before they are
+    rendered. Positions count the pages it lets through.
+    """
+
+    template_stats = {}
+    if stats is None:
+        stats = BuildStats(progress=False)
+
+    # the seek points of the pages read so far, up to the last checkpoint
+    seeks = deque()
+    read = 0
+
+    def mark(offset: int):
+        seeks.append((offset, read))
+
+    def count(pages: Iterable[Page]) -> Iterator[Page]:
+        nonlocal read
+        for page in pages:
+            read += 1
+            yield page
+
+    if pages is None:
+        if seek is not None:
+            read = seek[1]
+        pages = count(iter_page_tuples(
+            path, reader, multistream_index, decompress_jobs, ordered, stats.dump_progress, page_filter,
+            offset=seek[0] if seek is not None else 0,
+            mark=mark if progress_cb is not None else None,
+        ))
+    elif page_filter is not None:
+        pages = (page for page in pages if page_filter.accepts(page.ns, page.title))
+    pages = enumerate(itertools.islice(stats.timed('read', pages), start - read, None), start + 1)
+
+    def progress(position: int):
+        if progress_cb is None:
+            return
+        while len(seeks) > 1 and seeks[1][1] <= position:
+            seeks.popleft()
+        progress_cb(position, seeks[0] if len(seeks) > 0 and seeks[0][1] <= position else None)
+
+    def lookup(title: str, text: str | None, redirect: str | None) -> Tuple[bytes | None, bytes | None]:
+        if cache is None:
+            return None, None
+        started = time.perf_counter()
+        digest = page_digest(text, redirect)
+        record = cache.get(title, digest)
+        stats.add_time('cache', time.perf_counter() - started)
+        return digest, record
+
+    def emit(title: str, digest: bytes | None, record: bytes | None):
+        if record is None:
+            return
+        if cache is not None:
+            started = time.perf_counter()
+            cache.put(title, digest, record)
+            stats.add_time('cache', time.perf_counter() - started)
+        record_cb(title, record)
+
+    if jobs <= 1:
+        open_template_store(templates)
+        try:
+            for position, (ns, title, text, redirect) in pages:
+                stats.page_read()
+                if ns == '0':
+                    digest, record = lookup(title, text, redirect)
+                    if record is None:
+                        started = time.perf_counter()
+                        record = render_page(render, title, text, redirect, page_filter)
+                        stats.page_rendered(title, time.perf_counter() - started)
+                    emit(title, digest, record)
+                progress(position)
+            if _templates is not None:
+                merge_template_stats(template_stats, _templates.pop_stats())
+        finally:
+            open_template_store(None)
+        return template_stats
+
+    def batches():
+        batch = []
+        position = start
+        for position, (ns, title, text, redirect) in pages:
+            stats.page_read()
+            if ns == '0':
+                batch.append((title, text, redirect, *lookup(title, text, redirect)))
+            if len(batch) >= batch_size:
+                yield position, batch
+                batch = []
+        if len(batch) > 0:
+            yield position, batch
+
+    def consume(position, batch, future):
+        records, seconds, batch_template_stats = future.result()
+        merge_template_stats(template_stats, batch_template_stats)
+        rendered = iter(zip(records, seconds))
+        for title, text, redirect, digest, record in batch:
+            if record is None:
+                record, page_seconds = next(rendered)
+                stats.page_rendered(title, page_seconds)
+            emit(title, digest, record)
+        progress(position)
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=open_template_store, initargs=(templates,)) as executor:
+        pending = deque()
+        for position, batch in batches():
+            # cache hits stay in the main process, only misses are rendered
+            misses = [(title, text, redirect) for title, text, redirect, _, record in batch if record is None]
+            pending.append((position, batch, executor.submit(render_batch, render, misses, page_filter)))
+            if len(pending) >= jobs * 4:
+                consume(*pending.popleft())
+        while len(pending) > 0:
+            consume(*pending.popleft())
+
+    return template_stats
+
+
+DESCRIPTION = "Generated by https://github.com/hellodword/wiktionary2dict"
+
+
+class DictBuilder(object):
+    """
+    An .mdx at path built from pages, or their records, added one at a time
+    in any order, what the CLI builds from a dump.
+
+    add() renders a word page (ns 0) with render, a Renderer, unless
+    page_filter rejects it, and cuts it to the languages of page_filter
+    first. add_record() takes the record of a page rendered elsewhere.
+    Records are kept in an ExternalSorter of sort_memory bytes, redirects
+    in a RedirectResolver (unless resolve_redirects is False), and
+    finish() sorts them by collation and writes path with an MDictWriter
+    of the remaining arguments. Several builders can be fed from one pass
+    over a dump, one per language for example.
+
+    With run_prefix the sorted runs are files that outlive the builder,
+    checkpoint() returns what a builder created with state= that
+    checkpoint carries on from. stats gets the time spent sorting and
+    writing and the counts of redirects and shared records.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        title: str,
+        description: str = DESCRIPTION,
+        render: Callable[[str, str | None, str | None], bytes] | None = None,
+        page_filter: PageFilter | None = None,
+        collation: str = 'mdict',
+        resolve_redirects: bool = True,
+        redirect_depth: int = 8,
+        block_size: int = 64 * 1024,
+        dedup: bool = False,
+        sort_memory: int = 256 * 1024 * 1024,
+        run_prefix: str | None = None,
+        state: Dict | None = None,
+        stats: BuildStats | None = None,
+        compression_type: int = 2,
+        compression_level: int = -1,
+        compression_strategy: int = zlib.Z_DEFAULT_STRATEGY,
+        compress_threads: int = 1,
+    ):
+        if collation not in COLLATIONS:
+            raise ValueError(f'unknown collation {collation}')
+        if redirect_depth <= 0:
+            raise ValueError('redirect_depth must be positive')
+        self.path = path
+        self.render = render if render is not None else RENDERERS['headings']()
+        self.page_filter = page_filter
+        self.collation = collation
+        self.dedup = dedup
+        self.stats = stats if stats is not None else BuildStats(progress=False)
+        self.redirects = None
+        if resolve_redirects:
+            self.redirects = RedirectResolver(redirect_depth, state.get('redirects') if state is not None else None)
+        tmp_dir = os.path.dirname(os.path.abspath(path))
+        self._items = ExternalSorter(
+            sort_memory, tmp_dir,
+            run_prefix=run_prefix,
+            runs=state['runs'] if state is not None else [],
+        )
+        self._key_blocks = tempfile.TemporaryFile(dir=tmp_dir)
+        self.writer = MDictWriterStream(
+            title=title,
+            description=description,
+            output_key_blocks=self._key_blocks,
+            is_mdd=False,
+            block_size=block_size,
+            dedup=dedup,
+            # the keys are sorted by collation.sort_key
+            strip_key=collation == 'mdict',
+            compression_type=compression_type,
+            compression_level=compression_level,
+            compression_strategy=compression_strategy,
+            compress_threads=compress_threads,
+        )
+
+    def accepts(self, page: Page) -> bool:
+        return page.ns == '0' and (self.page_filter is None or self.page_filter.accepts(page.ns, page.title))
+
+    def add(self, page: Page) -> bool:
+        # whether the page made a record
+        if not self.accepts(page):
+            return False
+        started = time.perf_counter()
+        record = render_page(self.render, page.title, page.text, page.redirect, self.page_filter)
+        self.stats.page_rendered(page.title, time.perf_counter() - started)
+        if record is None:
+            return False
+        self.add_record(page.title, record)
+        return True
+
+    def add_record(self, title: str, record: bytes):
+        started = time.perf_counter()
+        if self.redirects is not None and record.startswith(LINK):
+            # written once every redirect is known
+            self.redirects.add(title, record[len(LINK):].decode())
+        else:
+            self._add_item(title.encode(), record)
+        self.stats.add_time('sort', time.perf_counter() - started)
+
+    def _add_item(self, key: bytes, record: bytes):
+        self._items.add(sort_key(key) if self.collation == 'mdict' else key, record)
+
+    def checkpoint(self) -> Dict:
+        return {
+            'runs': self._items.checkpoint(),
+            'redirects': self.redirects.state() if self.redirects is not None else None,
+        }
+
+    def _entries(self) -> Iterator[Tuple[bytes, bytes]]:
+        return merge_collisions(self._items) if self.collation == 'mdict' else iter(self._items)
+
+    def finish(self, verify: bool = False) -> MDictWriterStream:
+        """
+        Writes path and returns the writer, with verify reads it back and
+        checks every entry. The runs of run_prefix are removed once path
+        is written.
+        """
+
+        if self.redirects is not None:
+            started = time.perf_counter()
+            for key, target in self.redirects.resolved():
+                self._add_item(key.encode(), LINK + target.encode())
+            self.stats.add_count('redirects', len(self.redirects))
+            self.stats.add_count('redirect_chains_shortened', self.redirects.shortened)
+            self.stats.add_count('redirects_dropped', self.redirects.dropped)
+            self.stats.add_time('redirects', time.perf_counter() - started)
+
+        # two passes over the sorted entries, the keys and then the
+        # records, which are compressed straight into path
+        write_seconds = 0.0
+        started = time.perf_counter()
+        for key, record in self._entries():
+            write_started = time.perf_counter()
+            self.writer.add({key: record})
+            write_seconds += time.perf_counter() - write_started
+        self.stats.add_time('sort', time.perf_counter() - started - write_seconds)
+
+        started = time.perf_counter()
+        self.writer.commit()
+        with open(self.path, 'wb') as output:
+            self.writer.write(output, (record for _, record in self._entries()))
+        self.stats.add_time('write', write_seconds + time.perf_counter() - started)
+        if self.dedup:
+            self.stats.add_count('shared_records', self.writer.shared_records)
+            self.stats.add_count('shared_uncompressed_bytes', self.writer.shared_uncompressed_bytes)
+
+        if verify:
+            started = time.perf_counter()
+            verify_dict(self.path, self._entries())
+            self.stats.add_time('verify', time.perf_counter() - started)
+
+        self._items.remove_runs()
+        return self.writer
+
+    def close(self):
+        self._items.close()
+        self._key_blocks.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
+
+
+# bump whenever the output of a renderer changes, it invalidates --cache files
+RENDER_VERSION = '2'
 
 
 class Wiktionary2Dict:
 
     @staticmethod
-    def run():
+    def parse_args(argv=None):
+        parser = argparse.ArgumentParser(prog='wiktionary2dict')
+        parser.add_argument('dump_path', nargs='?', default='data/en.sample.xml.bz2')
+        parser.add_argument('dict_title', nargs='?', default='Wiktionary English')
+        parser.add_argument('dict_file', nargs='?', default='data/sample.mdx')
+        parser.add_argument('--block-size', type=int, default=64 * 1024,
+                            help='uncompressed size in bytes at which key and record blocks are cut')
+        parser.add_argument('--jobs', type=int, default=1,
+                            help='number of worker processes rendering pages, 0 for one per CPU')
+        parser.add_argument('--reader', choices=['etree', 'pulldom'], default='etree',
+                            help='xml dump reader, pulldom is the previous minidom based one')
+        parser.add_argument('--multistream-index',
+                            help='-multistream-index.txt(.bz2) of a pages-articles-multistream.xml.bz2 dump_path')
+        parser.add_argument('--decompress-jobs', type=int, default=1,
+                            help='number of worker processes decompressing multistream streams, 0 for one per CPU')
+        parser.add_argument('--sort-memory', type=int, default=256,
+                            help='memory budget in MiB for sorting entries, sorted runs beyond it are spilled to disk')
+        parser.add_argument('--checkpoint-interval', type=int, default=0,
+                            help='seconds between checkpoints of the parse stage, 0 disables checkpoints')
+        parser.add_argument('--resume', action='store_true',
+                            help='continue from the last checkpoint of dict_file')
+        parser.add_argument('--cache',
+                            help='sqlite file with the records of the previous build, '
+                                 'unchanged pages are not rendered again')
+        parser.add_argument('--expand-templates', action='store_true',
+                            help='expand {{templates}} with the ns 10 pages of the dump, '
+                                 'which takes an extra pass over it')
+        parser.add_argument('--template-stats',
+                            help='json file for the number of calls and the seconds spent in each template')
+        parser.add_argument('--page-index',
+                            help='sqlite page index of the dump (plain .xml or multistream), built on first use')
+        parser.add_argument('--titles',
+                            help='file with one title per line, only these pages are rendered (needs --page-index)')
+        parser.add_argument('--renderer', choices=list(RENDERERS), default='headings',
+                            help='page renderer, wikitextparser is the previous (slower) one')
+        parser.add_argument('--stats',
+                            help='json file for the time per stage, the slowest pages and the peak RSS of the build')
+        parser.add_argument('--slowest', type=int, default=10,
+                            help='number of slowest pages to report')
+        parser.add_argument('--quiet', action='store_true',
+                            help='no progress bar and no summary at the end')
+        parser.add_argument('--verify', action='store_true',
+                            help='read dict_file back and check every entry against the sorted ones '
+                                 'it was written from')
+        parser.add_argument('--languages', nargs='+', default=[], metavar='LANGUAGE',
+                            help='only the ==LANGUAGE== sections of word pages, pages without any are skipped')
+        parser.add_argument('--title-prefix', nargs='+', default=[], metavar='PREFIX',
+                            help='only the word pages whose title starts with one of these')
+        parser.add_argument('--title-pattern',
+                            help='only the word pages whose title matches this regex')
+        parser.add_argument('--exclude-title-pattern',
+                            help='no word pages whose title matches this regex')
+        parser.add_argument('--redirects', choices=['resolve', 'keep'], default='resolve',
+                            help='resolve links every redirect to the page at the end of its chain and drops cycles, '
+                                 'keep writes the link of each redirect page as it is')
+        parser.add_argument('--redirect-depth', type=int, default=8,
+                            help='longest chain of redirects that is resolved, longer ones are dropped')
+        parser.add_argument('--collation', choices=COLLATIONS, default='mdict',
+                            help='key order, mdict folds case and punctuation as clients do and merges the titles '
+                                 'that fold the same, codepoint is the previous order')
+        parser.add_argument('--compression', choices=list(COMPRESSION_TYPES), default='zlib',
+                            help='compression of the record blocks, lzo without python-lzo installed is slow')
+        parser.add_argument('--compression-level', type=int, default=-1,
+                            help='zlib level of the record blocks, 0-9, -1 for the default')
+        parser.add_argument('--compression-strategy', choices=list(ZLIB_STRATEGIES), default='default',
+                            help='zlib strategy of the record blocks')
+        parser.add_argument('--compress-threads', type=int, default=1,
+                            help='threads compressing record blocks, 0 for one per CPU')
+        parser.add_argument('--mdd', nargs='+', metavar='SOURCE',
+                            help='directories and files of resources (images, audio...) for a .mdd next to dict_file')
+        parser.add_argument('--dedup', action='store_true',
+                            help='replace records identical to an earlier one by a @@@LINK to its key, '
+                                 'short records the compression of their block finds anyway are kept')
+        return parser.parse_args(argv)
 
-        if len(sys.argv) != 4:
-            dump_path = 'data/en.sample.xml.bz2'
-            dict_title = 'Wiktionary English'
-            dict_file = 'data/sample.mdx'
-        else:
-            dump_path = sys.argv[1]
-            dict_title = sys.argv[2]
-            dict_file = sys.argv[3]
+    @staticmethod
+    def run(argv=None):
+        args = Wiktionary2Dict.parse_args(argv)
+        dump_path = args.dump_path
+        dict_title = args.dict_title
+        dict_file = args.dict_file
 
         assert (dict_file != '')
         assert (dict_title != '')
         assert (os.path.isfile(dump_path))
         assert (dump_path.endswith('.xml') or dump_path.endswith('.bz2'))
-
-        with open(f'{dict_file}.1', 'wb') as output_header, open(f'{dict_file}.2', 'wb') as output_2, open(f'{dict_file}.3', 'wb') as output_key_block_body_body, open(f'{dict_file}.4', 'wb') as output_4, open(f'{dict_file}.5', 'wb') as output_record_block_body_body,  open(f'{dict_file}.record_temp', 'wb+') as output_record_temp:
-            ws = MDictWriterStream(
-                title=dict_title,
-                description="Generated by https://github.com/hellodword/wiktionary2dict",
-                output_key_block_body_body=output_key_block_body_body,
-                output_record_block_body_body=output_record_block_body_body,
-                is_mdd=False,
-            )
-
-            record_offset = 0
-            items = []
-
-            # for example
-            def gen_html(w: WikiText) -> str:
-                h = ''
-                sections2 = w.get_sections(include_subsections=True, level=2)
-                for s2 in sections2:
-                    h += f'<h2>{escape(s2.title)}</h2>'
-                    sections3 = s2.get_sections(include_subsections=False, level=3)
-                    for s3 in sections3:
-                        h += f'<h3>{escape(s3.title)}</h3>'
-                return h
-
-            def template_cb(title: str, w: WikiText, text: str, redirect: str):
-                return
-
-            def word_cb(title: str, w: WikiText, text: str, redirect: str):
-                if redirect is not None:
-                    record = f'@@@LINK={escape(redirect)}'.encode()
+        assert (args.block_size > 0)
+        assert (args.jobs >= 0)
+        if args.jobs == 0:
+            args.jobs = os.cpu_count() or 1
+        assert (args.decompress_jobs >= 0)
+        if args.decompress_jobs == 0:
+            args.decompress_jobs = os.cpu_count() or 1
+        assert (args.sort_memory > 0)
+        assert (args.multistream_index is None or os.path.isfile(args.multistream_index))
+        assert (args.checkpoint_interval >= 0)
+        assert (args.titles is None or args.page_index is not None)
+        assert (args.slowest >= 0)
+        assert (-1 <= args.compression_level <= 9)
+        assert (args.compress_threads >= 0)
+        if args.compress_threads == 0:
+            args.compress_threads = os.cpu_count() or 1
+        assert (args.redirect_depth > 0)
+        compression = dict(
+            compression_type=COMPRESSION_TYPES[args.compression],
+            compression_level=args.compression_level,
+            compression_strategy=ZLIB_STRATEGIES[args.compression_strategy],
+            compress_threads=args.compress_threads,
+        )
+        for source in args.mdd or []:
+            assert (os.path.exists(source))
+        # word pages only, every other namespace is skipped unparsed
+        page_filter = PageFilter(
+            namespaces=['0'],
+            title_prefixes=args.title_prefix,
+            title_pattern=args.title_pattern,
+            exclude_title_pattern=args.exclude_title_pattern,
+            languages=args.languages,
+        )
+
+        checkpoint_path = f'{dict_file}.checkpoint'
+        checkpointing = args.checkpoint_interval > 0 or args.resume
+        start = 0
+        seek = None
+        state = None
+        if args.resume:
+            assert (os.path.isfile(checkpoint_path))
+            state = load_checkpoint(checkpoint_path)
+            assert (state['dump_path'] == os.path.abspath(dump_path))
+            assert (state['multistream_index'] == args.multistream_index)
+            # the runs are sorted by the keys of one collation
+            assert (state.get('collation', 'codepoint') == args.collation)
+            # positions count the pages of the filter
+            assert (state.get('filter') == page_filter.spec())
+            # the redirects collected so far, which are not in the runs
+            assert ((state.get('redirects') is None) == (args.redirects == 'keep'))
+            start = state['position']
+            if state.get('seek') is not None and (args.reader != 'pulldom' or args.multistream_index is not None):
+                # pulldom reads the dump from its start
+                seek = tuple(state['seek'])
+
+        with BuildStats(
+                    # pages of --titles are read from all over the dump
+                    os.path.getsize(dump_path) if args.titles is None else None,
+                    slowest=args.slowest,
+                    progress=not args.quiet,
+                ) as stats, \
+                DictBuilder(
+                    dict_file, dict_title,
+                    render=RENDERERS[args.renderer](),
+                    page_filter=page_filter,
+                    collation=args.collation,
+                    resolve_redirects=args.redirects == 'resolve',
+                    redirect_depth=args.redirect_depth,
+                    block_size=args.block_size,
+                    dedup=args.dedup,
+                    sort_memory=args.sort_memory * 1024 * 1024,
+                    run_prefix=f'{dict_file}.run.' if checkpointing else None,
+                    state=state,
+                    stats=stats,
+                    **compression,
+                ) as builder:
+            last_checkpoint = time.monotonic()
+            cache = None
+
+            def progress_cb(position: int, seek_point: Tuple[int, int] | None):
+                nonlocal last_checkpoint
+                if args.checkpoint_interval == 0 or time.monotonic() - last_checkpoint < args.checkpoint_interval:
+                    return
+                # the writer only runs after the sort, so the dump position
+                # and the spilled runs are the whole state of the build
+                started = time.perf_counter()
+                if cache is not None:
+                    # the records of the pages before position
+                    cache.checkpoint()
+                save_checkpoint(checkpoint_path, {
+                    'dump_path': os.path.abspath(dump_path),
+                    'multistream_index': args.multistream_index,
+                    'collation': args.collation,
+                    'filter': page_filter.spec(),
+                    'position': position,
+                    # where reading the dump resumes, instead of its start
+                    'seek': seek_point,
+                    **builder.checkpoint(),
+                })
+                stats.add_time('checkpoint', time.perf_counter() - started)
+                last_checkpoint = time.monotonic()
+
+            index = None
+            if args.page_index is not None:
+                started = time.perf_counter()
+                index = open_page_index(args.page_index, dump_path, args.multistream_index, args.decompress_jobs)
+                stats.add_time('index', time.perf_counter() - started)
+
+            pages = None
+            if args.titles is not None:
+                with open(args.titles, 'r', encoding='utf-8') as f:
+                    titles = [line.strip() for line in f if line.strip() != '']
+                pages = index.iter_pages(titles)
+
+            templates = None
+            render_version = f'{RENDER_VERSION}+{args.renderer}'
+            if len(page_filter.languages) > 0:
+                # the records are of the cut pages
+                render_version = f"{render_version}+languages:{','.join(page_filter.languages)}"
+            if args.expand_templates:
+                started = time.perf_counter()
+                templates = f'{dict_file}.templates'
+                if args.resume and os.path.isfile(templates):
+                    store = TemplateStore(templates)
+                elif index is not None:
+                    store = build_template_store(templates, index.iter_pages(index.titles(ns='10')))
                 else:
-                    record = gen_html(w).encode()
-
-                nonlocal record_offset
-                record_len = len(record)
-                items.append((escape(title), [record_offset, record_len]))
-                record_offset = record_offset+record_len
-
-                assert (output_record_temp.write(record) == record_len)
-
-            parse_wiktionary(dump_path, word_cb=word_cb, template_cb=None)
+                    store = build_template_store(templates, iter_page_tuples(
+                        dump_path, args.reader, args.multistream_index, args.decompress_jobs, ordered=False,
+                        page_filter=PageFilter(namespaces=['10'])))
+                render_version = f'{render_version}+templates:{store.digest()}'
+                store.close()
+                stats.add_time('templates', time.perf_counter() - started)
+
+            if args.cache is not None:
+                cache = RenderCache(args.cache, render_version, resume=args.resume)
+
+            template_stats = render_wiktionary(
+                dump_path, builder.render, builder.add_record,
+                jobs=args.jobs,
+                reader=args.reader,
+                multistream_index=args.multistream_index,
+                decompress_jobs=args.decompress_jobs,
+                # the records are sorted by key before they are written,
+                # but a checkpoint position is only meaningful in dump order
+                ordered=checkpointing,
+                start=start,
+                seek=seek,
+                progress_cb=progress_cb,
+                cache=cache,
+                templates=templates,
+                pages=pages,
+                stats=stats,
+                page_filter=page_filter,
+            )
 
-            output_record_temp.seek(0, 0)
+            if args.template_stats is not None:
+                with open(args.template_stats, 'w', encoding='utf-8') as f:
+                    slowest_first = sorted(template_stats.items(), key=lambda stat: -stat[1][1])
+                    json.dump(dict(slowest_first), f, ensure_ascii=False, indent=1)
 
-            items.sort(key=operator.itemgetter(0))
+            if cache is not None:
+                cache.commit()
 
-            for key, offset in items:
-                # TODO calculate seek
-                output_record_temp.seek(0, 0)
-                output_record_temp.seek(offset[0], 0)
+            builder.finish(verify=args.verify)
 
-                record = output_record_temp.read(offset[1])
-                assert (len(record) == offset[1])
-                ws.add({key: record.decode()})
+            if args.mdd is not None:
+                started = time.perf_counter()
+                build_mdd(
+                    os.path.splitext(dict_file)[0] + '.mdd', args.mdd, dict_title,
+                    description=DESCRIPTION,
+                    block_size=args.block_size,
+                    **compression,
+                )
+                stats.add_time('mdd', time.perf_counter() - started)
 
-            ws.commit()
-            ws.write_1_header(output_header)
-            ws.write_2_key_preamble_and_index_and_block_body_header(output_2)
-            ws.write_4_record_preamble_and_block_body_header(output_4)
+            remove_checkpoint(checkpoint_path)
+            if templates is not None:
+                os.remove(templates)
 
-        mergeFiles(f'{dict_file}',
-                   [
-                       f'{dict_file}.1',
-                       f'{dict_file}.2',
-                       f'{dict_file}.3',
-                       f'{dict_file}.4',
-                       f'{dict_file}.5',
-                   ])
+        if not args.quiet:
+            stats.summary()
+        if args.stats is not None:
+            stats.write(args.stats)
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+
+import xxhash
+
+
+def page_digest(text: str | None, redirect: str | None) -> bytes:
+    h = xxhash.xxh3_64()
+    if redirect is not None:
+        h.update(b'\1')
+        h.update(redirect.encode())
+    h.update(b'\0')
+    if text is not None:
+        h.update(text.encode())
+    return h.digest()
+
+
+def _version(db: sqlite3.Connection) -> str | None:
+    try:
+        row = db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+    except sqlite3.DatabaseError:
+        return None
+    return row[0] if row is not None else None
+
+
+class RenderCache(object):
+    """
+    Rendered records of the previous build, keyed by page title and the
+    page_digest of its raw wikitext.
+
+    Lookups go to the cache file of the previous build, every record of the
+    current build (hit or miss) is written to a fresh f'{path}.new' which
+    replaces path on commit(). Titles that disappeared from the dump are
+    therefore dropped, and so is the whole previous cache when it was
+    written with another renderer version.
+
+    checkpoint() makes the records written so far durable, a build resumed
+    from that checkpoint passes resume=True to carry on with the .new file
+    instead of starting it over, as long as it has the same version.
+    """
+
+    def __init__(self, path: str, version: str, resume: bool = False):
+        self._path = path
+        self._new_path = f'{path}.new'
+        self.hits = 0
+        self.misses = 0
+
+        self._old = None
+        if os.path.exists(path):
+            old = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+            if _version(old) == version:
+                self._old = old
+            else:
+                old.close()
+
+        self._new = None
+        if resume and os.path.exists(self._new_path):
+            self._new = sqlite3.connect(self._new_path)
+            if _version(self._new) != version:
+                self._new.close()
+                self._new = None
+        if self._new is None:
+            if os.path.exists(self._new_path):
+                os.remove(self._new_path)
+            self._new = sqlite3.connect(self._new_path)
+            self._new.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._new.execute('CREATE TABLE pages (title TEXT PRIMARY KEY, digest BLOB, record BLOB)')
+            self._new.execute("INSERT INTO meta VALUES ('version', ?)", (version,))
+            self._new.commit()
+        # the rollback journal keeps the last checkpoint intact if the
+        # build dies in the middle of writing
+        self._new.execute('PRAGMA synchronous = OFF')
+
+    def get(self, title: str, digest: bytes) -> bytes | None:
+        if self._old is None:
+            self.misses += 1
+            return None
+        row = self._old.execute('SELECT record FROM pages WHERE title = ? AND digest = ?', (title, digest)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, title: str, digest: bytes, record: bytes):
+        self._new.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?)', (title, digest, record))
+
+    def checkpoint(self):
+        self._new.commit()
+
+    def commit(self):
+        self._new.commit()
+        self.close()
+        os.replace(self._new_path, self._path)
+
+    def close(self):
+        if self._old is not None:
+            self._old.close()
+            self._old = None
+        if self._new is not None:
+            self._new.close()
+            self._new = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
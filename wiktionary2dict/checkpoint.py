@@ -0,0 +1,22 @@
+import json
+import os
+
+
+def save_checkpoint(path: str, state: dict):
+    # write then rename, a crash while saving leaves the previous checkpoint intact
+    temp = f'{path}.temp'
+    with open(temp, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def remove_checkpoint(path: str):
+    if os.path.exists(path):
+        os.remove(path)
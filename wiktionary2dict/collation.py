@@ -0,0 +1,108 @@
+"""
+The order of dictionary keys.
+
+MDict headers say KeyCaseSensitive="No", and MDict clients binary-search
+keys compared case- and punctuation-insensitively, so the keys of an .mdx
+have to be sorted by fold() and not by code point, or lookups of some
+words miss. Clients fold the keys as they are stored, which is why keys
+are plain titles and only escaped in record HTML: "don't" stored as
+"don&#x27;t" would fold to "donx27t", not where a search for it looks.
+sort_key() is the folded key and
+the key itself as one bytes value, so the ExternalSorter sorts by plain
+bytes comparison. Keys that fold to the same value are a single entry to
+a client, merge_collisions() makes them one.
+
+The keys of an .mdd are only compared case-insensitively (mdd_sort_key).
+"""
+
+import re
+import string
+from html import escape
+from typing import Iterable, Iterator, List, Tuple
+
+from .redirects import LINK
+
+COLLATIONS = ['mdict', 'codepoint']
+
+_PUNCTUATION = re.compile('[%s ]+' % re.escape(string.punctuation))
+
+
+def fold(key: str) -> str:
+    # what MDict compares keys as
+    return _PUNCTUATION.sub('', key.lower())
+
+
+def mdx_sort_key(key: str) -> Tuple[str, str]:
+    # ties broken by code point, so the order is total
+    return fold(key), key
+
+
+def mdd_sort_key(key: str) -> Tuple[str, str]:
+    return key.lower(), key
+
+
+def sort_key(key: bytes) -> bytes:
+    # mdx_sort_key of the UTF-8 key as bytes, UTF-8 bytes compare in code
+    # point order and keys never contain a null byte
+    return fold(key.decode()).encode() + b'\0' + key
+
+
+def split_sort_key(sort_key: bytes) -> Tuple[bytes, bytes]:
+    # (folded key, key)
+    folded, _, key = sort_key.partition(b'\0')
+    return folded, key
+
+
+def _merged_key(folded: bytes, keys: List[bytes]) -> bytes:
+    # the key that is its own fold ('s' of '-s', 'S' and 's'), else one
+    # without punctuation, else the first
+    for key in keys:
+        if key == folded:
+            return key
+    for key in keys:
+        if _PUNCTUATION.search(key.decode()) is None:
+            return key
+    return keys[0]
+
+
+def _merge(folded: bytes, group: List[Tuple[bytes, bytes]]) -> Tuple[bytes, bytes]:
+    # links to a key of the group and repeated records are dropped, the
+    # other links become links in the merged record, which is keyed by
+    # _merged_key of the whole group
+    pages = []
+    links = []
+    for key, record in group:
+        if not record.startswith(LINK):
+            if all(record != page for _, page in pages):
+                pages.append((key, record))
+            continue
+        target = record[len(LINK):]
+        if fold(target.decode()).encode() != folded:
+            links.append((key, target))
+    key = _merged_key(folded, [key for key, _ in group])
+    if len(pages) == 0:
+        return group[0] if len(links) == 0 else (key, LINK + links[0][1])
+    record = b''.join(record for _, record in pages)
+    for _, target in links:
+        target = escape(target.decode()).encode()
+        record += b'<p><a href="entry://%s">%s</a></p>' % (target, target)
+    return key, record
+
+
+def merge_collisions(entries: Iterable[Tuple[bytes, bytes]]) -> Iterator[Tuple[bytes, bytes]]:
+    """
+    (key, record) of the (sort_key(), record) entries, which are sorted,
+    with the entries whose keys fold to the same value merged into one.
+    """
+
+    group = []
+    group_folded = None
+    for sort_key_, record in entries:
+        folded, key = split_sort_key(sort_key_)
+        if folded != group_folded and len(group) > 0:
+            yield group[0] if len(group) == 1 else _merge(group_folded, group)
+            group = []
+        group_folded = folded
+        group.append((key, record))
+    if len(group) > 0:
+        yield group[0] if len(group) == 1 else _merge(group_folded, group)
@@ -0,0 +1,334 @@
+import bz2
+import io
+import mmap
+import os
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import BinaryIO, Callable, Iterator, List, NamedTuple, Tuple
+from xml.etree.ElementTree import Element, XMLPullParser
+
+from .pagefilter import PageFilter
+
+
+class BZ2OrXml(object):
+    def __init__(self, filename: str | BinaryIO):
+        # raw is the file on disk, its position is how much of the dump
+        # has been consumed, compressed or not. filename can also be a
+        # binary file of a dump, a download for example, which is left
+        # open, .bz2 ones are told apart by their magic bytes
+        self._owned = isinstance(filename, str)
+        self._wrapped = False
+        if self._owned:
+            self.raw = open(filename, 'rb')
+            compressed = filename.endswith('.bz2')
+        else:
+            self._wrapped = not hasattr(filename, 'peek')
+            self.raw = io.BufferedReader(filename) if self._wrapped else filename
+            compressed = self.raw.peek(3)[:3] == b'BZh'
+        if compressed:
+            self.file = bz2.BZ2File(self.raw)
+        else:
+            self.file = self.raw
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        if self.file is not self.raw:
+            self.file.close()
+        if self._owned:
+            self.raw.close()
+        elif self._wrapped:
+            self.raw.detach()
+
+
+class Page(NamedTuple):
+    ns: str
+    title: str
+    text: str | None
+    redirect: str | None
+
+
+def _local_name(tag: str) -> str:
+    # '{http://www.mediawiki.org/xml/export-0.10/}page' -> 'page'
+    return tag.rpartition('}')[2]
+
+
+def _page_record(page: Element) -> Page | None:
+    ns = None
+    title = None
+    redirect = None
+    model = None
+    text = None
+
+    for child in page:
+        name = _local_name(child.tag)
+        if name == 'ns':
+            ns = child.text
+        elif name == 'title':
+            title = child.text
+        elif name == 'redirect':
+            redirect = child.get('title')
+        elif name == 'revision':
+            for field in child:
+                name = _local_name(field.tag)
+                if name == 'model':
+                    model = field.text
+                elif name == 'text':
+                    text = field.text
+
+    if ns is None:
+        return None
+
+    if title is None or title == '':
+        return None
+
+    if ns == '0':
+        if model != 'wikitext':
+            return None
+    elif ns != '10':
+        text = None
+
+    return Page(ns, title, text, redirect)
+
+
+def _iter_chunks(f: BinaryIO, offset: int = 0, chunk_size: int = 256 * 1024) -> Iterator[Tuple[int, bytes]]:
+    # (offset, data) of the rest of f, which is at offset, cut right after
+    # a </page>, so every chunk but the first starts between two pages
+    buffer = b''
+    while True:
+        data = f.read(chunk_size)
+        if len(data) == 0:
+            if len(buffer) > 0:
+                yield offset, buffer
+            return
+        buffer += data
+        end = buffer.rfind(b'</page>')
+        if end < 0:
+            continue
+        end += len(b'</page>')
+        yield offset, buffer[:end]
+        offset += end
+        buffer = buffer[end:]
+
+
+def _iter_pages(
+    f: BinaryIO,
+    page_filter: PageFilter | None = None,
+    offset: int = 0,
+    mark: Callable[[int], any] = None,
+) -> Iterator[Page]:
+    # f is at offset, the start of the xml or between two pages. mark(offset)
+    # is called before the pages from offset on are yielded, once all the
+    # pages before it have been
+    parser = XMLPullParser(events=('start', 'end'))
+    if offset > 0:
+        # the root element is before offset
+        parser.feed(b'<mediawiki>')
+    root = None
+    for chunk_offset, data in _iter_chunks(f, offset):
+        if mark is not None:
+            mark(chunk_offset)
+        parser.feed(data if page_filter is None else page_filter.filter_fragment(data))
+        for (event, elem) in parser.read_events():
+            if event == 'start':
+                if root is None:
+                    root = elem
+                continue
+
+            if _local_name(elem.tag) != 'page':
+                continue
+
+            page = _page_record(elem)
+            elem.clear()
+            root.clear()
+            if page is not None:
+                yield page
+    parser.close()
+
+
+def iter_dump_pages(
+    path: str | BinaryIO,
+    progress: Callable[[int], any] = None,
+    page_filter: PageFilter | None = None,
+    offset: int = 0,
+    mark: Callable[[int], any] = None,
+) -> Iterator[Page]:
+    """
+    Streams the <page> elements of a MediaWiki xml dump (plain or .bz2), path
+    can also be a binary file of one (see BZ2OrXml).
+
+    Only the fields of one page are held at a time, every <page> is cleared
+    and dropped from the root once its Page record has been built, so memory
+    stays flat regardless of the dump size.
+    Text is only kept for wikitext pages in ns 0 and for templates (ns 10).
+
+    progress(bytes) is called after every page with the number of bytes of
+    the dump file read so far.
+
+    The <page>s page_filter rejects are dropped before they are parsed.
+
+    The xml is parsed in chunks that end after a </page>, mark(offset) is
+    called with the offset in the xml (decompressed for a .bz2) where the
+    next chunk starts, before its pages are yielded. Reading again from
+    such an offset yields the pages that followed it, a plain .xml seeks
+    there, a .bz2 is decompressed up to it but not parsed.
+    """
+
+    dump = BZ2OrXml(path)
+    with dump as f:
+        if offset > 0:
+            f.seek(offset)
+        for page in _iter_pages(f, page_filter, offset, mark):
+            if progress is not None:
+                progress(dump.raw.tell())
+            yield page
+
+
+def read_multistream_offsets(index_path: str) -> List[int]:
+    # each line of the index is 'offset:page_id:title', one line per page,
+    # all pages of a stream share the offset of that stream.
+    offsets = []
+    opener = bz2.open if index_path.endswith('.bz2') else open
+    with opener(index_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            offset = line.split(':', 1)[0]
+            if offset == '':
+                continue
+            offset = int(offset)
+            if len(offsets) == 0 or offsets[-1] != offset:
+                offsets.append(offset)
+    offsets.sort()
+    return offsets
+
+
+def parse_page_fragment(data: bytes, page_filter: PageFilter | None = None) -> List[Page]:
+    # data holds whole <page> elements, anything before the first and after
+    # the last one (the dump header or closing </mediawiki>) is dropped and
+    # the pages get a root of their own.
+    if page_filter is not None:
+        data = page_filter.filter_fragment(data)
+    first = data.find(b'<page>')
+    last = data.rfind(b'</page>')
+    if first < 0 or last < 0:
+        return []
+    return list(_iter_pages(io.BytesIO(b'<mediawiki>' + data[first:last + len(b'</page>')] + b'</mediawiki>')))
+
+
+def iter_xml_page_spans(path: str) -> Iterator[Tuple[int, int, Page]]:
+    # (byte offset, byte length, page) of every <page> of a plain .xml dump,
+    # '<page>' never occurs inside text, which is escaped.
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        start = m.find(b'<page>')
+        while start >= 0:
+            end = m.find(b'</page>', start)
+            if end < 0:
+                return
+            end += len(b'</page>')
+            for page in parse_page_fragment(m[start:end]):
+                yield start, end - start, page
+            start = m.find(b'<page>', end)
+
+
+def read_multistream_chunk(
+    path: str,
+    start: int,
+    end: int | None,
+    page_filter: PageFilter | None = None,
+) -> List[Page]:
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = bz2.decompress(f.read(-1 if end is None else end - start))
+    return parse_page_fragment(data, page_filter)
+
+
+def _read_multistream_range(
+    path: str,
+    start: int,
+    end: int | None,
+    page_filter: PageFilter | None,
+) -> Tuple[int, int | None, List[Page]]:
+    return start, end, read_multistream_chunk(path, start, end, page_filter)
+
+
+def iter_multistream_chunks(
+    path: str,
+    index_path: str,
+    jobs: int = 1,
+    ordered: bool = True,
+    page_filter: PageFilter | None = None,
+    offset: int = 0,
+) -> Iterator[Tuple[int, int | None, List[Page]]]:
+    """
+    Decompresses and parses the bz2 streams of a multistream dump, from the
+    one at offset on, yields (stream offset, next stream offset or None,
+    pages) per stream. See iter_multistream_pages.
+    """
+
+    offsets = read_multistream_offsets(index_path)
+    ranges = [
+        (start, offsets[i + 1] if i + 1 < len(offsets) else None)
+        for i, start in enumerate(offsets)
+        if start >= offset
+    ]
+
+    if jobs <= 1:
+        for start, end in ranges:
+            yield _read_multistream_range(path, start, end, page_filter)
+        return
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque()
+        for start, end in ranges:
+            pending.append(executor.submit(_read_multistream_range, path, start, end, page_filter))
+            if len(pending) < jobs * 2:
+                continue
+            if ordered:
+                yield pending.popleft().result()
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+                    yield future.result()
+        while len(pending) > 0:
+            yield pending.popleft().result()
+
+
+def iter_multistream_pages(
+    path: str,
+    index_path: str,
+    jobs: int = 1,
+    ordered: bool = True,
+    progress: Callable[[int], any] = None,
+    page_filter: PageFilter | None = None,
+    offset: int = 0,
+    mark: Callable[[int], any] = None,
+) -> Iterator[Page]:
+    """
+    Streams the pages of a pages-articles-multistream.xml.bz2 dump, using
+    the stream offsets of its -multistream-index.txt(.bz2) companion.
+
+    Every bz2 stream is decompressed and parsed independently, in a pool of
+    jobs worker processes when jobs > 1. With ordered the pages come out in
+    dump order, otherwise in the order the streams finish, which is fine
+    when the pages are sorted afterwards anyway.
+
+    progress(bytes) is called after every stream with the total size of the
+    streams read so far. page_filter is applied by the worker processes,
+    before the pages of a stream are parsed.
+
+    mark(offset) is called with the offset of every stream before its pages
+    are yielded, reading again from such an offset skips the streams before
+    it (ordered only).
+    """
+
+    size = os.path.getsize(path) if progress is not None else 0
+    # the streams before offset count as read
+    consumed = offset
+    for start, end, pages in iter_multistream_chunks(path, index_path, jobs, ordered, page_filter, offset):
+        if mark is not None:
+            mark(start)
+        yield from pages
+        if progress is not None:
+            consumed += (size if end is None else end) - start
+            progress(consumed)
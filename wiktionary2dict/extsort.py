@@ -0,0 +1,134 @@
+import heapq
+import os
+import struct
+import tempfile
+from typing import BinaryIO, Iterator, List, Tuple
+
+# key length, value length
+_RUN_ENTRY = struct.Struct('>II')
+
+# rough per entry cost of a (bytes, bytes) tuple held in a list,
+# on top of the key and value bytes themselves
+_ENTRY_OVERHEAD = 160
+
+
+class ExternalSorter(object):
+    """
+    Sorts (key, value) entries by key within a memory budget.
+
+    The value travels with its key, so once sorted the entries can be
+    consumed in one sequential pass without looking anything up.
+    Entries are buffered until their estimated size reaches memory_budget
+    bytes, then the buffer is sorted and spilled as a run of packed binary
+    entries to an anonymous temporary file in tmp_dir. Iterating the sorter
+    k-way merges the runs with heapq.merge. The merge is stable, equal keys
+    come out in the order they were added, the same as list.sort().
+    If nothing was spilled the buffer is sorted in memory. The sorter can
+    be iterated more than once, one iteration at a time.
+
+    With run_prefix the runs are named files f'{run_prefix}{n}' that outlive
+    the sorter, checkpoint() spills the buffer and returns their (absolute)
+    paths, and a later sorter created with runs=those paths carries on from
+    there. The runs a sorter spilled after its last checkpoint are removed
+    by the one that carries on.
+    """
+
+    def __init__(
+        self,
+        memory_budget: int = 256 * 1024 * 1024,
+        tmp_dir: str | None = None,
+        run_prefix: str | None = None,
+        runs: List[str] = (),
+    ):
+        self._memory_budget = memory_budget
+        self._tmp_dir = tmp_dir
+        # the paths of the runs do not depend on the working directory
+        self._run_prefix = os.path.abspath(run_prefix) if run_prefix is not None else None
+        self._buffer = []
+        self._buffer_size = 0
+        self._run_paths = list(runs)
+        self._runs: List[BinaryIO] = [open(path, 'rb') for path in self._run_paths]
+        self._num_entries = 0
+        if self._run_prefix is not None:
+            n = len(self._runs)
+            while os.path.exists(f'{self._run_prefix}{n}'):
+                os.remove(f'{self._run_prefix}{n}')
+                n += 1
+
+    def __len__(self):
+        return self._num_entries
+
+    def add(self, key: bytes, value: bytes):
+        self._buffer.append((key, value))
+        self._buffer_size += len(key) + len(value) + _ENTRY_OVERHEAD
+        self._num_entries += 1
+        if self._buffer_size >= self._memory_budget:
+            self._spill()
+
+    def _spill(self):
+        if len(self._buffer) == 0:
+            return
+        self._buffer.sort(key=_entry_key)
+        if self._run_prefix is None:
+            run = tempfile.TemporaryFile(dir=self._tmp_dir)
+        else:
+            path = f'{self._run_prefix}{len(self._runs)}'
+            run = open(path, 'wb+')
+            self._run_paths.append(path)
+        for key, value in self._buffer:
+            run.write(_RUN_ENTRY.pack(len(key), len(value)))
+            run.write(key)
+            run.write(value)
+        run.flush()
+        if self._run_prefix is not None:
+            os.fsync(run.fileno())
+        run.seek(0)
+        self._runs.append(run)
+        self._buffer = []
+        self._buffer_size = 0
+
+    def __iter__(self) -> Iterator[Tuple[bytes, bytes]]:
+        if len(self._runs) == 0:
+            self._buffer.sort(key=_entry_key)
+            yield from self._buffer
+            return
+
+        self._spill()
+        for run in self._runs:
+            run.seek(0)
+        yield from heapq.merge(*[_read_run(run) for run in self._runs], key=_entry_key)
+
+    def checkpoint(self) -> List[str]:
+        self._spill()
+        return list(self._run_paths)
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._buffer = []
+
+    def remove_runs(self):
+        self.close()
+        for path in self._run_paths:
+            os.remove(path)
+        self._run_paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
+
+
+def _entry_key(entry: Tuple[bytes, bytes]) -> bytes:
+    return entry[0]
+
+
+def _read_run(run: BinaryIO) -> Iterator[Tuple[bytes, bytes]]:
+    while True:
+        header = run.read(_RUN_ENTRY.size)
+        if len(header) == 0:
+            return
+        key_len, value_len = _RUN_ENTRY.unpack(header)
+        yield (run.read(key_len), run.read(value_len))
@@ -0,0 +1,124 @@
+"""
+.mdd resource files (images, css, js, audio...) from directories and files.
+
+    python -m wiktionary2dict.mdd data/sample.mdd resources/
+    python -m wiktionary2dict.mdd data/sample.mdd resources/ style.css
+
+A directory contributes the files under it, keyed by their path relative
+to the directory, a file is keyed by its name, so resources/img/a.png is
+\\img\\a.png, as MDict looks resources up. Files are read in chunks as the
+.mdd is written, so they never have to fit in memory.
+"""
+
+import argparse
+import os
+import tempfile
+import zlib
+from typing import Iterable, Iterator, List, Tuple
+
+from .collation import mdd_sort_key
+from .writemdict.writemdict import COMPRESSION_TYPES, ZLIB_STRATEGIES, FileRecord, MDictWriter
+
+
+def resource_key(relpath: str) -> str:
+    return '\\' + relpath.replace(os.sep, '\\').lstrip('\\')
+
+
+def iter_resources(sources: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    # (key, path) of every file of sources, directories walked in name order
+    for source in sources:
+        if not os.path.isdir(source):
+            yield resource_key(os.path.basename(source)), source
+            continue
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                yield resource_key(os.path.relpath(path, source)), path
+
+
+def build_mdd(
+    path: str,
+    sources: Iterable[str],
+    title: str,
+    description: str = '',
+    block_size: int = 64 * 1024,
+    chunk_size: int = 1024 * 1024,
+    compression_type: int = 2,
+    compression_level: int = -1,
+    compression_strategy: int = zlib.Z_DEFAULT_STRATEGY,
+    compress_threads: int = 1,
+) -> MDictWriter:
+    """
+    Writes the files of sources to the .mdd at path and returns the writer.
+    When two sources have a file with the same key, the first one is kept.
+    Identical files are each written, clients take the size of a resource
+    from the offset of the next one. The compression arguments are those of
+    MDictWriter, most images and audio are compressed already, so
+    compression_type 0 makes a slightly larger .mdd much faster.
+    """
+
+    resources: List[Tuple[str, str, int]] = []
+    keys = set()
+    for key, file in iter_resources(sources):
+        if key not in keys:
+            keys.add(key)
+            resources.append((key, file, os.path.getsize(file)))
+    resources.sort(key=lambda resource: mdd_sort_key(resource[0]))
+
+    records = [(key, FileRecord(file, size, chunk_size=chunk_size)) for key, file, size in resources]
+    with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path))) as output_key_blocks:
+        writer = MDictWriter(
+            title=title,
+            description=description,
+            output_key_blocks=output_key_blocks,
+            is_mdd=True,
+            block_size=block_size,
+            compression_type=compression_type,
+            compression_level=compression_level,
+            compression_strategy=compression_strategy,
+            compress_threads=compress_threads,
+        )
+        for key, record in records:
+            writer.add({key: record})
+        writer.commit()
+        with open(path, 'wb') as output:
+            writer.write(output, (record for _, record in records))
+    return writer
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m wiktionary2dict.mdd')
+    parser.add_argument('mdd_file')
+    parser.add_argument('sources', nargs='+', help='directories and files')
+    parser.add_argument('--title', default='')
+    parser.add_argument('--description', default='')
+    parser.add_argument('--block-size', type=int, default=64 * 1024,
+                        help='uncompressed size in bytes at which key and record blocks are cut')
+    parser.add_argument('--chunk-size', type=int, default=1024 * 1024,
+                        help='bytes read from a file at a time')
+    parser.add_argument('--compression', choices=list(COMPRESSION_TYPES), default='zlib')
+    parser.add_argument('--compression-level', type=int, default=-1,
+                        help='zlib level, 0-9, -1 for the default')
+    parser.add_argument('--compression-strategy', choices=list(ZLIB_STRATEGIES), default='default')
+    parser.add_argument('--compress-threads', type=int, default=1,
+                        help='threads compressing blocks, 0 for one per CPU')
+    args = parser.parse_args(argv)
+    assert (args.block_size > 0)
+    assert (args.chunk_size > 0)
+    assert (-1 <= args.compression_level <= 9)
+    assert (args.compress_threads >= 0)
+    if args.compress_threads == 0:
+        args.compress_threads = os.cpu_count() or 1
+    for source in args.sources:
+        assert (os.path.exists(source))
+
+    writer = build_mdd(args.mdd_file, args.sources, args.title, args.description,
+                       args.block_size, args.chunk_size,
+                       COMPRESSION_TYPES[args.compression], args.compression_level,
+                       ZLIB_STRATEGIES[args.compression_strategy], args.compress_threads)
+    print(f'{len(writer)} resources written to {args.mdd_file}')
+
+
+if __name__ == '__main__':
+    main()
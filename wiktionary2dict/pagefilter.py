@@ -0,0 +1,174 @@
+import re
+from html import unescape
+from typing import BinaryIO, Dict, Iterable, List
+from xml.sax.saxutils import escape
+
+from .renderer import iter_sections
+
+_RAW_NS = re.compile(rb'<ns>([^<]*)</ns>')
+_RAW_TITLE = re.compile(rb'<title>([^<]*)</title>')
+
+
+class PageFilter(object):
+    """
+    Which pages of a dump are read at all, and which language sections of
+    a word page are rendered.
+
+    Pages are accepted when their namespace is one of namespaces (all when
+    None) and not one of exclude_namespaces. Word pages (ns 0) must also
+    have a title starting with one of title_prefixes (when there are any),
+    matching title_pattern and not matching exclude_title_pattern (re
+    search). With languages, only the level 2 sections with one of those
+    headings (==English==) are kept of a word page, pages with none of
+    them are dropped, redirects are kept.
+
+    The readers of dumpreader apply accepts_raw() to the bytes of every
+    <page> before it is parsed, so a rejected page costs a few regex
+    searches instead of building its elements, and its text is never
+    decoded. Languages are first checked there with a regex on the raw
+    text, then cut() drops the other sections before the page is rendered.
+    """
+
+    def __init__(
+        self,
+        namespaces: Iterable[str] | None = None,
+        exclude_namespaces: Iterable[str] = (),
+        title_prefixes: Iterable[str] = (),
+        title_pattern: str | None = None,
+        exclude_title_pattern: str | None = None,
+        languages: Iterable[str] = (),
+    ):
+        self.namespaces = None if namespaces is None else sorted(set(namespaces))
+        self.exclude_namespaces = sorted(set(exclude_namespaces))
+        self.title_prefixes = tuple(title_prefixes)
+        self.title_pattern = title_pattern
+        self.exclude_title_pattern = exclude_title_pattern
+        self.languages = sorted(set(languages))
+        self._title = re.compile(title_pattern) if title_pattern is not None else None
+        self._exclude_title = re.compile(exclude_title_pattern) if exclude_title_pattern is not None else None
+        self._raw_language = None
+        if len(self.languages) > 0:
+            names = b'|'.join(re.escape(escape(language).encode()) for language in self.languages)
+            # at the start of a line, or of the text right after <text ...>
+            self._raw_language = re.compile(rb'(?:^|>)==[ \t]*(?:' + names + rb')[ \t]*==[ \t]*$', re.M)
+
+    def spec(self) -> Dict:
+        # what the filter was made from, for checkpoints and cache versions
+        return {
+            'namespaces': self.namespaces,
+            'exclude_namespaces': self.exclude_namespaces,
+            'title_prefixes': list(self.title_prefixes),
+            'title_pattern': self.title_pattern,
+            'exclude_title_pattern': self.exclude_title_pattern,
+            'languages': self.languages,
+        }
+
+    def accepts(self, ns: str, title: str) -> bool:
+        if self.namespaces is not None and ns not in self.namespaces:
+            return False
+        if ns in self.exclude_namespaces:
+            return False
+        if ns != '0':
+            return True
+        if len(self.title_prefixes) > 0 and not title.startswith(self.title_prefixes):
+            return False
+        if self._title is not None and self._title.search(title) is None:
+            return False
+        if self._exclude_title is not None and self._exclude_title.search(title) is not None:
+            return False
+        return True
+
+    def accepts_raw(self, page: bytes) -> bool:
+        # page is a whole <page> element as it is in the dump, pages the
+        # filter can not make sense of are left to the parser
+        head_end = page.find(b'<revision>')
+        head = page[:head_end] if head_end >= 0 else page
+        ns = _RAW_NS.search(head)
+        title = _RAW_TITLE.search(head)
+        if ns is None or title is None:
+            return True
+        ns = ns.group(1).decode()
+        if not self.accepts(ns, unescape(title.group(1).decode())):
+            return False
+        if ns == '0' and self._raw_language is not None and b'<redirect' not in head:
+            return self._raw_language.search(page) is not None
+        return True
+
+    def filter_fragment(self, data: bytes) -> bytes:
+        # data without the <page>s accepts_raw() rejects, anything around
+        # and between the pages is kept
+        out = []
+        pos = 0
+        while True:
+            start = data.find(b'<page>', pos)
+            if start < 0:
+                break
+            end = data.find(b'</page>', start)
+            if end < 0:
+                break
+            end += len(b'</page>')
+            out.append(data[pos:start])
+            page = data[start:end]
+            if self.accepts_raw(page):
+                out.append(page)
+            pos = end
+        out.append(data[pos:])
+        return b''.join(out)
+
+    def stream(self, f: BinaryIO) -> 'FilteredDump':
+        return FilteredDump(f, self)
+
+    def cut(self, text: str) -> str | None:
+        # the lead and the sections of languages, None without any of them
+        if len(self.languages) == 0:
+            return text
+        pieces: List[str] = []
+        keep = True
+        found = False
+        start = 0
+        for section in iter_sections(text):
+            if 0 < section.level <= 2:
+                keep = section.title.strip() in self.languages
+                found = found or keep
+            if keep:
+                pieces.append(text[start:section.end])
+            start = section.end
+        return ''.join(pieces) if found else None
+
+
+class FilteredDump(object):
+    # a file of the bytes of f without the <page>s page_filter rejects,
+    # read(size) is all the xml parsers need
+
+    def __init__(self, f: BinaryIO, page_filter: PageFilter, chunk_size: int = 1024 * 1024):
+        self._file = f
+        self._filter = page_filter
+        self._chunk_size = chunk_size
+        # read from f, not yet filtered, and filtered, not yet read
+        self._buffer = bytearray()
+        self._out = bytearray()
+        self._eof = False
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._eof and (size < 0 or len(self._out) < size):
+            self._fill()
+        if size < 0 or size > len(self._out):
+            size = len(self._out)
+        data = bytes(self._out[:size])
+        del self._out[:size]
+        return data
+
+    def _fill(self):
+        chunk = self._file.read(self._chunk_size)
+        if len(chunk) == 0:
+            self._eof = True
+            self._out += self._filter.filter_fragment(bytes(self._buffer))
+            self._buffer.clear()
+            return
+        self._buffer += chunk
+        # up to the end of the last whole page, pages do not nest
+        end = self._buffer.rfind(b'</page>')
+        if end >= 0:
+            end += len(b'</page>')
+            self._out += self._filter.filter_fragment(bytes(self._buffer[:end]))
+            del self._buffer[:end]
@@ -0,0 +1,181 @@
+import os
+import sqlite3
+from typing import Iterable, Iterator, NamedTuple
+
+from .dumpreader import Page, iter_multistream_chunks, iter_xml_page_spans, parse_page_fragment, read_multistream_chunk
+
+
+class IndexEntry(NamedTuple):
+    ns: str
+    # byte offset and length of the <page> in a plain .xml dump, or of the
+    # bz2 stream holding it in a multistream dump (length -1 for the last one)
+    offset: int
+    length: int
+    text_length: int
+    redirect: str | None
+
+
+class PageIndex(object):
+    """
+    Title -> IndexEntry of every page of a dump, in a sqlite file at path.
+
+    Titles are the primary key, so a lookup is a B-tree search and get()
+    reads back a single page (plain .xml) or a single bz2 stream
+    (multistream) instead of scanning the dump. The dump the index was
+    built from is kept in the file, see build_page_index.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pages ('
+            'title TEXT PRIMARY KEY, ns TEXT, offset INTEGER, length INTEGER, text_length INTEGER, redirect TEXT)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS pages_offset ON pages (offset)')
+        # the pages of the last bz2 stream read by get()
+        self._stream_offset = None
+        self._stream_pages = {}
+
+    def meta(self, key: str) -> str | None:
+        row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def set_meta(self, key: str, value: str | None):
+        self._db.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, value))
+
+    @property
+    def dump_path(self) -> str | None:
+        return self.meta('dump_path')
+
+    @property
+    def multistream_index(self) -> str | None:
+        return self.meta('multistream_index')
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def __contains__(self, title: str):
+        return self.entry(title) is not None
+
+    def add(self, title: str, entry: IndexEntry):
+        self._db.execute('INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)', (title, *entry))
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
+
+    def entry(self, title: str) -> IndexEntry | None:
+        row = self._db.execute(
+            'SELECT ns, offset, length, text_length, redirect FROM pages WHERE title = ?', (title,)).fetchone()
+        return IndexEntry(*row) if row is not None else None
+
+    def titles(self, ns: str | None = None, prefix: str | None = None) -> Iterator[str]:
+        # in dump order, which keeps get() on the same bz2 stream for a while
+        query = 'SELECT title FROM pages WHERE 1'
+        params = []
+        if ns is not None:
+            query += ' AND ns = ?'
+            params.append(ns)
+        if prefix is not None:
+            query += " AND title >= ? AND title < ?"
+            params += [prefix, prefix + '\U0010ffff']
+        query += ' ORDER BY offset, rowid'
+        for (title,) in self._db.execute(query, params).fetchall():
+            yield title
+
+    def get(self, title: str) -> Page | None:
+        entry = self.entry(title)
+        if entry is None:
+            return None
+
+        if self.multistream_index is None:
+            with open(self.dump_path, 'rb') as f:
+                f.seek(entry.offset)
+                pages = parse_page_fragment(f.read(entry.length))
+            return pages[0] if len(pages) > 0 else None
+
+        if self._stream_offset != entry.offset:
+            end = None if entry.length < 0 else entry.offset + entry.length
+            pages = read_multistream_chunk(self.dump_path, entry.offset, end)
+            self._stream_pages = {page.title: page for page in pages}
+            self._stream_offset = entry.offset
+        return self._stream_pages.get(title)
+
+    def iter_pages(self, titles: Iterable[str]) -> Iterator[Page]:
+        # titles that are not in the index are skipped
+        for title in titles:
+            page = self.get(title)
+            if page is not None:
+                yield page
+
+
+def _abspath(path: str | None) -> str | None:
+    return os.path.abspath(path) if path is not None else None
+
+
+def _dump_signature(dump_path: str) -> str:
+    stat = os.stat(dump_path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+def build_page_index(
+    path: str,
+    dump_path: str,
+    multistream_index: str | None = None,
+    jobs: int = 1,
+) -> PageIndex:
+    """
+    Indexes every page of a plain .xml dump, or of a multistream .bz2 dump
+    with its index (streams are read by jobs processes). A plain .bz2 dump
+    can't be indexed, it has nothing to seek to.
+    """
+
+    if multistream_index is None and dump_path.endswith('.bz2'):
+        raise ValueError('a page index needs a plain .xml dump or a multistream .bz2 dump with its index')
+
+    if os.path.exists(path):
+        os.remove(path)
+    index = PageIndex(path)
+    index.set_meta('dump_path', os.path.abspath(dump_path))
+    index.set_meta('multistream_index', _abspath(multistream_index))
+    index.set_meta('dump_signature', _dump_signature(dump_path))
+
+    def add(offset: int, length: int, page: Page):
+        text_length = len(page.text) if page.text is not None else 0
+        index.add(page.title, IndexEntry(page.ns, offset, length, text_length, page.redirect))
+
+    if multistream_index is None:
+        for offset, length, page in iter_xml_page_spans(dump_path):
+            add(offset, length, page)
+    else:
+        for start, end, pages in iter_multistream_chunks(dump_path, multistream_index, jobs, ordered=False):
+            for page in pages:
+                add(start, -1 if end is None else end - start, page)
+
+    index.commit()
+    return index
+
+
+def open_page_index(
+    path: str,
+    dump_path: str,
+    multistream_index: str | None = None,
+    jobs: int = 1,
+) -> PageIndex:
+    # reuses the index at path if it was built from this very dump
+    if os.path.exists(path):
+        index = PageIndex(path)
+        if index.dump_path == os.path.abspath(dump_path) \
+                and index.multistream_index == _abspath(multistream_index) \
+                and index.meta('dump_signature') == _dump_signature(dump_path):
+            return index
+        index.close()
+    return build_page_index(path, dump_path, multistream_index, jobs)
@@ -0,0 +1,338 @@
+import bisect
+import mmap
+import re
+import struct
+import zlib
+from collections import OrderedDict
+from html import unescape
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from .collation import fold, mdd_sort_key, mdx_sort_key
+from .writemdict import lzo
+
+_HEADER_ATTRIBUTE = re.compile(r'(\w+)="(.*?)"', re.S)
+_LINK = '@@@LINK='
+
+
+def _in_order(keys: List[str], key=None) -> bool:
+    keys = keys if key is None else [key(k) for k in keys]
+    return all(a <= b for a, b in zip(keys, keys[1:]))
+
+
+class KeyBlock(NamedTuple):
+    num_entries: int
+    first_key: str
+    last_key: str
+    # of the compressed block in the file
+    offset: int
+    size_compressed: int
+    size: int
+
+
+def decompress_block(block: bytes, size: int) -> bytes:
+    # <L compression type, >L adler32 of the uncompressed data, then the
+    # data, size bytes once decompressed
+    compression_type, = struct.unpack('<L', block[:4])
+    checksum, = struct.unpack('>L', block[4:8])
+    if compression_type == 0:
+        data = bytes(block[8:])
+    elif compression_type == 1:
+        data = lzo.decompress(block[8:], size)
+    elif compression_type == 2:
+        try:
+            data = zlib.decompress(block[8:])
+        except zlib.error as e:
+            raise ValueError(f'corrupt block: {e}')
+    else:
+        raise ValueError(f'unsupported compression type {compression_type}')
+    if zlib.adler32(data) & 0xffffffff != checksum:
+        raise ValueError('block checksum mismatch')
+    return data
+
+
+class MDictReader(object):
+    """
+    Read-only view of an .mdx or .mdd file (format 2.0, not encrypted), as
+    MDictWriter writes them.
+
+    The file is mmapped and only the header, the key block index and the
+    record block index are parsed up front. lookup() binary-searches the
+    key block index, then the one key block that can hold the key, and
+    decompresses only the record block(s) the record is in. Decompressed
+    blocks are kept in an LRU of max_blocks blocks.
+
+    The keys of an .mdx are in the order of collation.mdx_sort_key, as
+    MDict clients expect and StripKey="Yes" in the header says, or in code
+    point order, as .mdx files written with --collation codepoint (and
+    before there was a choice) are. Without StripKey="Yes" the order is
+    told from the keys when the file is opened, keys that fit both orders
+    are taken to be in the folded one, and it is kept in collation. The
+    keys of an .mdd are in the order of mdd_sort_key. Except in code point
+    order, lookup() finds the keys that fold to the same value as the one
+    looked up, as clients do, 'Free' finds 'free'. Records of an .mdx are
+    strings without their terminating null character, those of an .mdd
+    bytes.
+    """
+
+    def __init__(self, path: str, max_blocks: int = 64):
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._blocks = OrderedDict()
+        self._max_blocks = max_blocks
+        m = self._mmap
+
+        header_len, = struct.unpack('>L', m[0:4])
+        header = m[4:4 + header_len]
+        checksum, = struct.unpack('<L', m[4 + header_len:8 + header_len])
+        if zlib.adler32(header) & 0xffffffff != checksum:
+            raise ValueError('header checksum mismatch')
+        header = header.decode('utf_16_le').rstrip('\0')
+        self.is_mdd = header.startswith('<Library_Data')
+        self.header: Dict[str, str] = {name: unescape(value) for name, value in _HEADER_ATTRIBUTE.findall(header)}
+        if self.header.get('Encrypted', '0') not in ('0', 'No'):
+            raise ValueError('encrypted dictionaries are not supported')
+        if float(self.header.get('GeneratedByEngineVersion', '0')) < 2.0:
+            raise ValueError('only version 2.0 dictionaries are supported')
+
+        if self.is_mdd or self.header.get('Encoding', '').upper() in ('UTF-16', 'UTF-16LE'):
+            self._encoding = 'utf_16_le'
+            self._unit = 2
+        else:
+            self._encoding = self.header.get('Encoding') or 'utf_8'
+            self._unit = 1
+        pos = 8 + header_len
+
+        preamble = m[pos:pos + 40]
+        checksum, = struct.unpack('>L', m[pos + 40:pos + 44])
+        if zlib.adler32(preamble) & 0xffffffff != checksum:
+            raise ValueError('key preamble checksum mismatch')
+        num_key_blocks, self._num_entries, index_size, index_len, key_blocks_len = struct.unpack('>QQQQQ', preamble)
+        pos += 44
+
+        index = decompress_block(m[pos:pos + index_len], index_size)
+        pos += index_len
+        self._key_blocks: List[KeyBlock] = []
+        offset = pos
+        i = 0
+        for _ in range(num_key_blocks):
+            num_entries, first_len = struct.unpack('>QH', index[i:i + 10])
+            i += 10
+            first_key = index[i:i + first_len * self._unit].decode(self._encoding)
+            i += (first_len + 1) * self._unit
+            last_len, = struct.unpack('>H', index[i:i + 2])
+            i += 2
+            last_key = index[i:i + last_len * self._unit].decode(self._encoding)
+            i += (last_len + 1) * self._unit
+            size_compressed, size = struct.unpack('>QQ', index[i:i + 16])
+            i += 16
+            self._key_blocks.append(KeyBlock(num_entries, first_key, last_key, offset, size_compressed, size))
+            offset += size_compressed
+        if self.is_mdd:
+            self.collation = 'mdd'
+            self._fold, self._sort_key = str.lower, mdd_sort_key
+        elif self._in_code_point_order():
+            self.collation = 'codepoint'
+            self._fold, self._sort_key = None, None
+        else:
+            self.collation = 'mdict'
+            self._fold, self._sort_key = fold, mdx_sort_key
+        self._last_keys = [self._key(block.last_key) for block in self._key_blocks]
+        pos += key_blocks_len
+
+        num_record_blocks, _, record_index_len, _ = struct.unpack('>QQQQ', m[pos:pos + 32])
+        pos += 32
+        # (file offset, size, uncompressed size) and uncompressed start
+        # offset of each record block
+        self._record_blocks: List[Tuple[int, int, int]] = []
+        self._record_starts: List[int] = []
+        offset = pos + record_index_len
+        start = 0
+        for i in range(num_record_blocks):
+            size_compressed, size = struct.unpack('>QQ', m[pos + 16 * i:pos + 16 * i + 16])
+            self._record_blocks.append((offset, size_compressed, size))
+            self._record_starts.append(start)
+            offset += size_compressed
+            start += size
+        self._records_size = start
+
+    def __len__(self):
+        return self._num_entries
+
+    def __contains__(self, key: str):
+        for _ in self._matches(key):
+            return True
+        return False
+
+    def close(self):
+        self._blocks.clear()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
+
+    def _block(self, kind: str, i: int):
+        cached = self._blocks.get((kind, i))
+        if cached is not None:
+            self._blocks.move_to_end((kind, i))
+            return cached
+
+        if kind == 'key':
+            block = self._key_blocks[i]
+            data = decompress_block(self._mmap[block.offset:block.offset + block.size_compressed], block.size)
+            cached = self._parse_key_block(data)
+        else:
+            offset, size_compressed, size = self._record_blocks[i]
+            cached = decompress_block(self._mmap[offset:offset + size_compressed], size)
+
+        self._blocks[(kind, i)] = cached
+        if len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+        return cached
+
+    def _parse_key_block(self, data: bytes) -> Tuple[List[str], List[int]]:
+        # (keys, uncompressed record offsets)
+        keys = []
+        offsets = []
+        null = b'\0' * self._unit
+        i = 0
+        while i < len(data):
+            offsets.append(struct.unpack('>Q', data[i:i + 8])[0])
+            i += 8
+            end = data.find(null, i)
+            while self._unit > 1 and end >= 0 and (end - i) % self._unit != 0:
+                end = data.find(null, end + 1)
+            if end < 0:
+                end = len(data)
+            keys.append(data[i:end].decode(self._encoding))
+            i = end + self._unit
+        return keys, offsets
+
+    def _in_code_point_order(self) -> bool:
+        # the first and last keys of the blocks, and the keys of the first
+        # block, that are in folded order are searched folded, whether or
+        # not they are in code point order too, as clients search them
+        if self.header.get('StripKey') == 'Yes':
+            return False
+        keys = [key for block in self._key_blocks for key in (block.first_key, block.last_key)]
+        if not _in_order(keys):
+            return False
+        if _in_order(keys, mdx_sort_key) and len(self._key_blocks) > 0:
+            return not _in_order(self._block('key', 0)[0], mdx_sort_key)
+        return True
+
+    def _key(self, key: str):
+        # what keys are compared as, see _entries
+        return key if self._sort_key is None else self._sort_key(key)
+
+    def _entries(self, start=None) -> Iterator[Tuple[str, int, int]]:
+        # (key, record start, record end) from the first key >= start, a
+        # _key(), in file order
+        if start is None:
+            i, j = 0, 0
+        else:
+            i = bisect.bisect_left(self._last_keys, start)
+            if i == len(self._key_blocks):
+                return
+            j = bisect.bisect_left(self._block('key', i)[0], start, key=self._sort_key)
+
+        while i < len(self._key_blocks):
+            keys, offsets = self._block('key', i)
+            while j < len(keys):
+                key = keys[j]
+                if j + 1 < len(offsets):
+                    end = offsets[j + 1]
+                elif i + 1 < len(self._key_blocks):
+                    end = self._block('key', i + 1)[1][0]
+                else:
+                    end = self._records_size
+                yield key, offsets[j], end
+                j += 1
+            i += 1
+            j = 0
+
+    def _record(self, start: int, end: int) -> str | bytes:
+        i = bisect.bisect_right(self._record_starts, start) - 1
+        data = self._block('record', i)
+        data = data[start - self._record_starts[i]:end - self._record_starts[i]]
+        # a record of a file from another writer may span blocks
+        while self._record_starts[i] + len(self._block('record', i)) < end:
+            i += 1
+            data += self._block('record', i)[:end - self._record_starts[i]]
+        if self.is_mdd:
+            return data
+        record = data.decode(self._encoding)
+        return record[:-1] if record.endswith('\0') else record
+
+    def _matches(self, key: str, prefix: bool = False) -> Iterator[Tuple[str, int, int]]:
+        # the _entries() equal to key, or starting with it, once folded
+        if self._fold is None:
+            for entry in self._entries(key):
+                if not (entry[0].startswith(key) if prefix else entry[0] == key):
+                    return
+                yield entry
+            return
+        folded = self._fold(key)
+        for entry in self._entries((folded,)):
+            entry_folded = self._fold(entry[0])
+            if not (entry_folded.startswith(folded) if prefix else entry_folded == folded):
+                return
+            yield entry
+
+    def lookup(self, key: str) -> List[str | bytes]:
+        # the records of every entry with this key, usually one
+        return [self._record(start, end) for _, start, end in self._matches(key)]
+
+    def iter_prefix(self, prefix: str) -> Iterator[Tuple[str, str | bytes]]:
+        # (key, record) of the keys starting with prefix, in order
+        for key, start, end in self._matches(prefix, prefix=True):
+            yield key, self._record(start, end)
+
+    def keys(self) -> Iterator[str]:
+        for key, _, _ in self._entries():
+            yield key
+
+    def items(self) -> Iterator[Tuple[str, str | bytes]]:
+        for key, start, end in self._entries():
+            yield key, self._record(start, end)
+
+
+def _links_to(reader: MDictReader, link: str | bytes, record: str | bytes) -> bool:
+    if reader.is_mdd or not link.startswith(_LINK) or record.startswith(_LINK):
+        return False
+    return record in reader.lookup(link[len(_LINK):])
+
+
+def verify_dict(path: str, entries: Iterable[Tuple[bytes, bytes]], encoding: str = 'utf_8') -> int:
+    """
+    Reads the dictionary at path back and checks that its entries are
+    exactly entries, the (key, record) bytes it was written from, in order.
+    A @@@LINK= record in place of another one, as MDictWriter(dedup=True)
+    writes, has to link to a key with that record. Returns the number of
+    entries, raises ValueError at the first mismatch.
+    """
+
+    n = 0
+    with MDictReader(path) as reader:
+        read = reader.items()
+        for key, record in entries:
+            key = key.decode(encoding)
+            got = next(read, None)
+            if got is None:
+                raise ValueError(f'{path}: entry {n} ({key!r}) is missing')
+            got_key, got_record = got
+            if not reader.is_mdd:
+                record = record.decode(encoding)
+            if got_key != key:
+                raise ValueError(f'{path}: entry {n} is {got_key!r}, expected {key!r}')
+            if got_record != record and not _links_to(reader, got_record, record):
+                raise ValueError(f'{path}: the record of entry {n} ({key!r}) differs')
+            n += 1
+        if next(read, None) is not None:
+            raise ValueError(f'{path}: more than {n} entries')
+        if n != len(reader):
+            raise ValueError(f'{path}: {n} entries read, {len(reader)} in the key preamble')
+    return n
@@ -0,0 +1,67 @@
+"""
+Redirect pages of a dump, resolved to the pages they end at.
+
+A redirect is rendered as a @@@LINK=target record, which clients follow
+one link at a time, so a redirect to a redirect takes two lookups and a
+cycle of them never ends. The RedirectResolver collects the redirects
+while the dump is parsed instead, and once it has been, links every one
+of them straight to the page at the end of its chain. Redirects that are
+part of a cycle, or whose chain is longer than max_depth, lead nowhere
+and are dropped. A target that is not a redirect is taken to be a page,
+whether or not the dump (or the filter) has it, as with @@@LINK records.
+"""
+
+from typing import Dict, Iterator, Tuple
+
+LINK = b'@@@LINK='
+
+
+class RedirectResolver(object):
+    # keys are titles, as in the dictionary
+
+    def __init__(self, max_depth: int = 8, redirects: Dict[str, str] | None = None):
+        self.max_depth = max_depth
+        self._targets: Dict[str, str] = dict(redirects or {})
+        # counts of the last resolved()
+        self.shortened = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._targets)
+
+    def add(self, key: str, target: str):
+        self._targets[key] = target
+
+    def state(self) -> Dict[str, str]:
+        # what a resolver created with redirects=state() carries on from
+        return self._targets
+
+    def resolve(self, key: str) -> str | None:
+        """
+        The key of the page at the end of the redirects from key, None when
+        they run in a cycle or for more than max_depth links.
+        """
+
+        seen = {key}
+        target = self._targets.get(key, key)
+        for _ in range(self.max_depth):
+            if target not in self._targets:
+                return target
+            if target in seen:
+                return None
+            seen.add(target)
+            target = self._targets[target]
+        return None
+
+    def resolved(self) -> Iterator[Tuple[str, str]]:
+        # (key, final target) of every redirect that leads somewhere
+        self.shortened = 0
+        self.dropped = 0
+        for key, target in self._targets.items():
+            final = self.resolve(key)
+            if final is None:
+                self.dropped += 1
+                continue
+            if final != target:
+                self.shortened += 1
+            yield key, final
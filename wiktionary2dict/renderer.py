@@ -0,0 +1,171 @@
+import abc
+import re
+from html import escape
+from typing import Dict, Iterator, List, NamedTuple
+
+from wikitextparser import WikiText
+
+# Extension tags as wikitextparser knows them. The whole of an unparsable
+# tag is opaque, a parsable tag only hides its content.
+_UNPARSABLE_TAGS = (
+    'ce|charinsert|chem|graph|hiero|languages|mapframe|maplink|math|nowiki|pagelist|pagequality|pages|pre|score'
+    '|source|syntaxhighlight|templatedata|templatestyles|timeline'
+)
+_PARSABLE_TAGS = (
+    'categorytree|gallery|imagemap|includeonly|indicator|inputbox|noinclude|onlyinclude|poem|ref|references|section'
+)
+
+_COMMENT_OR_TAG = re.compile(
+    r'<(?:'
+    r'(?P<comment>!--.*?(?:-->|\Z))'
+    r'|(?P<unparsable>(?P<u>' + _UNPARSABLE_TAGS + r')\b[^>]*(?:(?<=/)>|>.*?</(?P=u)\s*>))'
+    r'|(?P<parsable>(?P<p>' + _PARSABLE_TAGS + r')\b[^>]*(?:(?<=/)>|>(?P<content>.*?)</(?P=p)\s*>))'
+    r')',
+    re.S | re.I,
+)
+
+_BRACES = re.compile(r'\{\{|\}\}')
+
+# matched at the start of a line
+_HEADING = re.compile(r'(={1,6})([^\n]+?)\1[ \t]*$', re.M)
+
+
+def _mask_comment_or_tag(m: re.Match) -> str:
+    if m.group('comment') is not None:
+        return '\0' * len(m.group())
+    if m.group('unparsable') is not None:
+        return '_' * len(m.group())
+    content = m.group('content')
+    if content is None:
+        return m.group()
+    start, end = m.start('content') - m.start(), m.end('content') - m.start()
+    return m.group()[:start] + '_' * len(content) + m.group()[end:]
+
+
+def shadow(text: str) -> str:
+    """
+    text with comments, extension tags and templates masked, character for
+    character, the way wikitextparser does before it looks for headings:
+    a '=' line inside a multi-line template or a <pre> is not a heading.
+    """
+
+    if '<' in text:
+        text = _COMMENT_OR_TAG.sub(_mask_comment_or_tag, text)
+    if '{{' in text:
+        # outermost balanced {{...}}, unbalanced braces stay as they are
+        spans = []
+        opened = []
+        for m in _BRACES.finditer(text):
+            if m.group() == '{{':
+                opened.append(m.start())
+            elif len(opened) > 0:
+                start = opened.pop()
+                if len(opened) == 0:
+                    spans.append((start, m.end()))
+        if len(spans) > 0:
+            pieces = []
+            end = 0
+            for start, stop in spans:
+                pieces.append(text[end:start])
+                pieces.append('X' * (stop - start))
+                end = stop
+            pieces.append(text[end:])
+            text = ''.join(pieces)
+    return text
+
+
+class Section(NamedTuple):
+    # level 0 and title None for the lead section,
+    # [start, end) is the section body in the page text
+    level: int
+    title: str | None
+    start: int
+    end: int
+
+
+def iter_sections(text: str) -> Iterator[Section]:
+    # every heading starts a new section, whatever its level
+    masked = shadow(text)
+    level = 0
+    title = None
+    start = 0
+    line = 0
+    while line >= 0:
+        m = _HEADING.match(masked, line)
+        if m is not None:
+            yield Section(level, title, start, m.start())
+            level = len(m.group(1))
+            title = text[m.start(2):m.end(2)]
+            start = m.end()
+        line = masked.find('\n=', line)
+        if line >= 0:
+            line += 1
+    yield Section(level, title, start, len(text))
+
+
+class Renderer(abc.ABC):
+    """
+    Turns the wikitext of a page into the record of a dictionary entry.
+
+    The page is split into sections in a single pass, subclasses implement
+    render_sections and append their HTML to out. Renderer instances are
+    the render callables of render_wiktionary, so they have to be
+    picklable for --jobs.
+    """
+
+    def __call__(self, title: str, text: str | None, redirect: str | None) -> bytes:
+        if redirect is not None:
+            # the target is a key, which is the plain title
+            return f'@@@LINK={redirect}'.encode()
+        return self.render(title, text).encode()
+
+    def render(self, title: str, text: str) -> str:
+        out = []
+        self.render_sections(out, title, text, iter_sections(text))
+        return ''.join(out)
+
+    @abc.abstractmethod
+    def render_sections(self, out: List[str], title: str, text: str, sections: Iterator[Section]):
+        pass
+
+
+class HeadingsRenderer(Renderer):
+    # the level 2 headings, and the level 3 headings inside them
+
+    def render_sections(self, out: List[str], title: str, text: str, sections: Iterator[Section]):
+        in_level2 = False
+        for section in sections:
+            if section.level == 2:
+                in_level2 = True
+                out.append(f'<h2>{escape(section.title)}</h2>')
+            elif section.level == 3:
+                if in_level2:
+                    out.append(f'<h3>{escape(section.title)}</h3>')
+            elif section.level < 2:
+                in_level2 = False
+
+
+# for example
+def gen_html(w: WikiText) -> str:
+    h = ''
+    sections2 = w.get_sections(include_subsections=True, level=2)
+    for s2 in sections2:
+        h += f'<h2>{escape(s2.title)}</h2>'
+        sections3 = s2.get_sections(include_subsections=False, level=3)
+        for s3 in sections3:
+            h += f'<h3>{escape(s3.title)}</h3>'
+    return h
+
+
+class WikiTextRenderer(Renderer):
+    # HeadingsRenderer through wikitextparser, slower, kept for comparison
+
+    def render_sections(self, out: List[str], title: str, text: str, sections: Iterator[Section]):
+        # wikitextparser finds the sections itself
+        out.append(gen_html(WikiText(text)))
+
+
+RENDERERS: Dict[str, type] = {
+    'headings': HeadingsRenderer,
+    'wikitextparser': WikiTextRenderer,
+}
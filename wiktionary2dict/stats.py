@@ -0,0 +1,132 @@
+import heapq
+import json
+import resource
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, TextIO, Tuple
+
+from tqdm import tqdm
+
+_MB = 1000 * 1000
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    # bytes, ru_maxrss is in KiB on Linux and in bytes on macOS
+    rss = resource.getrusage(who).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class BuildStats(object):
+    """
+    Progress, time per stage, slowest pages and peak RSS of one build.
+
+    With total_bytes (the size of the dump) the progress bar follows the
+    bytes of the dump consumed, as reported by dump_progress(), otherwise
+    it counts pages. Stage times are cumulative, stages timed in worker
+    processes (render with --jobs) add up the time of every worker, so they
+    can exceed the wall time of the build. The slowest pages keep the
+    slowest number of page_rendered() titles. Counts are whatever else a
+    stage reports, the redirects it resolved or the bytes it saved.
+    """
+
+    def __init__(self, total_bytes: int | None = None, slowest: int = 10, progress: bool = True):
+        self.stages: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {}
+        self.pages = 0
+        self.rendered = 0
+        self._num_slowest = slowest
+        # min-heap of (seconds, title), the fastest of the slowest on top
+        self._slowest: List[Tuple[float, str]] = []
+        self._started = time.monotonic()
+        self._by_bytes = total_bytes is not None
+        self._consumed = 0
+        self._bar = tqdm(
+            total=total_bytes,
+            unit='B' if self._by_bytes else ' pages',
+            unit_scale=self._by_bytes,
+            unit_divisor=1024,
+            disable=not progress,
+            dynamic_ncols=True,
+        )
+
+    def add_time(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def timed(self, stage: str, iterable: Iterable) -> Iterator:
+        # the time spent producing each item counts towards stage
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(stage, time.perf_counter() - start)
+                return
+            self.add_time(stage, time.perf_counter() - start)
+            yield item
+
+    def page_read(self):
+        self.pages += 1
+        if not self._by_bytes:
+            self._bar.update(1)
+        elif self.pages % 1000 == 0:
+            self._bar.set_postfix_str(f'{self.pages} pages', refresh=False)
+
+    def dump_progress(self, consumed: int):
+        if consumed > self._consumed:
+            self._bar.update(consumed - self._consumed)
+            self._consumed = consumed
+
+    def page_rendered(self, title: str, seconds: float):
+        self.rendered += 1
+        self.add_time('render', seconds)
+        if len(self._slowest) < self._num_slowest:
+            heapq.heappush(self._slowest, (seconds, title))
+        elif self._num_slowest > 0 and seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, (seconds, title))
+
+    def slowest(self) -> List[Tuple[float, str]]:
+        return sorted(self._slowest, reverse=True)
+
+    def report(self) -> Dict:
+        return {
+            'seconds': round(time.monotonic() - self._started, 3),
+            'pages': self.pages,
+            'rendered': self.rendered,
+            'dump_bytes': self._consumed,
+            'stages': {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+            'counts': dict(self.counts),
+            'slowest_pages': [{'title': title, 'seconds': round(seconds, 6)} for seconds, title in self.slowest()],
+            'peak_rss_mb': round(peak_rss() / _MB, 1),
+            # the largest of the worker processes that have exited
+            'peak_rss_children_mb': round(peak_rss(resource.RUSAGE_CHILDREN) / _MB, 1),
+        }
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=1)
+
+    def summary(self, out: TextIO = sys.stderr):
+        report = self.report()
+        print(f"{report['pages']} pages, {report['rendered']} rendered in {report['seconds']:.1f}s", file=out)
+        for stage, seconds in sorted(report['stages'].items(), key=lambda stage: -stage[1]):
+            print(f'  {stage:<12} {seconds:10.3f}s', file=out)
+        for name, n in report['counts'].items():
+            print(f'{name}: {n}', file=out)
+        if len(report['slowest_pages']) > 0:
+            print('slowest pages:', file=out)
+            for page in report['slowest_pages']:
+                print(f"  {page['seconds']:10.6f}s {page['title']}", file=out)
+        print(f"peak RSS {report['peak_rss_mb']} MB, workers {report['peak_rss_children_mb']} MB", file=out)
+
+    def close(self):
+        self._bar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, ctx_type, ctx_value, ctx_traceback):
+        self.close()
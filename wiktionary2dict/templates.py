@@ -0,0 +1,483 @@
+import os
+import pickle
+import re
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+import xxhash
+
+from .dumpreader import Page
+
+# A compiled template is a list of nodes, a node is a literal str, a Param or a Call.
+
+
+class Param(NamedTuple):
+    # {{{name|default}}}
+    name: list
+    default: list | None
+
+
+class Arg(NamedTuple):
+    # name is None for positional arguments
+    name: list | None
+    value: list
+
+
+class Call(NamedTuple):
+    # {{name|arg|key=value}}, parser functions included
+    name: list
+    args: List[Arg]
+
+
+_TOKEN = re.compile(r'<!--.*?(?:-->|\Z)|<nowiki\s*/>|<nowiki>.*?</nowiki>|\{\{\{|\{\{|\}\}\}|\}\}|\[\[|\]\]|\||=', re.S)
+# outside of {{ }} only these are not text
+_TOP_TOKEN = re.compile(r'<!--.*?(?:-->|\Z)|<nowiki\s*/>|<nowiki>.*?</nowiki>|\{\{\{|\{\{', re.S)
+
+_NOINCLUDE = re.compile(r'<noinclude\s*>.*?(?:</noinclude\s*>|\Z)', re.S)
+_INCLUDEONLY = re.compile(r'<includeonly\s*>.*?(?:</includeonly\s*>|\Z)', re.S)
+_ONLYINCLUDE = re.compile(r'<onlyinclude\s*>(.*?)(?:</onlyinclude\s*>|\Z)', re.S)
+_INCLUSION_TAG = re.compile(r'</?(?:noinclude|includeonly|onlyinclude)\s*/?>')
+
+_SPACES = re.compile(r'[ _]+')
+
+
+def template_name(title: str) -> str:
+    # 'Template:en-noun', 'template:en_noun ' and 'en-noun' are the same template
+    name = _SPACES.sub(' ', title).strip()
+    if name[:9].lower() == 'template:':
+        name = name[9:].strip()
+    return name
+
+
+def transclusion_text(text: str) -> str:
+    # what another page sees when it includes text
+    parts = _ONLYINCLUDE.findall(text)
+    if len(parts) > 0:
+        text = ''.join(parts)
+    text = _NOINCLUDE.sub('', text)
+    return _INCLUSION_TAG.sub('', text)
+
+
+def page_text(text: str) -> str:
+    # what the page itself renders
+    text = _INCLUDEONLY.sub('', text)
+    return _INCLUSION_TAG.sub('', text)
+
+
+# {{ }} and {{{ }}} around more than this many levels of them are left as
+# text, what they contain is kept
+_MAX_NESTING = 100
+
+
+def _nodes(pieces: list) -> list:
+    # adjacent strings joined, empty ones dropped, and the pieces of the
+    # lists in pieces (braces left as text) put in their place
+    nodes = []
+    literal = []
+    iterators = [iter(pieces)]
+    while len(iterators) > 0:
+        for piece in iterators[-1]:
+            if isinstance(piece, str):
+                literal.append(piece)
+            elif isinstance(piece, list):
+                iterators.append(iter(piece))
+                break
+            else:
+                if len(literal) > 0:
+                    literal = ''.join(literal)
+                    if literal != '':
+                        nodes.append(literal)
+                    literal = []
+                nodes.append(piece)
+        else:
+            iterators.pop()
+    literal = ''.join(literal)
+    if literal != '':
+        nodes.append(literal)
+    return nodes
+
+
+class _Open(object):
+    # a {{ or {{{ whose closing braces have not come yet: its parts (split
+    # at |) as strings and nodes, where the first = of each part is, the
+    # depth of the [[links]] open in the last part, which hide | = }}, and
+    # the most levels of nodes in one of its nodes
+    __slots__ = ('braces', 'parts', 'equals', 'link_depth', 'height')
+
+    def __init__(self, braces: str):
+        self.braces = braces
+        self.parts = [[]]
+        self.equals = [None]
+        self.link_depth = 0
+        self.height = 0
+
+    def text(self) -> list:
+        # what it is when it is left as text, but for the closing braces
+        pieces = [self.braces]
+        for i, part in enumerate(self.parts):
+            if i > 0:
+                pieces.append('|')
+            pieces.extend(part)
+        return pieces
+
+    def param(self) -> Param:
+        # {{{a|b|c}}}, everything after the default is ignored
+        default = _nodes(self.parts[1]) if len(self.parts) > 1 else None
+        return Param(_nodes(self.parts[0]), default)
+
+    def call(self) -> Call:
+        args = []
+        for part, equals in zip(self.parts[1:], self.equals[1:]):
+            if equals is None:
+                args.append(Arg(None, _nodes(part)))
+            else:
+                args.append(Arg(_nodes(part[:equals]), _nodes(part[equals + 1:])))
+        return Call(_nodes(self.parts[0]), args)
+
+
+def _parse(text: str) -> list:
+    # one pass over the tokens, the {{ and {{{ not closed yet are on a
+    # stack and closing braces close the innermost one. Those still open at
+    # the end of the text are text, what they contain is not parsed again.
+    # Each one is in the last part of the one below it, so the text is
+    # theirs one after the other.
+    top = []
+    stack: List[_Open] = []
+    current = None
+    pieces = top
+    pos = 0
+    while True:
+        m = (_TOKEN if current is not None else _TOP_TOKEN).search(text, pos)
+        if m is None:
+            pieces.append(text[pos:])
+            break
+        if m.start() > pos:
+            pieces.append(text[pos:m.start()])
+        token = m.group()
+        pos = m.end()
+
+        if token in ('{{', '{{{'):
+            current = _Open(token)
+            stack.append(current)
+            pieces = current.parts[-1]
+            continue
+        if current is None:
+            pass
+        elif token == '[[':
+            current.link_depth += 1
+        elif token == ']]' and current.link_depth > 0:
+            current.link_depth -= 1
+        elif current.link_depth == 0:
+            if token in ('}}', '}}}'):
+                closed = stack.pop()
+                current = stack[-1] if len(stack) > 0 else None
+                pieces = current.parts[-1] if current is not None else top
+                is_param = closed.braces == '{{{' and token == '}}}'
+                if closed.braces == '{{{' and not is_param:
+                    # {{{a}} is { and {{a}}
+                    pieces.append('{')
+                    closed.braces = '{{'
+                elif token == '}}}' and not is_param:
+                    # {{a|{{b}}}} closes b first
+                    pos -= 1
+                height = closed.height + 1
+                if height > _MAX_NESTING:
+                    height = closed.height
+                    pieces.append(closed.text() + ['}}}' if is_param else '}}'])
+                else:
+                    pieces.append(closed.param() if is_param else closed.call())
+                if current is not None:
+                    current.height = max(current.height, height)
+                continue
+            if token == '|':
+                pieces = []
+                current.parts.append(pieces)
+                current.equals.append(None)
+                continue
+            if token == '=' and len(current.parts) > 1 and current.equals[-1] is None:
+                current.equals[-1] = len(pieces)
+
+        if not token.startswith('<!--'):
+            pieces.append(token)
+
+    for unclosed in stack:
+        top.append(unclosed.text())
+    return _nodes(top)
+
+
+def compile_wikitext(text: str) -> list:
+    if '{{' not in text:
+        return [text] if text != '' else []
+    return _parse(text)
+
+
+class _Frame(object):
+    __slots__ = ('title', 'depth', '_args', '_expanded')
+
+    def __init__(self, title: str, depth: int, args: Dict[str, Tuple[list, '_Frame', bool]]):
+        self.title = title
+        self.depth = depth
+        self._args = args
+        self._expanded = {}
+
+    def has(self, name: str) -> bool:
+        return name in self._args
+
+    def arg(self, store: 'TemplateStore', name: str) -> str:
+        # arguments are expanded lazily, in the frame of the caller
+        if name not in self._expanded:
+            nodes, frame, strip = self._args[name]
+            value = store._expand_str(nodes, frame)
+            self._expanded[name] = value.strip() if strip else value
+        return self._expanded[name]
+
+
+def _to_number(s: str) -> float | None:
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+class TemplateStore(object):
+    """
+    Templates (ns 10 pages, redirects included) of a dump, compiled to
+    Param/Call node lists and kept in a sqlite file at path.
+
+    A bounded LRU of max_parsed compiled templates is held in memory, the
+    rest is unpickled from the file on demand, so any number of processes
+    can expand with the same store. Expansion supports template arguments,
+    <noinclude>/<includeonly>/<onlyinclude>, and the #if, #ifeq, #switch,
+    #ifexist, lc, uc, lcfirst, ucfirst and PAGENAME parser functions;
+    Scribunto (#invoke) and other functions expand to nothing.
+    Inclusions deeper than max_depth are cut off, and so are nodes nested
+    deeper than max_nesting, counting those of every template they are
+    included from, which keeps expansion (recursive) within the Python
+    recursion limit. depth_exceeded counts both.
+
+    stats maps template names to [calls, seconds], seconds including the
+    templates they call in turn.
+    """
+
+    def __init__(self, path: str, max_parsed: int = 4096, max_depth: int = 40, max_nesting: int = 120):
+        self._path = path
+        self._db = sqlite3.connect(path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS templates (name TEXT PRIMARY KEY, redirect TEXT, compiled BLOB)')
+        self._parsed = OrderedDict()
+        self._max_parsed = max_parsed
+        self._max_depth = max_depth
+        self._max_nesting = max_nesting
+        self._nesting = 0
+        self.stats: Dict[str, List] = {}
+        self.depth_exceeded = 0
+
+    def add(self, title: str, text: str | None, redirect: str | None):
+        name = template_name(title)
+        if redirect is not None:
+            row = (name, template_name(redirect), None)
+        else:
+            row = (name, None, pickle.dumps(compile_wikitext(transclusion_text(text or '')), pickle.HIGHEST_PROTOCOL))
+        self._db.execute('INSERT OR REPLACE INTO templates VALUES (?, ?, ?)', row)
+
+    def commit(self):
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def digest(self) -> str:
+        # changes whenever any template changes, for invalidating caches of rendered pages
+        h = xxhash.xxh3_64()
+        rows = self._db.execute('SELECT name, redirect, compiled FROM templates ORDER BY name')
+        for name, redirect, compiled in rows:
+            h.update(name.encode())
+            h.update(b'\0')
+            h.update((redirect or '').encode())
+            h.update(b'\0')
+            h.update(compiled or b'')
+        return h.hexdigest()
+
+    def get(self, name: str) -> list | None:
+        if name in self._parsed:
+            self._parsed.move_to_end(name)
+            return self._parsed[name]
+
+        nodes = None
+        target = name
+        for _ in range(8):
+            row = self._db.execute('SELECT redirect, compiled FROM templates WHERE name = ?', (target,)).fetchone()
+            if row is None:
+                break
+            if row[0] is None:
+                nodes = pickle.loads(row[1])
+                break
+            target = row[0]
+
+        self._parsed[name] = nodes
+        if len(self._parsed) > self._max_parsed:
+            self._parsed.popitem(last=False)
+        return nodes
+
+    def pop_stats(self) -> Dict[str, List]:
+        stats = self.stats
+        self.stats = {}
+        return stats
+
+    def expand(self, text: str, title: str) -> str:
+        if '{{' not in text:
+            return text
+        return self._expand_str(compile_wikitext(page_text(text)), _Frame(title, 0, {}))
+
+    def _expand_str(self, nodes: list, frame: _Frame) -> str:
+        out = []
+        self._expand(nodes, frame, out)
+        return ''.join(out)
+
+    def _expand(self, nodes: list, frame: _Frame, out: List[str]):
+        # every recursion of the expansion goes through here, a few Python
+        # frames per level
+        if self._nesting >= self._max_nesting:
+            self.depth_exceeded += 1
+            return
+        self._nesting += 1
+        try:
+            for node in nodes:
+                if isinstance(node, str):
+                    out.append(node)
+                elif isinstance(node, Param):
+                    name = self._expand_str(node.name, frame).strip()
+                    if frame.has(name):
+                        out.append(frame.arg(self, name))
+                    elif node.default is not None:
+                        self._expand(node.default, frame, out)
+                    else:
+                        out.append(f'{{{{{{{name}}}}}}}')
+                else:
+                    out.append(self._call(node, frame))
+        finally:
+            self._nesting -= 1
+
+    def _arg_text(self, arg: Arg, frame: _Frame) -> str:
+        if arg.name is None:
+            return self._expand_str(arg.value, frame)
+        return self._expand_str(arg.name, frame) + '=' + self._expand_str(arg.value, frame)
+
+    def _call(self, call: Call, frame: _Frame) -> str:
+        name = self._expand_str(call.name, frame).strip()
+
+        function, colon, first = name.partition(':')
+        if colon != '' and function.strip().lower() in _FUNCTIONS:
+            return _FUNCTIONS[function.strip().lower()](self, first.strip(), call.args, frame)
+        if name in _VARIABLES:
+            return _VARIABLES[name](frame)
+        if name.startswith('#'):
+            return ''
+
+        name = template_name(name)
+        nodes = self.get(name)
+        if nodes is None:
+            return ''
+        if frame.depth >= self._max_depth:
+            self.depth_exceeded += 1
+            return ''
+
+        args = {}
+        position = 1
+        for arg in call.args:
+            if arg.name is None:
+                args[str(position)] = (arg.value, frame, False)
+                position += 1
+            else:
+                args[self._expand_str(arg.name, frame).strip()] = (arg.value, frame, True)
+
+        start = time.perf_counter()
+        result = self._expand_str(nodes, _Frame(frame.title, frame.depth + 1, args))
+        stat = self.stats.setdefault(name, [0, 0.0])
+        stat[0] += 1
+        stat[1] += time.perf_counter() - start
+        return result
+
+
+def _if(store: TemplateStore, test: str, args: List[Arg], frame: _Frame) -> str:
+    index = 0 if test != '' else 1
+    if index >= len(args):
+        return ''
+    return store._arg_text(args[index], frame).strip()
+
+
+def _ifeq(store: TemplateStore, left: str, args: List[Arg], frame: _Frame) -> str:
+    if len(args) == 0:
+        return ''
+    right = store._arg_text(args[0], frame).strip()
+    left_number, right_number = _to_number(left), _to_number(right)
+    if left_number is not None and right_number is not None:
+        equal = left_number == right_number
+    else:
+        equal = left == right
+    index = 1 if equal else 2
+    if index >= len(args):
+        return ''
+    return store._arg_text(args[index], frame).strip()
+
+
+def _switch(store: TemplateStore, value: str, args: List[Arg], frame: _Frame) -> str:
+    matched = False
+    default = None
+    for i, arg in enumerate(args):
+        if arg.name is None:
+            case = store._expand_str(arg.value, frame).strip()
+            if i == len(args) - 1:
+                # a last case without a result is the default
+                return case
+            if case == value:
+                # fall through to the next case with a result
+                matched = True
+            continue
+        case = store._expand_str(arg.name, frame).strip()
+        if matched or case == value:
+            return store._expand_str(arg.value, frame).strip()
+        if case == '#default':
+            default = arg.value
+    if default is not None:
+        return store._expand_str(default, frame).strip()
+    return ''
+
+
+def _ifexist(store: TemplateStore, title: str, args: List[Arg], frame: _Frame) -> str:
+    exists = title[:9].lower() == 'template:' and store.get(template_name(title)) is not None
+    index = 0 if exists else 1
+    if index >= len(args):
+        return ''
+    return store._arg_text(args[index], frame).strip()
+
+
+_FUNCTIONS = {
+    '#if': _if,
+    '#ifeq': _ifeq,
+    '#switch': _switch,
+    '#ifexist': _ifexist,
+    'lc': lambda store, s, args, frame: s.lower(),
+    'uc': lambda store, s, args, frame: s.upper(),
+    'lcfirst': lambda store, s, args, frame: s[:1].lower() + s[1:],
+    'ucfirst': lambda store, s, args, frame: s[:1].upper() + s[1:],
+}
+
+_VARIABLES = {
+    '!': lambda frame: '|',
+    'PAGENAME': lambda frame: frame.title,
+    'FULLPAGENAME': lambda frame: frame.title,
+}
+
+
+def build_template_store(path: str, pages: Iterable[Page]) -> TemplateStore:
+    # only the ns 10 pages are kept
+    if os.path.exists(path):
+        os.remove(path)
+    store = TemplateStore(path)
+    for ns, title, text, redirect in pages:
+        if ns == '10':
+            store.add(title, text, redirect)
+    store.commit()
+    return store
@@ -0,0 +1,212 @@
+"""
+LZO1X, MDict compression type 1.
+
+Blocks are raw LZO1X streams, without the 5 byte header python-lzo puts in
+front of them. python-lzo (the C library) is used when it is installed,
+otherwise the pure Python _compress() and _decompress() below, which are
+far slower (a few MB/s) and only meant to keep type 1 readable and
+writable everywhere. The fallback compressor is a greedy LZO1X-1 with a single hash
+table entry per 4 byte sequence, its output is valid LZO1X that any
+decompressor reads, it just does not match the C library byte for byte.
+"""
+
+import struct
+
+try:
+    import lzo as _lzo
+except ImportError:
+    _lzo = None
+
+# the longest distance of each match kind, M1 (2 byte matches) are not used
+_M2_MAX_OFFSET = 0x0800
+_M3_MAX_OFFSET = 0x4000
+_M4_MAX_OFFSET = 0xbfff
+_M2_MAX_LEN = 8
+_MIN_MATCH = 4
+_END = b'\x11\x00\x00'
+
+
+def _length(out: bytearray, length: int):
+    # length beyond what fits in the instruction byte, as in lzo1x
+    while length > 255:
+        out.append(0)
+        length -= 255
+    out.append(length)
+
+
+def _literals(out: bytearray, data: bytes, start: int, end: int, state: int):
+    # state is the position in out of the low byte of the last match,
+    # whose 2 low bits carry a run of 1 to 3 literals, -1 before any match
+    n = end - start
+    if n == 0:
+        return
+    if state < 0 and n <= 238:
+        out.append(17 + n)
+    elif state >= 0 and n <= 3:
+        out[state] |= n
+    elif n <= 18:
+        out.append(n - 3)
+    else:
+        out.append(0)
+        _length(out, n - 18)
+    out += data[start:end]
+
+
+def _match(out: bytearray, length: int, distance: int) -> int:
+    # returns the position of the byte holding the literal bits
+    if length <= _M2_MAX_LEN and distance <= _M2_MAX_OFFSET:
+        distance -= 1
+        out.append(((length - 1) << 5) | ((distance & 7) << 2))
+        out.append(distance >> 3)
+        return len(out) - 2
+    if distance <= _M3_MAX_OFFSET:
+        distance -= 1
+        if length - 2 <= 31:
+            out.append(32 | (length - 2))
+        else:
+            out.append(32)
+            _length(out, length - 2 - 31)
+    else:
+        distance -= 0x4000
+        if length - 2 <= 7:
+            out.append(16 | ((distance & 0x4000) >> 11) | (length - 2))
+        else:
+            out.append(16 | ((distance & 0x4000) >> 11))
+            _length(out, length - 2 - 7)
+        distance &= 0x3fff
+    out += struct.pack('<H', distance << 2)
+    return len(out) - 2
+
+
+def _compress(data: bytes) -> bytes:
+    out = bytearray()
+    table = {}
+    n = len(data)
+    state = -1
+    literal = 0
+    i = 0
+    while i + _MIN_MATCH <= n:
+        key = data[i:i + _MIN_MATCH]
+        candidate = table.get(key)
+        table[key] = i
+        if candidate is None or i - candidate > _M4_MAX_OFFSET:
+            i += 1
+            continue
+        length = _MIN_MATCH
+        while i + length < n and data[candidate + length] == data[i + length]:
+            length += 1
+        _literals(out, data, literal, i, state)
+        state = _match(out, length, i - candidate)
+        i += length
+        literal = i
+    _literals(out, data, literal, n, state)
+    out += _END
+    return bytes(out)
+
+
+def _decompress(data: bytes) -> bytes:
+    out = bytearray()
+    ip = 0
+
+    def copy_match(distance: int, length: int):
+        start = len(out) - distance
+        if start < 0:
+            raise ValueError('corrupt LZO data')
+        if distance >= length:
+            out.extend(out[start:start + length])
+        else:
+            for k in range(length):
+                out.append(out[start + k])
+
+    def extended(t: int, bits: int) -> int:
+        nonlocal ip
+        if t == 0:
+            t = bits
+            while data[ip] == 0:
+                t += 255
+                ip += 1
+            t += data[ip]
+            ip += 1
+        return t
+
+    try:
+        t = data[0]
+        if t > 17:
+            # a first run of literals
+            ip = 1
+            t -= 17
+            out += data[ip:ip + t]
+            ip += t
+            after_literals = t >= 4
+            t = data[ip]
+            ip += 1
+        else:
+            after_literals = None
+            t = -1
+
+        while True:
+            if t < 0:
+                t = data[ip]
+                ip += 1
+                if t < 16:
+                    n = extended(t, 15) + 3
+                    out += data[ip:ip + n]
+                    ip += n
+                    t = data[ip]
+                    ip += 1
+                    after_literals = True
+                else:
+                    after_literals = None
+
+            if t >= 64:
+                distance = 1 + ((t >> 2) & 7) + (data[ip] << 3)
+                ip += 1
+                copy_match(distance, (t >> 5) + 1)
+            elif t >= 32:
+                n = extended(t & 31, 31) + 2
+                distance = 1 + (struct.unpack_from('<H', data, ip)[0] >> 2)
+                ip += 2
+                copy_match(distance, n)
+            elif t >= 16:
+                n = extended(t & 7, 7) + 2
+                offset = struct.unpack_from('<H', data, ip)[0] >> 2
+                ip += 2
+                distance = ((t & 8) << 11) + offset
+                if distance == 0:
+                    break
+                copy_match(distance + 0x4000, n)
+            elif after_literals:
+                # a 3 byte match right after a run of 4 or more literals
+                distance = 1 + 0x0800 + (t >> 2) + (data[ip] << 2)
+                ip += 1
+                copy_match(distance, 3)
+            else:
+                distance = 1 + (t >> 2) + (data[ip] << 2)
+                ip += 1
+                copy_match(distance, 2)
+
+            n = data[ip - 2] & 3
+            if n == 0:
+                t = -1
+                continue
+            out += data[ip:ip + n]
+            ip += n
+            after_literals = False
+            t = data[ip]
+            ip += 1
+    except IndexError:
+        raise ValueError('truncated LZO data')
+    return bytes(out)
+
+
+def compress(data: bytes) -> bytes:
+    if _lzo is not None:
+        return _lzo.compress(data, 1)[5:]
+    return _compress(data)
+
+
+def decompress(data: bytes, size: int) -> bytes:
+    # size of the decompressed data, python-lzo needs it up front
+    if _lzo is not None:
+        return _lzo.decompress(b'\xf0' + struct.pack('>I', size) + data)
+    return _decompress(data)
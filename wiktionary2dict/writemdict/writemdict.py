@@ -1,44 +1,217 @@
 from __future__ import unicode_literals
 import datetime
+import os
+import shutil
 from io import BufferedWriter
 
 import struct
 import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from html import escape
 
+import xxhash
+
+from . import lzo
+
+# MDict compression types
+COMPRESSION_TYPES = {'none': 0, 'lzo': 1, 'zlib': 2}
+ZLIB_STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'huffman_only': zlib.Z_HUFFMAN_ONLY,
+    'rle': zlib.Z_RLE,
+    'fixed': zlib.Z_FIXED,
+}
+
+
+def _match_window(compression_type, level, strategy):
+    # how far back the compression of a record block finds repeated bytes,
+    # LZO's M4 matches and zlib's window
+    if compression_type == 1:
+        return 0xbfff
+    if compression_type == 2 and level != 0 and strategy not in (zlib.Z_HUFFMAN_ONLY, zlib.Z_RLE):
+        return 32768
+    return 0
+# the start of a record that links to the one of another key
+LINK = b"@@@LINK="
+
 
 class ParameterError(Exception):
     # Raised when some parameter to MdxWriter is invalid or uninterpretable.
     pass
 
 
-class ZlibWriter(object):
+class BlockWriter(object):
+    # Buffers uncompressed data and writes it out as independent blocks,
+    # each one prefixed with its own compression type and adler32 checksum.
+    # write_chunks() streams data too large to buffer, the block it ends up
+    # in is compressed as it goes and its header patched when it is flushed,
+    # which needs a seekable output. With an executor, blocks are compressed
+    # by its threads (zlib and python-lzo release the GIL), at most
+    # max_pending of them at a time, and written in order.
 
-    def __init__(self, output):
+    def __init__(self, output, compression_type=2, level=-1, strategy=zlib.Z_DEFAULT_STRATEGY,
+                 executor=None, max_pending=0):
         self._output = output
+        self._compression_type = compression_type
+        self._level = level
+        self._strategy = strategy
+        self._executor = executor
+        self._max_pending = max_pending
+        # (future of the compressed block, uncompressed size)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._blocks = []
         self._size = 0
         self._size_compressed = 0
-        self._compressor = zlib.compressobj()
+        # set while a block is being streamed
+        self._compressor = None
+        self._stream_type = compression_type
+        self._stream_start = 0
+        self._stream_size = 0
+        self._stream_adler = 1
+
+    def __len__(self):
+        return len(self._buffer) if self._compressor is None else self._stream_size
 
     def write(self, data):
-        self._size += len(data)
-        compressed = self._compressor.compress(data)
-        self._output.write(compressed)
-        self._size_compressed += len(compressed)
+        if self._compressor is not None:
+            self._stream(data)
+        else:
+            self._buffer += data
+
+    def write_chunks(self, chunks, buffer_limit):
+        # from the chunk that takes the block past buffer_limit bytes on,
+        # the block is streamed
+        for chunk in chunks:
+            if self._compressor is None and len(self._buffer) + len(chunk) > buffer_limit:
+                self._start_stream()
+            self.write(chunk)
+
+    def _start_stream(self):
+        self._drain(0)
+        # LZO does not stream, the compression type is per block so a
+        # streamed block is zlib in a dictionary of LZO blocks
+        self._stream_type = 0 if self._compression_type == 0 else 2
+        self._stream_start = self._output.tell()
+        self._output.write(bytes(8))
+        self._compressor = False if self._stream_type == 0 else zlib.compressobj(
+            self._level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, self._strategy)
+        self._stream_size = 0
+        self._stream_adler = 1
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        self._stream(data)
+
+    def _stream(self, data):
+        self._stream_size += len(data)
+        self._stream_adler = zlib.adler32(data, self._stream_adler)
+        self._output.write(self._compressor.compress(data) if self._compressor else data)
+
+    def _finish_stream(self):
+        if self._compressor:
+            self._output.write(self._compressor.flush())
+        end = self._output.tell()
+        self._output.seek(self._stream_start)
+        self._output.write(struct.pack(b"<L", self._stream_type) +
+                           struct.pack(b">L", self._stream_adler & 0xffffffff))
+        self._output.seek(end)
+        self._compressor = None
+        return end - self._stream_start, self._stream_size
+
+    def flush_block(self):
+        if self._compressor is not None:
+            self._add_block(*self._finish_stream())
+        elif len(self._buffer) == 0:
+            return
+        else:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            if self._executor is None:
+                block = _mdx_compress(data, self._compression_type, self._level, self._strategy)
+                self._output.write(block)
+                self._add_block(len(block), len(data))
+            else:
+                self._pending.append((self._executor.submit(
+                    _mdx_compress, data, self._compression_type, self._level, self._strategy), len(data)))
+                self._drain(self._max_pending)
+
+    def _drain(self, max_pending):
+        # writes the compressed blocks until max_pending are left
+        while len(self._pending) > max_pending:
+            future, size = self._pending.popleft()
+            block = future.result()
+            self._output.write(block)
+            self._add_block(len(block), size)
+
+    def _add_block(self, size_compressed, size):
+        self._blocks.append((size_compressed, size))
+        self._size += size
+        self._size_compressed += size_compressed
 
     def finish(self):
-        compressed = self._compressor.flush()
-        self._output.write(compressed)
-        self._size_compressed += len(compressed)
-
-
-def _mdx_compress(data, compression_type=2):
+        self.flush_block()
+        self._drain(0)
+
+
+def _copy_file(src, dst):
+    # Appends the whole of src at the position of dst. os.copy_file_range
+    # copies inside the kernel (or shares the extents on filesystems with
+    # reflinks), shutil.copyfileobj is the fallback where it isn't available.
+    src.flush()
+    dst.flush()
+    size = os.fstat(src.fileno()).st_size
+    position = dst.tell()
+    try:
+        copied = 0
+        while copied < size:
+            n = os.copy_file_range(src.fileno(), dst.fileno(), size - copied, copied, position + copied)
+            if n == 0:
+                raise OSError("short copy")
+            copied += n
+    except (AttributeError, OSError):
+        src.seek(0)
+        dst.seek(position)
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    dst.seek(position + size)
+
+
+class FileRecord(object):
+    """
+    The content of a file as a record, read in chunks of chunk_size bytes
+    when it is written, so that it never has to be in memory as a whole.
+    """
+
+    def __init__(self, path, size=None, chunk_size=1024 * 1024):
+        self.path = path
+        self.size = os.path.getsize(path) if size is None else size
+        self.chunk_size = chunk_size
+
+    def __len__(self):
+        return self.size
+
+    def chunks(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(self.chunk_size)
+                if len(chunk) == 0:
+                    return
+                yield chunk
+
+
+def _mdx_compress(data, compression_type=2, level=-1, strategy=zlib.Z_DEFAULT_STRATEGY):
     header = (struct.pack(b"<L", compression_type) +
               struct.pack(b">L", zlib.adler32(data) & 0xffffffff))  # depending on python version, zlib.adler32 may return a signed number.
     if compression_type == 0:  # no compression
         return header + data
+    elif compression_type == 1:
+        return header + lzo.compress(data)
     elif compression_type == 2:
-        return header + zlib.compress(data)
+        if strategy == zlib.Z_DEFAULT_STRATEGY:
+            return header + zlib.compress(data, level)
+        compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, strategy)
+        return header + compressor.compress(data) + compressor.flush()
     else:
         raise ParameterError("Unknown compression type")
 
@@ -46,21 +219,40 @@ def _mdx_compress(data, compression_type=2):
 class MDictWriter(object):
 
     def __init__(self, title, description,
-                 output_key_block_body_body,
-                 output_record_block_body_body,
+                 output_key_blocks,
                  day=datetime.date.today(),
                  is_mdd=False,
+                 block_size=65536,
+                 dedup=False,
+                 dedup_max_records=1 << 20,
+                 strip_key=True,
+                 compression_type=2,
+                 compression_level=-1,
+                 compression_strategy=zlib.Z_DEFAULT_STRATEGY,
+                 compress_threads=1,
                  ):
         """
-        Prepares the records. A subsequent call to write() writes 
-        the mdx or mdd file.
-
-        d is a dictionary. The keys should be (unicode) strings. If used for an mdx
-          file (the parameter is_mdd is False), then the values should also be 
-          (unicode) strings, containing HTML snippets. If used to write an mdd
-          file (the parameter is_mdd is True), then the values should be binary 
-          strings (bytes objects), containing the raw data for the corresponding 
-          file object.
+        Writes an mdx or mdd file in two passes over the sorted entries.
+        add() takes the entries and builds the key blocks, only the length
+        of the records matters there. commit() finishes the key section,
+        then write() writes the whole file, compressing the records, which
+        must be the values of the added entries in the same order, straight
+        into it.
+
+        The entries passed to add() form a dictionary. The keys should be
+          (unicode) strings, or bytes already encoded in the dictionary
+          encoding. If used for an mdx file (the parameter is_mdd is False),
+          then the values should also be (unicode) strings or encoded bytes,
+          containing HTML snippets. If used to write an mdd file (the
+          parameter is_mdd is True), then the values should be binary
+          strings (bytes objects), containing the raw data for the
+          corresponding file object.
+
+        output_key_blocks is a binary file opened for reading and writing
+          that holds the compressed key blocks until write() copies them
+          after the key index, they are a small part of the file.
+
+        Records can be FileRecords, which are streamed from their files.
 
         title is a (unicode) string, with the title of the dictionary
           description is a (unicode) string, with a short description of the
@@ -69,6 +261,36 @@ class MDictWriter(object):
         is_mdd is a boolean specifying whether the file written will be an mdx file
           or an mdd file. By default this is False, meaning that an mdd file will
           be written.
+
+        block_size is the approximate number of bytes (before compression) in
+          each key block and record block. A block is cut after the entry that
+          makes it reach block_size, so entries never span two blocks.
+
+        dedup replaces a record identical to the one of an earlier key by a
+          @@@LINK= record to that key, which clients follow as they do the
+          links of redirects. Records that are links already, or not longer
+          than the link, are kept, and so are those the compression of the
+          record block mostly finds anyway: records not over six times the
+          length of the link whose earlier copy is in the same block,
+          within the window of LZO or zlib, compress about as small as the
+          link would (on the sample dumps). The digests of the first
+          dedup_max_records distinct records are remembered, records first
+          seen after that are not deduplicated, so the memory used stays
+          bounded. shared_records and shared_uncompressed_bytes count the
+          records replaced and the bytes that saved before compression.
+          Only .mdx records can be deduplicated.
+
+        strip_key says in the header of an mdx whether its keys are sorted and
+          compared with punctuation and spaces stripped (StripKey="Yes"), as
+          collation.sort_key sorts them, or not. Keys of an mdd never are.
+
+        compression_type is that of the record blocks, 0 (none), 1 (LZO, see
+          lzo) or 2 (zlib), compression_level (0-9, -1 for zlib's default)
+          and compression_strategy (one of ZLIB_STRATEGIES) tune zlib. The
+          key blocks and the key index are always zlib at the default level,
+          MDict requires the index to be. With compress_threads > 1 the
+          record blocks are compressed by that many threads, the output is
+          the same.
         """
 
         self._title = title
@@ -76,16 +298,42 @@ class MDictWriter(object):
         self._day = day
         self._is_mdd = is_mdd
         self._compression_type = 2
-
-        self._key_block_body_body_output = ZlibWriter(output_key_block_body_body)
-        self._key_block_body_body_checksum = 1
-        self._record_block_body_body_output = ZlibWriter(output_record_block_body_body)
-        self._record_block_body_body_checksum = 1
+        self._block_size = block_size
+        if compression_type not in COMPRESSION_TYPES.values():
+            raise ParameterError("Unknown compression type")
+        if not -1 <= compression_level <= 9:
+            raise ParameterError("Invalid compression level")
+        if dedup and is_mdd:
+            raise ParameterError("Records of an mdd can not be deduplicated")
+        self._record_compression = (compression_type, compression_level, compression_strategy)
+        self._match_window = _match_window(*self._record_compression)
+        self._compress_threads = compress_threads
+
+        self._key_blocks_output = BlockWriter(output_key_blocks, self._compression_type)
+        # the record blocks are only compressed by write(), their
+        # uncompressed sizes are known from the start
+        self._record_blocks_output = None
+        self._record_block_sizes = []
+        self._record_block_size = 0
+
+        # one (num_entries, first_key_len, first_key, last_key_len, last_key)
+        # tuple per finished key block, the sizes come from _key_blocks_output.
+        self._key_block_info = []
+        self._key_block_num_entries = 0
 
         self._num_entries = 0
         self._total_record_len = 0
 
-        self._first_key = None
+        self._strip_key = strip_key and not is_mdd
+        self._dedup = dedup
+        self._dedup_max_records = dedup_max_records
+        # digest -> (encoded key, record block, offset) of the first entry
+        # with that record, and one flag per entry, 1 for those whose
+        # record is a link to it
+        self._record_keys = {}
+        self._shared = bytearray()
+        self.shared_records = 0
+        self.shared_uncompressed_bytes = 0
 
         # encoding is set to the string used in the mdx header.
         # python_encoding is passed on to the python .encode()
@@ -98,44 +346,112 @@ class MDictWriter(object):
             self._encoding_length = 1
         else:
             self._python_encoding = "utf_16_le"
+            self._encoding = "UTF-16"
             self._encoding_length = 2
 
+    def __len__(self):
+        return self._num_entries
+
     def commit(self):
-        self._key_block_body_body_output.finish()
-        self._record_block_body_body_output.finish()
+        self._flush_key_block()
+        if self._record_block_size > 0:
+            self._record_block_sizes.append(self._record_block_size)
+            self._record_block_size = 0
+
+    def _flush_key_block(self):
+        if self._key_block_num_entries == 0:
+            return
+        self._key_blocks_output.flush_block()
+        self._key_block_info.append((
+            self._key_block_num_entries,
+            self._block_first_key_len,
+            self._block_first_key,
+            self._last_key_len,
+            self._last_key,
+        ))
+        self._key_block_num_entries = 0
 
     def add(self, d):
         self._num_entries += len(d)
         items = list(d.items())
         for key, record in items:
-            key_enc = key.encode(self._python_encoding)
-            key_null = (key+"\0").encode(self._python_encoding)
+            key_enc = key if isinstance(key, bytes) else key.encode(self._python_encoding)
+            key_null = key_enc + "\0".encode(self._python_encoding)
             key_len = len(key_enc) // self._encoding_length
 
-            if self._first_key is None:
-                self._first_key = key_null
-                self._first_key_len = key_len
-
             self._last_key = key_null
             self._last_key_len = key_len
 
-            # set record_null to a the the value of the record. If it's
-            # an MDX file, append an extra null character.
-            if self._is_mdd:
-                record_null = record
-            else:
-                record_null = (record+"\0").encode(self._python_encoding)
-
-            key_block_body_body = struct.pack(b">Q", self._total_record_len)+key_null
-            self._key_block_body_body_checksum = zlib.adler32(key_block_body_body, self._key_block_body_body_checksum)
-            self._key_block_body_body_output.write(key_block_body_body)
-
-            record_block_body_body = record_null
-            self._record_block_body_body_checksum = zlib.adler32(
-                record_block_body_body, self._record_block_body_body_checksum)
-            self._record_block_body_body_output.write(record_block_body_body)
-
-            self._total_record_len += len(record_null)
+            if self._key_block_num_entries == 0:
+                self._block_first_key = key_null
+                self._block_first_key_len = key_len
+
+            record_null = self._record_null(record)
+            if self._dedup:
+                link = self._link(key_enc, record_null)
+                self._shared.append(link is not None)
+                if link is not None:
+                    self.shared_records += 1
+                    self.shared_uncompressed_bytes += len(record_null) - len(link)
+                    record_null = link
+
+            self._key_blocks_output.write(struct.pack(b">Q", self._total_record_len)+key_null)
+            self._key_block_num_entries += 1
+            if len(self._key_blocks_output) >= self._block_size:
+                self._flush_key_block()
+
+            # the same cuts write_5_record_blocks makes
+            record_len = len(record_null)
+            self._record_block_size += record_len
+            if self._record_block_size >= self._block_size:
+                self._record_block_sizes.append(self._record_block_size)
+                self._record_block_size = 0
+
+            self._total_record_len += record_len
+
+    def _link(self, key_enc, record_null):
+        # the link record that replaces record_null, None to keep it
+        if record_null.startswith(LINK):
+            return None
+        digest = xxhash.xxh3_128_digest(record_null)
+        block = len(self._record_block_sizes)
+        first = self._record_keys.get(digest)
+        if first is None:
+            if len(self._record_keys) < self._dedup_max_records:
+                self._record_keys[digest] = (key_enc, block, self._total_record_len)
+            return None
+        first_key, first_block, first_offset = first
+        link = LINK + first_key + b"\0"
+        if first_block == block and self._total_record_len - first_offset <= self._match_window:
+            # the compression finds the earlier record, its matches take
+            # about as much as a link (mostly its key, as literals) unless
+            # the record is several times longer
+            return link if len(record_null) > 6 * len(link) else None
+        return link if len(link) < len(record_null) else None
+
+    def _record_null(self, record):
+        # set record_null to a the the value of the record. If it's
+        # an MDX file, append an extra null character.
+        if self._is_mdd:
+            return record
+        elif isinstance(record, bytes):
+            return record + "\0".encode(self._python_encoding)
+        else:
+            return (record+"\0").encode(self._python_encoding)
+
+    def write(self, f, records):
+        # f is seekable, the record preamble and index are reserved before
+        # the record blocks and filled in once their sizes are known
+        self.write_1_header(f)
+        self.write_2_key_preamble_and_index(f)
+        self.write_3_key_blocks(f)
+        record_index_offset = f.tell()
+        f.write(bytes(32 + 16 * len(self._record_block_sizes)))
+        self.write_5_record_blocks(f, records)
+        end = f.tell()
+        f.seek(record_index_offset)
+        self.write_4_record_preamble_and_index(f)
+        f.seek(end)
 
     def write_1_header(self, f):
         encrypted = 0
@@ -154,6 +470,7 @@ class MDictWriter(object):
                 """Compact="No" """
                 """Compat="No" """
                 """KeyCaseSensitive="No" """
+                """StripKey="{strip_key}" """
                 """Description="{description}" """
                 """Title="{title}" """
                 """DataSourceFormat="106" """
@@ -166,6 +483,7 @@ class MDictWriter(object):
                 date=self._day,
                 description=escape(self._description, quote=True),
                 title=escape(self._title, quote=True),
+                strip_key="Yes" if self._strip_key else "No",
                 register_by_str=register_by_str,
                 regcode=regcode
             ).encode("utf_16_le")
@@ -180,6 +498,7 @@ class MDictWriter(object):
                 """Compact="No" """
                 """Compat="No" """
                 """KeyCaseSensitive="No" """
+                """StripKey="No" """
                 """Description="{description}" """
                 """Title="{title}" """
                 """DataSourceFormat="106" """
@@ -198,31 +517,30 @@ class MDictWriter(object):
         f.write(header_string)
         f.write(struct.pack(b"<L", zlib.adler32(header_string) & 0xffffffff))
 
-    def write_2_key_preamble_and_index_and_block_body_header(self, f: BufferedWriter):
-
-        key_block_body_header = (struct.pack(b"<L", self._compression_type) +
-                                 struct.pack(b">L", self._key_block_body_body_checksum & 0xffffffff))
+    def write_2_key_preamble_and_index(self, f: BufferedWriter):
 
         long_format = b">Q"
         short_format = b">H"
-        key_index_decomp = (
-            struct.pack(long_format, self._num_entries)
-            + struct.pack(short_format, self._first_key_len)
-            + self._first_key
-            + struct.pack(short_format, self._last_key_len)
-            + self._last_key
-            + struct.pack(long_format, len(key_block_body_header)+self._key_block_body_body_output._size_compressed)
-            + struct.pack(long_format, self._key_block_body_body_output._size)
+        key_index_decomp = b"".join(
+            struct.pack(long_format, num_entries)
+            + struct.pack(short_format, first_key_len)
+            + first_key
+            + struct.pack(short_format, last_key_len)
+            + last_key
+            + struct.pack(long_format, size_compressed)
+            + struct.pack(long_format, size)
+            for (num_entries, first_key_len, first_key, last_key_len, last_key), (size_compressed, size)
+            in zip(self._key_block_info, self._key_blocks_output._blocks)
         )
 
         key_index_comp = _mdx_compress(key_index_decomp)
 
         preamble = struct.pack(b">QQQQQ",
-                               1,  # len(self._key_blocks),
+                               len(self._key_block_info),
                                self._num_entries,
                                len(key_index_decomp),
                                len(key_index_comp),
-                               len(key_block_body_header)+self._key_block_body_body_output._size_compressed)
+                               self._key_blocks_output._size_compressed)
         preamble_checksum = struct.pack(b">L", zlib.adler32(preamble))
 
         f.write(preamble)
@@ -230,30 +548,46 @@ class MDictWriter(object):
 
         f.write(key_index_comp)
 
-        f.write(key_block_body_header)
-
-    def write_3_key_block_body_body(self):
-        raise Exception("error")
-
-    def write_4_record_preamble_and_block_body_header(self, f: BufferedWriter):
-        record_block_body_header = (struct.pack(b"<L", self._compression_type) +
-                                    struct.pack(b">L", self._record_block_body_body_checksum & 0xffffffff))
+    def write_3_key_blocks(self, f: BufferedWriter):
+        _copy_file(self._key_blocks_output._output, f)
 
-        record_index_decomp = struct.pack(b">QQ",
-                                          len(record_block_body_header) +
-                                          self._record_block_body_body_output._size_compressed,
-                                          self._record_block_body_body_output._size)
+    def write_4_record_preamble_and_index(self, f: BufferedWriter):
+        record_index_decomp = b"".join(
+            struct.pack(b">QQ", size_compressed, size)
+            for size_compressed, size in self._record_blocks_output._blocks
+        )
 
         preamble = struct.pack(b">QQQQ",
-                               1,  # len(self._record_blocks),
+                               len(self._record_blocks_output._blocks),
                                self._num_entries,
                                len(record_index_decomp),
-                               len(record_block_body_header) +
-                               self._record_block_body_body_output._size_compressed)
+                               self._record_blocks_output._size_compressed)
 
         f.write(preamble)
         f.write(record_index_decomp)
-        f.write(record_block_body_header)
 
-    def write_5_record_block_body_body(self):
-        raise Exception("error")
+    def write_5_record_blocks(self, f: BufferedWriter, records):
+        if self._compress_threads > 1:
+            with ThreadPoolExecutor(self._compress_threads) as executor:
+                self._record_blocks_output = BlockWriter(
+                    f, *self._record_compression, executor=executor, max_pending=2 * self._compress_threads)
+                self._write_record_blocks(records)
+        else:
+            self._record_blocks_output = BlockWriter(f, *self._record_compression)
+            self._write_record_blocks(records)
+        if [size for _, size in self._record_blocks_output._blocks] != self._record_block_sizes:
+            raise ParameterError("The records differ from the ones added")
+
+    def _write_record_blocks(self, records):
+        for i, record in enumerate(records):
+            record_null = self._record_null(record)
+            if self._dedup and self._shared[i]:
+                first_key = self._record_keys[xxhash.xxh3_128_digest(record_null)][0]
+                record_null = LINK + first_key + b"\0"
+            if isinstance(record_null, FileRecord):
+                self._record_blocks_output.write_chunks(record_null.chunks(), self._block_size)
+            else:
+                self._record_blocks_output.write(record_null)
+            if len(self._record_blocks_output) >= self._block_size:
+                self._record_blocks_output.flush_block()
+        self._record_blocks_output.finish()